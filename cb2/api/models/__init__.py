@@ -1,11 +1,19 @@
 from .base import db, ma
 from .cb_instance import CBInstance, Agent, cb_instance_schema, cb_instances_schema, agent_schema, agents_schema
 from .audit_log import AuditLog, AuditActions
+from .sync_job import SyncJob
+from .license_snapshot import LicenseSnapshot
+from .agent_rollup import AgentStatusRollup
+from .audit_rollup import AuditLogRollup
 
 # Export all models and schemas
 __all__ = [
     'db', 'ma',
     'CBInstance', 'Agent', 'cb_instance_schema', 'cb_instances_schema', 
     'agent_schema', 'agents_schema',
-    'AuditLog', 'AuditActions'
+    'AuditLog', 'AuditActions',
+    'SyncJob',
+    'LicenseSnapshot',
+    'AgentStatusRollup',
+    'AuditLogRollup'
 ] 
\ No newline at end of file
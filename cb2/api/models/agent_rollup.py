@@ -0,0 +1,28 @@
+from datetime import datetime
+from . import db
+
+class AgentStatusRollup(db.Model):
+    """Model for point-in-time agent counts, bucketed by hour or day.
+
+    Each row counts an instance's agents with one combination of OS, status
+    and sensor version as of the last sync in its bucket.
+    """
+    __tablename__ = 'agent_status_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket', 'instance_id', 'os', 'status', 'sensor_version',
+                            name='uq_agent_status_rollup'),
+        db.Index('ix_agent_status_rollups_bucket', 'granularity', 'bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(8), nullable=False)  # hour, day
+    bucket = db.Column(db.DateTime, nullable=False)  # UTC start of the hour or day
+    instance_id = db.Column(db.String(50), nullable=False)
+    os = db.Column(db.String(50), nullable=False, default='Unknown')
+    status = db.Column(db.String(50), nullable=False, default='Unknown')
+    sensor_version = db.Column(db.String(100), nullable=False, default='Unknown')
+    agent_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AgentStatusRollup {self.granularity} {self.bucket} {self.instance_id}: {self.agent_count}>'
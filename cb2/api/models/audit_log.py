@@ -29,9 +29,21 @@ class AuditLog(db.Model):
     
     @classmethod
     def log_action(cls, action, resource_type=None, resource_id=None, 
-                  details=None, ip_address=None, user_agent=None, status="success", user_id=None):
-        """Create and save a new audit log entry."""
-        log = cls(
+                  details=None, ip_address=None, user_agent=None, status="success", user_id=None,
+                  sync=False):
+        """Record a new audit log entry.
+        
+        The entry is handed to the buffered audit writer and written in the
+        background, outside the caller's session and transaction. Pass
+        sync=True when the entry must be stored before returning.
+        
+        Returns:
+            AuditLog: Detached entry; its id is only set for synchronous writes
+        """
+        from ..utils.audit_writer import audit_writer
+        
+        event = audit_writer.write(
+            sync=sync,
             user_id=user_id,
             action=action,
             resource_type=resource_type,
@@ -41,18 +53,22 @@ class AuditLog(db.Model):
             user_agent=user_agent,
             status=status
         )
-        db.session.add(log)
-        db.session.commit()
+        log = cls(**{column: event[column] for column in
+                     ('user_id', 'action', 'resource_type', 'resource_id', 'details',
+                      'ip_address', 'user_agent', 'status')})
+        log.id = event.get('id')
+        log.timestamp = event['timestamp']
         return log
     
     @classmethod
-    def log_system_action(cls, action, details=None, status="success"):
+    def log_system_action(cls, action, details=None, status="success", sync=False):
         """Log system-level actions."""
         return cls.log_action(
             action=action,
             resource_type='system',
             details=details,
-            status=status
+            status=status,
+            sync=sync
         )
     
     def to_dict(self):
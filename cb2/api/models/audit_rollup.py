@@ -0,0 +1,23 @@
+from . import db
+
+class AuditLogRollup(db.Model):
+    """Model for hourly audit log counts.
+
+    Each row counts the audit logs of one hour with one combination of
+    action, resource type and status. Logs without a resource type are
+    counted under an empty resource type.
+    """
+    __tablename__ = 'audit_log_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('hour', 'action', 'resource_type', 'status', name='uq_audit_log_rollup'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, nullable=False)  # UTC start of the hour
+    action = db.Column(db.String(64), nullable=False)
+    resource_type = db.Column(db.String(64), nullable=False, default='')
+    status = db.Column(db.String(32), nullable=False, default='success')
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<AuditLogRollup {self.hour} {self.action} {self.resource_type} {self.status}: {self.count}>'
@@ -17,11 +17,14 @@ class CBInstance(db.Model, BaseModel):
     connection_status = db.Column(db.String(50), default='offline')
     last_checked = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
     sensors = db.Column(db.Integer, default=0)
+    sensors_counted_at = db.Column(db.DateTime(timezone=True), nullable=True)  # When sensors was last counted exactly
     version = db.Column(db.String(100), default='Unknown')
     connection_message = db.Column(db.Text, default='')
     created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
     updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
     server_type = db.Column(db.String(50), default='response')
+    sync_watermark = db.Column(db.DateTime(timezone=True), nullable=True)  # Newest sensor check-in synced
+    last_full_sync = db.Column(db.DateTime(timezone=True), nullable=True)
     
     # Relationships
     agents = db.relationship('Agent', backref='instance', lazy=True, cascade='all, delete-orphan')
@@ -63,6 +66,18 @@ class CBInstance(db.Model, BaseModel):
 class Agent(db.Model, BaseModel):
     """Model for Carbon Black agents/sensors."""
     __tablename__ = 'agents'
+    __table_args__ = (
+        # Per-instance keyset pages, sync preloads and per-sensor lookups
+        db.Index('ix_agents_instance_id_id', 'instance_id', 'id'),
+        # Status filters and dashboard status counts within an instance
+        db.Index('ix_agents_instance_id_status', 'instance_id', 'status'),
+        # hostname/os/version sorts and the os/version equality filters
+        db.Index('ix_agents_hostname_instance_id_id', 'hostname', 'instance_id', 'id'),
+        db.Index('ix_agents_os_instance_id_id', 'os', 'instance_id', 'id'),
+        db.Index('ix_agents_version_instance_id_id', 'version', 'instance_id', 'id'),
+        # Group membership filter (groups @> ARRAY[...]), PostgreSQL only
+        db.Index('ix_agents_groups', 'groups', postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
 
     # Override BaseModel id to match existing schema
     id = db.Column(db.String(50), primary_key=True)
@@ -73,7 +88,8 @@ class Agent(db.Model, BaseModel):
     version = db.Column(db.String(100), nullable=False)
     last_check_in = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
     status = db.Column(db.String(50), default='offline')
-    groups = db.Column(db.ARRAY(db.Text), default=[])
+    # A text[] on PostgreSQL; SQLite (the testing config) stores a JSON list
+    groups = db.Column(db.ARRAY(db.Text).with_variant(db.JSON, 'sqlite'), default=[])
     created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
     updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -0,0 +1,45 @@
+import json
+from datetime import datetime
+from . import db
+
+class LicenseSnapshot(db.Model):
+    """Model for the last license data fetched from a Carbon Black instance."""
+    __tablename__ = 'license_snapshots'
+
+    instance_id = db.Column(db.String(50), db.ForeignKey('instances.id', ondelete='CASCADE'), primary_key=True)
+    license_data = db.Column(db.Text)  # JSON encoded raw license payload
+    events = db.Column(db.Text)  # JSON encoded license-limit events
+    agents = db.Column(db.Text, nullable=True)  # JSON encoded agent list, only kept once requested
+    fetched_at = db.Column(db.DateTime, nullable=True)  # Last successful license fetch
+    last_error = db.Column(db.Text, nullable=True)
+    last_attempt_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def age(self):
+        """Seconds since the license data was fetched, or None if it never was."""
+        if not self.fetched_at:
+            return None
+        return (datetime.utcnow() - self.fetched_at).total_seconds()
+
+    def get_license_data(self):
+        return json.loads(self.license_data) if self.license_data else {}
+
+    def get_events(self):
+        return json.loads(self.events) if self.events else []
+
+    def get_agents(self):
+        return json.loads(self.agents) if self.agents is not None else None
+
+    def to_dict(self):
+        """Convert snapshot metadata to dictionary."""
+        return {
+            'instance_id': self.instance_id,
+            'fetched_at': self.fetched_at.isoformat() if self.fetched_at else None,
+            'age': round(self.age, 1) if self.age is not None else None,
+            'last_error': self.last_error,
+            'last_attempt_at': self.last_attempt_at.isoformat() if self.last_attempt_at else None
+        }
+
+    def __repr__(self):
+        return f'<LicenseSnapshot {self.instance_id} {self.fetched_at}>'
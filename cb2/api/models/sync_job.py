@@ -0,0 +1,94 @@
+import json
+from datetime import datetime, timedelta
+from . import db
+
+class SyncJob(db.Model):
+    """Model for background agent sync jobs."""
+    __tablename__ = 'sync_jobs'
+
+    id = db.Column(db.String(36), primary_key=True)
+    job_type = db.Column(db.String(32), nullable=False)  # sync_all, sync_instance, sync_agent
+    dedupe_key = db.Column(db.String(255), index=True)
+    instance_id = db.Column(db.String(50), nullable=True)
+    status = db.Column(db.String(32), default='queued', index=True)  # queued, running, completed, failed
+    sensors_processed = db.Column(db.Integer, default=0)
+    rows_written = db.Column(db.Integer, default=0)
+    instances_total = db.Column(db.Integer, default=0)
+    instances_done = db.Column(db.Integer, default=0)
+    message = db.Column(db.Text, default='')
+    results = db.Column(db.Text)  # JSON encoded list of per-instance results
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    ACTIVE_STATUSES = ('queued', 'running')
+
+    # At most one queued or running job per dedupe key, across all workers
+    __table_args__ = (
+        db.Index('uq_sync_jobs_active_dedupe_key', 'dedupe_key', unique=True,
+                 postgresql_where=status.in_(ACTIVE_STATUSES),
+                 sqlite_where=status.in_(ACTIVE_STATUSES)),
+    )
+
+    @property
+    def is_active(self):
+        """Whether the job is still queued or running."""
+        return self.status in self.ACTIVE_STATUSES
+
+    @property
+    def elapsed(self):
+        """Seconds the job has been running, or ran for if finished."""
+        if not self.started_at:
+            return 0
+        end = self.finished_at or datetime.utcnow()
+        return round((end - self.started_at).total_seconds(), 3)
+
+    @classmethod
+    def find_active(cls, dedupe_key):
+        """Find the queued or running job with a dedupe key."""
+        return cls.query.filter(
+            cls.dedupe_key == dedupe_key,
+            cls.status.in_(cls.ACTIVE_STATUSES)
+        ).order_by(cls.created_at.desc()).first()
+
+    @classmethod
+    def expire_stale(cls, dedupe_key, stale_after):
+        """Fail active jobs with a dedupe key that stopped reporting progress.
+
+        Jobs that have not reported progress for ``stale_after`` seconds are
+        assumed to belong to a worker that died, and would otherwise hold
+        their dedupe key forever. The caller commits.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+        return cls.query.filter(
+            cls.dedupe_key == dedupe_key,
+            cls.status.in_(cls.ACTIVE_STATUSES),
+            cls.updated_at < cutoff
+        ).update({
+            cls.status: 'failed',
+            cls.message: 'Sync job stopped reporting progress',
+            cls.finished_at: datetime.utcnow()
+        }, synchronize_session=False)
+
+    def to_dict(self):
+        """Convert sync job to dictionary."""
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'instance_id': self.instance_id,
+            'status': self.status,
+            'sensors_processed': self.sensors_processed,
+            'rows_written': self.rows_written,
+            'instances_total': self.instances_total,
+            'instances_done': self.instances_done,
+            'elapsed': self.elapsed,
+            'message': self.message,
+            'results': json.loads(self.results) if self.results else [],
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    def __repr__(self):
+        return f'<SyncJob {self.id}: {self.job_type} {self.status}>'
@@ -1,20 +1,48 @@
+import math
+from datetime import datetime, timedelta, timezone
+from dateutil import parser as date_parser
 from flask import Blueprint, jsonify, request, current_app
 from werkzeug.exceptions import Forbidden
-from sqlalchemy import desc
-from ..models import db
+from sqlalchemy import desc, func
+from ..models import db, AuditLogRollup
 from ..models.audit_log import AuditLog
+from ..utils.agent_rollups import hour_bucket
+from ..utils.pagination import CursorError, paginate_keyset, parse_limit, estimate_count
 
 audit_bp = Blueprint('audit', __name__, url_prefix='/api/audit')
 
+# Audit logs are paged newest first on (timestamp, id), served by the timestamp index
+AUDIT_SORT = '-timestamp'
+AUDIT_KEYSET = [AuditLog.timestamp, AuditLog.id]
+
+def flag(value):
+    """Whether a query string flag such as ?estimate=1 is set."""
+    return str(value or '').lower() in ('1', 'true', 'yes')
+
+def parse_utc(value):
+    """Parse a date string into a naive UTC datetime, as audit timestamps are stored."""
+    parsed = date_parser.parse(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
 @audit_bp.route('/', methods=['GET'])
 def get_audit_logs():
-    """Get audit logs with filtering options."""
+    """Get audit logs with filtering options, newest first.
+    
+    Pages are addressed either by ``page`` and ``per_page`` (OFFSET based,
+    kept for compatibility) or, when ``cursor`` is given, by keyset on
+    (timestamp, id) so that every page costs the same as the first. Each
+    response carries a ``next_cursor`` for the page that follows it.
+    In page mode ``total_items`` is an exact count, or a cheaper planner
+    estimate on PostgreSQL with ``estimate=1``. In cursor mode it is only
+    computed with ``include_total=1``, and is always an estimate.
+    """
     try:
         # Pagination parameters
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)  # Default to 50 logs per page
-        max_per_page = 100  # Limit to 100 logs per page max
-        per_page = min(per_page, max_per_page)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = parse_limit(request.args.get('per_page'), default=50, maximum=100)
+        cursor = request.args.get('cursor')
         
         # Filter parameters
         user_id = request.args.get('user_id', type=int)
@@ -49,15 +77,38 @@ def get_audit_logs():
         if status:
             query = query.filter(AuditLog.status == status)
         
-        # Order by timestamp (newest first)
-        query = query.order_by(desc(AuditLog.timestamp))
-        
-        # Paginate the results
-        logs_page = query.paginate(page=page, per_page=per_page, error_out=False)
+        pagination = {'per_page': per_page}
+        
+        if cursor:
+            count_mode = 'estimate' if flag(request.args.get('include_total')) else None
+        else:
+            count_mode = 'estimate' if flag(request.args.get('estimate')) else 'exact'
+        
+        if count_mode:
+            if count_mode == 'estimate':
+                total, estimated = estimate_count(query)
+            else:
+                total, estimated = query.order_by(None).count(), False
+            pagination.update({
+                'total_pages': math.ceil(total / per_page),
+                'total_items': total,
+                'total_estimated': estimated
+            })
+        
+        if cursor:
+            # Seek past the cursor on (timestamp, id), newest first
+            log_rows, next_cursor = paginate_keyset(query, AUDIT_KEYSET, AUDIT_SORT, per_page, cursor,
+                                                    descending=True)
+        else:
+            pagination['page'] = page
+            log_rows, next_cursor = paginate_keyset(query, AUDIT_KEYSET, AUDIT_SORT, per_page,
+                                                    descending=True, offset=(page - 1) * per_page)
+        
+        pagination.update({'next_cursor': next_cursor, 'has_more': next_cursor is not None})
         
         # Convert logs to dicts
         logs = []
-        for log in logs_page.items:
+        for log in log_rows:
             log_dict = log.to_dict()
             log_dict['username'] = 'System'  # Default username since we don't have users
             logs.append(log_dict)
@@ -65,13 +116,13 @@ def get_audit_logs():
         return jsonify({
             'status': 'success',
             'data': logs,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total_pages': logs_page.pages,
-                'total_items': logs_page.total
-            }
+            'pagination': pagination
         })
+    except CursorError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
     except Exception as e:
         current_app.logger.error(f"Error retrieving audit logs: {str(e)}")
         return jsonify({
@@ -83,8 +134,8 @@ def get_audit_logs():
 def get_audit_actions():
     """Get a list of all possible audit actions."""
     try:
-        # Get all distinct actions from the database
-        actions = db.session.query(AuditLog.action).distinct().all()
+        # Distinct actions, from the hourly rollups rather than every log
+        actions = db.session.query(AuditLogRollup.action).distinct().all()
         action_list = [action[0] for action in actions]
         
         return jsonify({
@@ -102,9 +153,9 @@ def get_audit_actions():
 def get_resource_types():
     """Get a list of all resource types in audit logs."""
     try:
-        # Get all distinct resource types from the database
-        resource_types = db.session.query(AuditLog.resource_type).distinct().all()
-        resource_type_list = [rt[0] for rt in resource_types if rt[0]]  # Filter out None values
+        # Distinct resource types, from the hourly rollups rather than every log
+        resource_types = db.session.query(AuditLogRollup.resource_type).distinct().all()
+        resource_type_list = [rt[0] for rt in resource_types if rt[0]]  # Filter out logs without one
         
         return jsonify({
             'status': 'success',
@@ -119,52 +170,71 @@ def get_resource_types():
 
 @audit_bp.route('/stats', methods=['GET'])
 def get_audit_stats():
-    """Get statistics about audit logs."""
+    """Get statistics about audit logs.
+    
+    Counts come from the hourly audit_log_rollups, so they cost the same
+    however many logs there are. Optional ``start_date`` and ``end_date``
+    restrict them to a time range, rounded outwards to whole hours; the
+    24 hour activity count is likewise counted from the start of the hour.
+    """
     try:
+        in_range = []
+        try:
+            if request.args.get('start_date'):
+                in_range.append(AuditLogRollup.hour >= hour_bucket(parse_utc(request.args['start_date'])))
+            if request.args.get('end_date'):
+                in_range.append(AuditLogRollup.hour <= parse_utc(request.args['end_date']))
+        except (ValueError, OverflowError):
+            return jsonify({
+                'status': 'error',
+                'message': 'Invalid start_date or end_date'
+            }), 400
+        
+        log_count = func.coalesce(func.sum(AuditLogRollup.count), 0)
+        
         # Total number of logs
-        total_logs = AuditLog.query.count()
+        total_logs = db.session.query(log_count).filter(*in_range).scalar()
         
         # Recent activity (logs from the last 24 hours)
-        from datetime import datetime, timedelta
-        recent_logs = AuditLog.query.filter(
-            AuditLog.timestamp >= datetime.utcnow() - timedelta(days=1)
-        ).count()
+        recent_logs = db.session.query(log_count).filter(
+            AuditLogRollup.hour >= hour_bucket(datetime.utcnow() - timedelta(days=1))
+        ).scalar()
         
         # Most common actions
-        from sqlalchemy import func
         action_counts = db.session.query(
-            AuditLog.action,
-            func.count(AuditLog.id).label('action_count')
-        ).group_by(AuditLog.action)\
+            AuditLogRollup.action,
+            func.sum(AuditLogRollup.count).label('action_count')
+        ).filter(*in_range)\
+            .group_by(AuditLogRollup.action)\
             .order_by(desc('action_count'))\
             .limit(5)\
             .all()
         
         common_actions = [
-            {'action': action, 'count': count}
+            {'action': action, 'count': int(count)}
             for action, count in action_counts
         ]
         
         # Most affected resources
         resource_counts = db.session.query(
-            AuditLog.resource_type,
-            func.count(AuditLog.id).label('resource_count')
-        ).filter(AuditLog.resource_type.isnot(None))\
-            .group_by(AuditLog.resource_type)\
+            AuditLogRollup.resource_type,
+            func.sum(AuditLogRollup.count).label('resource_count')
+        ).filter(AuditLogRollup.resource_type != '', *in_range)\
+            .group_by(AuditLogRollup.resource_type)\
             .order_by(desc('resource_count'))\
             .limit(5)\
             .all()
         
         common_resources = [
-            {'resource_type': resource_type, 'count': count}
+            {'resource_type': resource_type, 'count': int(count)}
             for resource_type, count in resource_counts
         ]
         
         return jsonify({
             'status': 'success',
             'data': {
-                'total_logs': total_logs,
-                'recent_logs': recent_logs,
+                'total_logs': int(total_logs),
+                'recent_logs': int(recent_logs),
                 'common_actions': common_actions,
                 'common_resources': common_resources
             }
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify, current_app, Response
-from ..models import db, CBInstance, cb_instance_schema, cb_instances_schema
-from ..utils import CBAPIHelper
+from ..models import db, CBInstance, AgentStatusRollup, cb_instance_schema, cb_instances_schema
+from ..utils import CBAPIHelper, sync_jobs, cb_clients, license_snapshots, invalidate_agent_caches, health_probe, cbapi_cache
+from .job_routes import job_accepted_response
 import logging
 import uuid
 import csv
@@ -27,6 +28,7 @@ def get_instances():
                 'api_base_url': instance.api_base_url,
                 'connection_status': instance.connection_status,
                 'sensors': instance.sensors,
+                'sensors_counted_at': instance.sensors_counted_at.isoformat() if instance.sensors_counted_at else None,
                 'version': instance.version,
                 'connection_message': instance.connection_message,
                 'is_active': instance.is_active,
@@ -63,6 +65,7 @@ def get_instance(instance_id):
             'api_base_url': instance.api_base_url,
             'connection_status': instance.connection_status,
             'sensors': instance.sensors,
+            'sensors_counted_at': instance.sensors_counted_at.isoformat() if instance.sensors_counted_at else None,
             'version': instance.version,
             'connection_message': instance.connection_message,
             'is_active': instance.is_active,
@@ -137,6 +140,7 @@ def create_instance():
         
         db.session.add(instance)
         db.session.commit()
+        invalidate_agent_caches()
         
         return jsonify({
             'success': True,
@@ -212,8 +216,17 @@ def update_instance(instance_id):
             instance.connection_message = connection_result.get('message', '')
             instance.version = connection_result.get('version', '')
         
+        # Cached license data may belong to the old server
+        if 'api_base_url' in data or 'server_type' in data:
+            license_snapshots.invalidate(instance_id)
+        
         db.session.commit()
         
+        # Drop the cached API client so the next call picks up new settings
+        cb_clients.evict(instance_id)
+        cbapi_cache.invalidate_instance(instance_id)
+        invalidate_agent_caches()
+        
         return jsonify({
             'success': True,
             'message': f"Instance {instance.name} updated successfully",
@@ -249,8 +262,13 @@ def delete_instance(instance_id):
                 'message': f"Instance {instance_id} not found"
             }), 404
         
+        license_snapshots.invalidate(instance_id)
+        AgentStatusRollup.query.filter_by(instance_id=instance_id).delete()
         db.session.delete(instance)
         db.session.commit()
+        cb_clients.evict(instance_id)
+        cbapi_cache.invalidate_instance(instance_id)
+        invalidate_agent_caches()
         
         return jsonify({
             'success': True,
@@ -263,6 +281,57 @@ def delete_instance(instance_id):
             'message': f"Error deleting instance: {str(e)}"
         }), 500
 
+@cb_instance_bp.route('/<instance_id>/sync', methods=['POST'])
+def sync_instance(instance_id):
+    """Sync agents for a CB instance as a background job."""
+    try:
+        instance = CBInstance.query.get(instance_id)
+        
+        if not instance:
+            return jsonify({
+                'success': False,
+                'message': f"Instance {instance_id} not found"
+            }), 404
+        
+        mode = request.args.get('mode', 'auto')
+        if mode not in ['auto', 'full', 'incremental']:
+            return jsonify({
+                'success': False,
+                'message': f"Invalid sync mode: {mode}"
+            }), 400
+        
+        job, created = sync_jobs.start_instance_sync(instance.id, mode)
+        return job_accepted_response(job, created)
+    except Exception as e:
+        current_app.logger.error(f"Error starting sync for instance {instance_id}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f"Error starting sync: {str(e)}"
+        }), 500
+
+@cb_instance_bp.route('/probe', methods=['POST'])
+def probe_instances():
+    """Probe the connection of all active instances now.
+    
+    Instances are probed concurrently and their connection status is
+    stored, as the scheduled health probe does. Pass ``instance_ids`` in
+    the JSON body to probe specific instances.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        results = health_probe.probe_all(data.get('instance_ids'))
+        
+        return jsonify({
+            'success': True,
+            'data': results
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error probing instances: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f"Error probing instances: {str(e)}"
+        }), 500
+
 @cb_instance_bp.route('/test-connection', methods=['POST'])
 def test_connection():
     """Test connection to a CB instance."""
@@ -396,6 +465,7 @@ def import_instances_from_csv():
         
         # Commit all changes
         db.session.commit()
+        invalidate_agent_caches()
         
         return jsonify({
             'success': True,
@@ -1,12 +1,41 @@
-from flask import Blueprint, request, jsonify
+import json
+from urllib.parse import urlencode
+from cbapi.errors import ServerError
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from ..models import db, CBInstance, Agent
 from ..utils.cb_api_helper import CBAPIHelper
+from ..utils.fanout import fan_out
+from ..utils.license_snapshots import license_snapshots, fresh_requested
+from ..utils.passthrough_cache import cbapi_cache, bypass_mode
 
 cbapi_bp = Blueprint('cbapi', __name__, url_prefix='/api/cbapi')
 
+# HTTP methods the passthrough forwards
+PASSTHROUGH_METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+
+# Defaults used when the app does not configure batch execution
+DEFAULT_BATCH_MAX_ITEMS = 500
+DEFAULT_BATCH_WORKERS = 8
+DEFAULT_BATCH_TIMEOUT = 30
+
+# Shortest per-item timeout a batch may ask for, in seconds
+MIN_BATCH_TIMEOUT = 1
+
+# Largest page requested from the server when streaming, unless configured
+DEFAULT_STREAM_PAGE_SIZE = 500
+
+class NotPaginatedError(Exception):
+    """Raised when a streamed endpoint does not return a page of search results."""
+
 @cbapi_bp.route('/execute', methods=['POST'])
 def execute_api_action():
-    """Execute a Carbon Black API action."""
+    """Execute a Carbon Black API action.
+    
+    GET requests are served through the passthrough cache; the X-Cache
+    response header says whether it was a HIT, MISS or BYPASS. Send
+    ``Cache-Control: no-cache`` or ``X-Cache-Bypass: 1`` to refetch, or
+    ``Cache-Control: no-store`` to skip the cache.
+    """
     data = request.get_json()
     
     if not data:
@@ -45,20 +74,23 @@ def execute_api_action():
     
     # Execute the API action
     try:
-        result = execute_cb_api_action(
+        result, cache_status = run_cb_api_action(
             cb_api, 
             instance,
             data['action'],
             data['method'],
             data['endpoint'],
             data.get('params', {}),
-            data.get('body', {})
+            data.get('body', {}),
+            bypass=bypass_mode(request.headers)
         )
         
-        return jsonify({
+        response = jsonify({
             'success': True,
             'data': result
-        }), 200
+        })
+        response.headers['X-Cache'] = cache_status
+        return response, 200
         
     except Exception as e:
         return jsonify({
@@ -66,6 +98,320 @@ def execute_api_action():
             'message': f'Error executing API action: {str(e)}'
         }), 500
 
+@cbapi_bp.route('/execute-batch', methods=['POST'])
+def execute_api_batch():
+    """Execute Carbon Black API actions on many instances concurrently.
+    
+    The body holds either ``items``, a list of ``{instance_id, method,
+    endpoint, params, body}`` objects, or one ``method``/``endpoint``
+    (with optional ``action``, ``params`` and ``body``) plus an instance
+    selector: ``instance_ids`` (a list, or ``"all"``, the default, for
+    every active instance) and an optional ``server_type``.
+    
+    Items run on at most CBAPI_BATCH_WORKERS threads (``max_workers`` can
+    lower that) and each gets ``timeout`` seconds, at least
+    MIN_BATCH_TIMEOUT and at most CBAPI_BATCH_TIMEOUT. Results are streamed as NDJSON, one line per item
+    as soon as it completes, followed by a summary line. GET items go
+    through the passthrough cache and honour its bypass headers. Failed
+    items carry the upstream ``status_code`` when the server returned one.
+    """
+    data = request.get_json(silent=True)
+    
+    if not data:
+        return jsonify({
+            'success': False,
+            'message': 'No data provided'
+        }), 400
+    
+    try:
+        items = batch_items(data)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    max_items = current_app.config.get('CBAPI_BATCH_MAX_ITEMS', DEFAULT_BATCH_MAX_ITEMS)
+    if len(items) > max_items:
+        return jsonify({
+            'success': False,
+            'message': f'Too many items: {len(items)} (at most {max_items})'
+        }), 400
+    
+    max_timeout = current_app.config.get('CBAPI_BATCH_TIMEOUT', DEFAULT_BATCH_TIMEOUT)
+    max_workers = current_app.config.get('CBAPI_BATCH_WORKERS', DEFAULT_BATCH_WORKERS)
+    try:
+        timeout = max(MIN_BATCH_TIMEOUT, min(float(data.get('timeout') or max_timeout), max_timeout))
+        max_workers = max(1, min(int(data.get('max_workers') or max_workers), max_workers))
+    except (TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'message': 'timeout and max_workers must be numbers'
+        }), 400
+    
+    ids = {item['instance_id'] for item in items}
+    instances = {instance.id: instance for instance in CBInstance.query.filter(CBInstance.id.in_(ids)).all()}
+    bypass = bypass_mode(request.headers)
+    
+    def run_item(item):
+        instance = instances[item['instance_id']]
+        cb_api = CBAPIHelper.get_cb_api(instance)
+        if not cb_api:
+            raise Exception('Failed to initialize CB API')
+        return run_cb_api_action(cb_api, instance, item['action'], item['method'], item['endpoint'],
+                                 item['params'], item['body'], bypass=bypass)
+    
+    def generate():
+        summary = {'total': len(items), 'succeeded': 0, 'failed': 0, 'timed_out': 0}
+        runnable = []
+        
+        for item in items:
+            if item['instance_id'] in instances:
+                runnable.append(item)
+                continue
+            summary['failed'] += 1
+            yield json.dumps(batch_result(item, success=False, message='Instance not found')) + '\n'
+        
+        for outcome in fan_out(run_item, runnable, max_workers, timeout):
+            item = outcome.item
+            instance = instances[item['instance_id']]
+            if outcome.timed_out:
+                summary['timed_out'] += 1
+                result = batch_result(item, instance, success=False, timed_out=True,
+                                      message=f'Timed out after {timeout} seconds')
+            elif outcome.error is not None:
+                summary['failed'] += 1
+                result = batch_result(item, instance, success=False,
+                                      message=f'Error executing API action: {str(outcome.error)}')
+                status_code = getattr(outcome.error.__cause__, 'error_code', None)
+                if isinstance(status_code, int):
+                    result['status_code'] = status_code
+            else:
+                summary['succeeded'] += 1
+                response, cache_status = outcome.value
+                result = batch_result(item, instance, success=True, data=response, cache=cache_status)
+            result['elapsed'] = outcome.elapsed
+            yield json.dumps(result, default=str) + '\n'
+        
+        yield json.dumps({'summary': summary}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@cbapi_bp.route('/execute-stream', methods=['POST'])
+def execute_api_stream():
+    """Stream the results of a paginated Carbon Black GET query as NDJSON.
+    
+    Takes ``instance_id``, ``endpoint`` and ``params`` like /execute, plus
+    optional ``page_size`` (capped by CBAPI_STREAM_PAGE_SIZE) and
+    ``max_rows``. The server is paged with start/rows (offset/limit on CB
+    Protection) and every result row is written as one NDJSON line,
+    followed by a summary line. Endpoints that do not return search
+    results are rejected with 400. A failure after streaming started is
+    reported as a final ``{"error": ...}`` line.
+    
+    Only one page is held in memory at a time. The next page is fetched
+    only once the previous one has been handed to the client, so a slow
+    client slows down paging and a disconnected one stops it. Results are
+    not cached.
+    """
+    data = request.get_json(silent=True)
+    
+    if not data:
+        return jsonify({
+            'success': False,
+            'message': 'No data provided'
+        }), 400
+    
+    for field in ('instance_id', 'endpoint'):
+        if field not in data:
+            return jsonify({
+                'success': False,
+                'message': f'Missing required field: {field}'
+            }), 400
+    
+    max_page_size = current_app.config.get('CBAPI_STREAM_PAGE_SIZE', DEFAULT_STREAM_PAGE_SIZE)
+    try:
+        page_size = max(1, min(int(data.get('page_size') or max_page_size), max_page_size))
+        max_rows = int(data['max_rows']) if 'max_rows' in data and data['max_rows'] is not None else None
+    except (TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'message': 'page_size and max_rows must be integers'
+        }), 400
+    
+    if max_rows is not None and max_rows < 1:
+        return jsonify({
+            'success': False,
+            'message': 'max_rows must be at least 1'
+        }), 400
+    
+    instance = CBInstance.query.get(data['instance_id'])
+    
+    if not instance:
+        return jsonify({
+            'success': False,
+            'message': 'Instance not found'
+        }), 404
+    
+    cb_api = CBAPIHelper.get_cb_api(instance)
+    
+    if not cb_api:
+        return jsonify({
+            'success': False,
+            'message': 'Failed to initialize CB API'
+        }), 500
+    
+    pages = iter_cb_api_pages(cb_api, instance, data.get('action', 'stream'), data['endpoint'],
+                              data.get('params') or {}, page_size, max_rows)
+    
+    # Fetch the first page now, so an upstream error still gets an error status
+    try:
+        first_page = next(pages, None)
+    except NotPaginatedError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error executing API action: {str(e)}'
+        }), 500
+    
+    def generate():
+        summary = {'rows': 0, 'pages': 0, 'total_results': None, 'complete': False}
+        page = first_page
+        try:
+            while page is not None:
+                rows, total = page
+                summary['pages'] += 1
+                summary['rows'] += len(rows)
+                summary['total_results'] = total
+                if rows:
+                    yield ''.join(json.dumps(row, default=str) + '\n' for row in rows)
+                page = next(pages, None)
+            summary['complete'] = True
+        except Exception as e:
+            current_app.logger.error(f"Error streaming {data['endpoint']} from {instance.name}: {str(e)}")
+            yield json.dumps({'error': f'Error executing API action: {str(e)}'}) + '\n'
+        finally:
+            pages.close()
+        yield json.dumps({'summary': summary}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def iter_cb_api_pages(cb_api, instance, action, endpoint, params, page_size, max_rows=None):
+    """Page through a Carbon Black search endpoint, one request per page.
+    
+    CB Response searches take start/rows and return ``results`` with
+    ``total_results``; CB Protection takes offset/limit and returns a list.
+    A ``start`` in params sets the first row.
+    
+    Yields:
+        tuple: (rows, total_results) per page; total_results is None when
+        the server does not report it
+    
+    Raises:
+        NotPaginatedError: If the endpoint does not return search results
+    """
+    response_api = (instance.server_type or 'response').lower() == 'response'
+    params = dict(params)
+    start = int(params.pop('start', None) or params.pop('offset', None) or 0)
+    for name in ('rows', 'limit'):
+        params.pop(name, None)
+    fetched = 0
+    
+    while max_rows is None or fetched < max_rows:
+        rows_wanted = page_size if max_rows is None else min(page_size, max_rows - fetched)
+        if response_api:
+            page_params = dict(params, start=start, rows=rows_wanted)
+        else:
+            page_params = dict(params, offset=start, limit=rows_wanted)
+        
+        result = execute_cb_api_action(cb_api, instance, action, 'GET', endpoint, page_params, None)
+        
+        if response_api and isinstance(result, dict) and isinstance(result.get('results'), list):
+            rows = result['results']
+            total = result.get('total_results')
+        elif not response_api and isinstance(result, list):
+            rows = result
+            total = None
+        else:
+            raise NotPaginatedError(f"{endpoint} does not return paginated search results")
+        
+        yield rows, total
+        
+        fetched += len(rows)
+        start += len(rows)
+        if len(rows) < rows_wanted or (total is not None and start >= total):
+            return
+
+def batch_items(data):
+    """Expand an execute-batch request body into a list of items.
+    
+    Returns:
+        list: Dicts with index, instance_id, action, method, endpoint, params and body
+        
+    Raises:
+        ValueError: If the body is malformed
+    """
+    if 'items' in data:
+        raw_items = data['items']
+        if not isinstance(raw_items, list) or not raw_items:
+            raise ValueError('items must be a non-empty list')
+    else:
+        for field in ('method', 'endpoint'):
+            if field not in data:
+                raise ValueError(f'Missing required field: {field}')
+        
+        selector = data.get('instance_ids', 'all')
+        if selector == 'all':
+            query = CBInstance.query.filter_by(is_active=True)
+            if data.get('server_type'):
+                query = query.filter(CBInstance.server_type == data['server_type'])
+            instance_ids = [instance_id for instance_id, in query.with_entities(CBInstance.id).all()]
+        elif isinstance(selector, list):
+            instance_ids = selector
+        else:
+            raise ValueError("instance_ids must be a list or 'all'")
+        
+        if not instance_ids:
+            raise ValueError('No instances selected')
+        raw_items = [dict(data, instance_id=instance_id) for instance_id in instance_ids]
+    
+    items = []
+    for index, raw in enumerate(raw_items):
+        if not isinstance(raw, dict):
+            raise ValueError(f'Item {index} must be an object')
+        for field in ('instance_id', 'method', 'endpoint'):
+            if not raw.get(field):
+                raise ValueError(f'Item {index}: missing required field: {field}')
+        method = str(raw['method']).upper()
+        if method not in PASSTHROUGH_METHODS:
+            raise ValueError(f'Item {index}: unsupported method: {raw["method"]}')
+        items.append({
+            'index': index,
+            'instance_id': str(raw['instance_id']),
+            'action': raw.get('action', 'batch'),
+            'method': method,
+            'endpoint': raw['endpoint'],
+            'params': raw.get('params') or {},
+            'body': raw.get('body') or {}
+        })
+    return items
+
+def batch_result(item, instance=None, **fields):
+    """One NDJSON line of an execute-batch response."""
+    result = {
+        'index': item['index'],
+        'instance_id': item['instance_id'],
+        'instance_name': instance.name if instance else None,
+        'method': item['method'],
+        'endpoint': item['endpoint']
+    }
+    result.update(fields)
+    return result
+
 @cbapi_bp.route('/agents', methods=['GET'])
 def get_agents():
     """Get agents from a Carbon Black instance."""
@@ -417,125 +763,18 @@ def get_threats():
 
 @cbapi_bp.route('/licenses', methods=['GET'])
 def get_licenses():
-    """Get license information for all instances."""
+    """Get license information for all instances.
+    
+    Shares the snapshot store and aggregation engine behind /api/licenses.
+    """
     try:
-        from datetime import datetime
-        from flask import current_app
-        
         # Get all instances
-        from cb2.api.models.instance import CBInstance
         instances = CBInstance.query.all()
-        license_info = []
-        total_seats = 0
-        used_seats = 0
-        dropped_connections = []
         
-        # Query each instance for license information
-        for instance in instances:
-            try:
-                # Initialize the CB API client
-                cb_api = CBAPIHelper.get_cb_api(instance)
-                
-                if not cb_api:
-                    current_app.logger.error(f"Failed to initialize CB API for instance {instance.name}")
-                    continue
-                
-                # Get license information based on server type
-                if instance.server_type.lower() == 'response':
-                    # For Carbon Black Response (EDR)
-                    license_data = cb_api._request('GET', '/api/v1/license')
-                    
-                    # Extract relevant license information
-                    instance_license = {
-                        'id': instance.id,
-                        'name': instance.name,
-                        'license_type': license_data.get('edr_license_type', 'Standard'),
-                        'seats_used': license_data.get('sensors_active', 0),
-                        'total_seats': license_data.get('sensors_maximum', 0),
-                        'start_date': license_data.get('license_valid_from'),
-                        'expiration_date': license_data.get('license_valid_to')
-                    }
-                    
-                    # Get dropped connections due to license issues (if available)
-                    try:
-                        # This endpoint might vary depending on CB Response version
-                        events = cb_api._request('GET', '/api/v1/sensor/events?q=license')
-                        if events and 'results' in events:
-                            for event in events['results']:
-                                if 'license' in event.get('description', '').lower():
-                                    dropped_connections.append({
-                                        'instance_id': instance.id,
-                                        'instance_name': instance.name,
-                                        'agent_id': event.get('sensor_id'),
-                                        'agent_hostname': event.get('hostname', 'Unknown'),
-                                        'timestamp': event.get('timestamp'),
-                                        'reason': event.get('description', 'License limit reached')
-                                    })
-                    except Exception as e:
-                        current_app.logger.error(f"Error getting dropped connections for {instance.name}: {str(e)}")
-                
-                else:  # 'protection'
-                    # For Carbon Black Protection (App Control)
-                    license_data = cb_api._request('GET', '/api/bit9platform/v1/license')
-                    
-                    # Extract relevant license information
-                    instance_license = {
-                        'id': instance.id,
-                        'name': instance.name,
-                        'license_type': license_data.get('type', 'Standard'),
-                        'seats_used': license_data.get('agentsUsed', 0),
-                        'total_seats': license_data.get('maxAgents', 0),
-                        'start_date': license_data.get('startDate'),
-                        'expiration_date': license_data.get('expirationDate')
-                    }
-                    
-                    # Get dropped connections due to license issues (if available)
-                    try:
-                        # This endpoint might vary depending on CB Protection version
-                        events = cb_api._request('GET', '/api/bit9platform/v1/events?q=licenseLimit')
-                        if events:
-                            for event in events:
-                                dropped_connections.append({
-                                    'instance_id': instance.id,
-                                    'instance_name': instance.name,
-                                    'agent_id': event.get('agentId'),
-                                    'agent_hostname': event.get('computerName', 'Unknown'),
-                                    'timestamp': event.get('timestamp'),
-                                    'reason': event.get('description', 'License limit reached')
-                                })
-                    except Exception as e:
-                        current_app.logger.error(f"Error getting dropped connections for {instance.name}: {str(e)}")
-                
-                # Add instance license info to the list
-                license_info.append(instance_license)
-                
-                # Add to totals
-                total_seats += instance_license['total_seats']
-                used_seats += instance_license['seats_used']
-                
-            except Exception as e:
-                current_app.logger.error(f"Error getting license information for instance {instance.name}: {str(e)}")
-                # Add a placeholder entry with error information
-                license_info.append({
-                    'id': instance.id,
-                    'name': instance.name,
-                    'license_type': 'Unknown',
-                    'seats_used': 0,
-                    'total_seats': 0,
-                    'start_date': None,
-                    'expiration_date': None,
-                    'error': str(e)
-                })
+        timeout = request.args.get('timeout', type=int)
+        result = license_snapshots.summary(instances, fresh=fresh_requested(request.args), timeout=timeout)
         
-        return jsonify({
-            'status': 'success',
-            'total_seats': total_seats,
-            'used_seats': used_seats,
-            'available_seats': total_seats - used_seats,
-            'dropped_connections_count': len(dropped_connections),
-            'instances': license_info,
-            'dropped_connections': dropped_connections
-        })
+        return jsonify(result)
         
     except Exception as e:
         current_app.logger.error(f"Error getting license information: {str(e)}")
@@ -660,30 +899,69 @@ def get_cb_audit_logs():
         }), 500
 
 def execute_cb_api_action(cb_api, instance, action, method, endpoint, params, body):
-    """Execute a Carbon Black API action."""
-    # This is a simplified implementation
-    # In a real implementation, this would handle various API endpoints
-    # and return the appropriate data
+    """Execute a Carbon Black API action through the cbapi client.
+    
+    GET requests use ``get_object``; POST, PUT and DELETE use the matching
+    ``post_object``, ``put_object`` and ``delete_object`` calls. Query
+    parameters are appended to the endpoint for every method.
     
+    Returns:
+        The parsed JSON response, the response text if it is not JSON, or
+        None for an empty response
+    """
     # Prepare the full endpoint
     full_endpoint = endpoint
     if not full_endpoint.startswith('/'):
         full_endpoint = '/' + full_endpoint
+    if params:
+        separator = '&' if '?' in full_endpoint else '?'
+        full_endpoint += separator + urlencode(sorted(params.items()), doseq=True)
     
     # Execute the API request based on the method
     try:
         if method == 'GET':
-            response = cb_api._request('GET', full_endpoint, params=params)
+            return cb_api.get_object(full_endpoint)
         elif method == 'POST':
-            response = cb_api._request('POST', full_endpoint, data=body)
+            response = cb_api.post_object(full_endpoint, body or {})
         elif method == 'PUT':
-            response = cb_api._request('PUT', full_endpoint, data=body)
+            response = cb_api.put_object(full_endpoint, body or {})
         elif method == 'DELETE':
-            response = cb_api._request('DELETE', full_endpoint)
+            response = cb_api.delete_object(full_endpoint)
         else:
             raise ValueError(f'Unsupported method: {method}')
         
-        return response
+        if response.status_code >= 400:
+            raise ServerError(error_code=response.status_code, message=response.text)
+        if not response.content:
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            return response.text
         
     except Exception as e:
-        raise Exception(f'Error executing API request: {str(e)}') 
\ No newline at end of file
+        raise Exception(f'Error executing API request: {str(e)}') from e
+
+def run_cb_api_action(cb_api, instance, action, method, endpoint, params, body, bypass=None):
+    """Execute a Carbon Black API action through the passthrough cache.
+    
+    GET requests are read through cbapi_cache. POST, PUT and DELETE
+    requests invalidate the cached reads of the resource they target, even
+    when they fail, since the server may have applied them anyway.
+    
+    Returns:
+        tuple: (response, cache status 'HIT', 'MISS' or 'BYPASS')
+    """
+    method = (method or '').upper()
+    
+    def fetch():
+        return execute_cb_api_action(cb_api, instance, action, method, endpoint, params, body)
+    
+    if method == 'GET':
+        return cbapi_cache.fetch(instance.id, endpoint, params, fetch, bypass)
+    
+    try:
+        return fetch(), 'BYPASS'
+    finally:
+        if method in ('POST', 'PUT', 'DELETE'):
+            cbapi_cache.invalidate_resource(instance.id, endpoint)
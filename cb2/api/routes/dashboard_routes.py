@@ -1,23 +1,60 @@
 from flask import Blueprint, request, jsonify
-from ..models import db, CBInstance, Agent
+from ..models import db, CBInstance, Agent, SyncJob
 from ..utils.cb_api_helper import CBAPIHelper
+from ..utils.dashboard_stats import agent_counters, instance_counters, row_matches, status_group, os_family
+from ..utils.agent_rollups import rollup_series, hour_bucket, day_bucket
+from ..utils.response_cache import dashboard_cache
+from ..utils.license_snapshots import fresh_requested
+from sqlalchemy import func
 from datetime import datetime, timedelta
-import random  # Temporary for mock data
 
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/api/dashboard')
 
+# Most common sensor versions shown in the sensor version chart
+MAX_SENSOR_VERSIONS = 10
+
+# Instance connection statuses and their keys in the instance status chart
+INSTANCE_STATUS_KEYS = {
+    'Connected': 'connected',
+    'Connected (test skipped)': 'connected',
+    'Connection Error': 'connectionError',
+    'Authentication Failed': 'authFailed',
+    'API Error': 'apiError'
+}
+
+# Failing instance connection statuses and the severity of their alerts
+INSTANCE_PROBLEM_STATUSES = {
+    'Connection Error': 'critical',
+    'Authentication Failed': 'critical',
+    'API Error': 'warning'
+}
+
+# Share of connected agents below which system health degrades
+WARNING_CONNECTED_RATIO = 0.9
+CRITICAL_CONNECTED_RATIO = 0.5
+
+# Most alerts and events shown on the dashboard
+MAX_DASHBOARD_ITEMS = 10
+
 @dashboard_bp.route('/data', methods=['GET'])
 def get_dashboard_data():
-    """Get dashboard data based on the provided filters."""
+    """Get dashboard data based on the provided filters.
+    
+    Responses are cached per filter combination until the TTL expires or a
+    sync or instance change invalidates them. ?fresh=1 bypasses the cache.
+    """
     # Get filter parameters
     instance_id = request.args.get('instance', 'all')
     os_type = request.args.get('os_type', 'all')
     status = request.args.get('status', 'all')
     time_period = request.args.get('time_period', '24h')
     
-    # In a real implementation, fetch actual data from the database
-    # and calculate statistics based on the filters
-    # For demonstration, generate mock data
+    cache_key, data = dashboard_cache.lookup(instance_id or 'all', os_type, status, time_period,
+                                             bypass=fresh_requested(request.args))
+    if data is not None:
+        response = jsonify(data)
+        response.headers['X-Cache'] = 'HIT'
+        return response
     
     # Convert time period to days for filtering
     days = {
@@ -30,8 +67,11 @@ def get_dashboard_data():
     # Calculate statistics based on filters
     stats = calculate_dashboard_stats(instance_id, os_type, status, days)
     
+    # Agent counts over the period, from the pre-aggregated rollups
+    series = load_agent_series(instance_id, days)
+    
     # Generate chart data
-    charts = generate_chart_data(instance_id, os_type, status, days)
+    charts = generate_chart_data(instance_id, os_type, status, series)
     
     # Generate alert and event data
     alerts = generate_alert_data(instance_id, days)
@@ -41,133 +81,147 @@ def get_dashboard_data():
     instances = get_instances()
     
     # Calculate trends (percentage change from previous period)
-    trends = calculate_trends(instance_id, os_type, status, days)
+    trends = calculate_trends(os_type, status, series)
     
-    return jsonify({
+    data = {
         'stats': stats,
         'charts': charts,
         'alerts': alerts,
         'events': events,
         'instances': instances,
         'trends': trends
-    })
+    }
+    dashboard_cache.store(cache_key, data)
+    
+    response = jsonify(data)
+    response.headers['X-Cache'] = 'MISS'
+    return response
 
 def calculate_dashboard_stats(instance_id, os_type, status, days):
-    """Calculate dashboard statistics."""
-    # In a real implementation, query the database
-    # For demonstration, return mock data
-    
-    # Get total agents count
-    total_agents = Agent.query.count()
-    
-    # Get connected agents count
-    connected_agents = Agent.query.filter(Agent.status == 'Connected').count()
-    
-    # Get disconnected agents count
-    disconnected_agents = Agent.query.filter(Agent.status == 'Disconnected').count()
-    
-    # Get isolated agents count
-    isolated_agents = Agent.query.filter(Agent.network_status == 'Isolated').count()
-    
-    # Get instances count
-    total_instances = CBInstance.query.count()
-    
-    # Get response instances count
-    response_instances = CBInstance.query.filter(CBInstance.server_type == 'response').count()
-    
-    # Get protection instances count
-    protection_instances = CBInstance.query.filter(CBInstance.server_type == 'protection').count()
+    """Calculate dashboard statistics.
     
-    # Get active instances count
-    active_instances = CBInstance.query.filter(CBInstance.is_active == True).count()
+    Agent and instance counters each come from a single aggregate query,
+    with the instance, OS type and status filters applied.
+    """
+    agents = agent_counters(instance_id, os_type, status)
+    instances = instance_counters(instance_id)
     
-    # Get active response instances count
-    active_response_instances = CBInstance.query.filter(
-        CBInstance.is_active == True,
-        CBInstance.server_type == 'response'
-    ).count()
-    
-    # Get active protection instances count
-    active_protection_instances = CBInstance.query.filter(
-        CBInstance.is_active == True,
-        CBInstance.server_type == 'protection'
-    ).count()
-    
-    # Determine system health based on various factors
-    system_health = determine_system_health()
+    # Determine system health from instance and agent connectivity
+    system_health = determine_system_health(agents, instance_id)
     
     return {
-        'totalAgents': total_agents,
-        'connectedAgents': connected_agents,
-        'disconnectedAgents': disconnected_agents,
-        'isolatedAgents': isolated_agents,
-        'totalInstances': total_instances,
-        'responseInstances': response_instances,
-        'protectionInstances': protection_instances,
-        'activeInstances': active_instances,
-        'activeResponseInstances': active_response_instances,
-        'activeProtectionInstances': active_protection_instances,
+        'totalAgents': agents['total'],
+        'connectedAgents': agents['connected'],
+        'disconnectedAgents': agents['disconnected'],
+        'isolatedAgents': agents['isolated'],
+        'totalInstances': instances['total'],
+        'responseInstances': instances['response'],
+        'protectionInstances': instances['protection'],
+        'activeInstances': instances['active'],
+        'activeResponseInstances': instances['active_response'],
+        'activeProtectionInstances': instances['active_protection'],
         'systemHealth': system_health
     }
 
-def determine_system_health():
-    """Determine overall system health status."""
-    # In a real implementation, this would check various factors like:
-    # - Connection status of instances
-    # - Agent health metrics
-    # - Server resource utilization
-    # - Recent alerts and their severity
-    
-    # For demonstration, return random status
-    statuses = ['Healthy', 'Warning', 'Critical']
-    weights = [0.7, 0.2, 0.1]  # More likely to be healthy
+def determine_system_health(agents, instance_id):
+    """Determine overall system health from instance and agent connectivity.
+    
+    Critical when every active instance is failing its connection checks or
+    fewer than CRITICAL_CONNECTED_RATIO of agents are connected; Warning when
+    any active instance is failing or fewer than WARNING_CONNECTED_RATIO are.
+    """
+    query = db.session.query(CBInstance.connection_status).filter(CBInstance.is_active == True)
+    if instance_id and instance_id != 'all':
+        query = query.filter(CBInstance.id == instance_id)
+    statuses = [connection_status for connection_status, in query.all()]
+    failing = [status for status in statuses if status in INSTANCE_PROBLEM_STATUSES]
+    
+    connected_ratio = agents['connected'] / agents['total'] if agents['total'] else 1.0
+    
+    if (statuses and len(failing) == len(statuses)) or connected_ratio < CRITICAL_CONNECTED_RATIO:
+        status = 'Critical'
+    elif failing or connected_ratio < WARNING_CONNECTED_RATIO:
+        status = 'Warning'
+    else:
+        status = 'Healthy'
     
     return {
-        'status': random.choices(statuses, weights=weights, k=1)[0]
+        'status': status,
+        'failingInstances': len(failing),
+        'connectedRatio': round(connected_ratio, 3)
     }
 
-def generate_chart_data(instance_id, os_type, status, days):
-    """Generate chart data for the dashboard."""
-    # In a real implementation, query the database
-    # For demonstration, return mock data
-    
-    # Generate date labels for the time period
-    date_labels = []
-    for i in range(days):
-        date = datetime.now() - timedelta(days=days-i-1)
-        date_labels.append(date.strftime('%Y-%m-%d'))
-    
+def load_agent_series(instance_id, days):
+    """Load agent counts for every bucket of the dashboard period.
+    
+    The 24h view uses hourly buckets, longer periods daily buckets.
+    
+    Returns:
+        list: (label, rows) per bucket, where rows are rollup tuples of
+        (instance_id, os, status, sensor_version, count)
+    """
+    now = datetime.utcnow()
+    if days <= 1:
+        step = timedelta(hours=1)
+        last = hour_bucket(now)
+        buckets = [last - step * (23 - i) for i in range(24)]
+        label_format = '%Y-%m-%d %H:00'
+    else:
+        step = timedelta(days=1)
+        last = day_bucket(now)
+        buckets = [last - step * (days - 1 - i) for i in range(days)]
+        label_format = '%Y-%m-%d'
+    
+    series = rollup_series(db.session, buckets, step, instance_id)
+    return [(bucket.strftime(label_format), rows) for bucket, rows in zip(buckets, series)]
+
+def summarize_rollup_rows(rows, os_type, status):
+    """Total pre-aggregated agent counts by dashboard status group."""
+    totals = {'total': 0, 'Connected': 0, 'Disconnected': 0, 'Isolated': 0}
+    for _, os_name, agent_status, _, count in rows:
+        if not row_matches(os_name, agent_status, os_type, status):
+            continue
+        totals['total'] += count
+        group = status_group(agent_status)
+        if group:
+            totals[group] += count
+    return totals
+
+def generate_chart_data(instance_id, os_type, status, series):
+    """Generate chart data for the dashboard from agent rollups."""
     # Agent status over time
+    summaries = [summarize_rollup_rows(rows, os_type, status) for _, rows in series]
     agent_status = {
-        'labels': date_labels,
-        'connected': [random.randint(80, 100) for _ in range(days)],
-        'disconnected': [random.randint(10, 20) for _ in range(days)],
-        'isolated': [random.randint(0, 5) for _ in range(days)]
-    }
-    
-    # OS type distribution
-    os_type_data = {
-        'windows': random.randint(80, 120),
-        'mac': random.randint(20, 40),
-        'linux': random.randint(10, 30),
-        'other': random.randint(0, 5)
+        'labels': [label for label, _ in series],
+        'connected': [summary['Connected'] for summary in summaries],
+        'disconnected': [summary['Disconnected'] for summary in summaries],
+        'isolated': [summary['Isolated'] for summary in summaries]
     }
     
-    # Sensor version distribution
-    sensor_versions = ['7.0.0', '7.1.0', '7.2.0', '7.3.0', '7.4.0']
+    # OS type and sensor version distribution as of the latest bucket
+    latest = series[-1][1] if series else []
+    os_type_data = {'windows': 0, 'mac': 0, 'linux': 0, 'other': 0}
+    version_counts = {}
+    for _, os_name, row_status, sensor_version, count in latest:
+        if not row_matches(os_name, row_status, os_type, status):
+            continue
+        os_type_data[os_family(os_name)] += count
+        version_counts[sensor_version] = version_counts.get(sensor_version, 0) + count
+    
+    top_versions = sorted(version_counts.items(), key=lambda item: item[1], reverse=True)[:MAX_SENSOR_VERSIONS]
     sensor_version_data = {
-        'labels': sensor_versions,
-        'counts': [random.randint(10, 50) for _ in range(len(sensor_versions))]
+        'labels': [version for version, _ in top_versions],
+        'counts': [count for _, count in top_versions]
     }
     
     # Instance status distribution
-    instance_status_data = {
-        'connected': random.randint(5, 10),
-        'connectionError': random.randint(0, 2),
-        'authFailed': random.randint(0, 1),
-        'apiError': random.randint(0, 1),
-        'unknown': random.randint(0, 1)
-    }
+    instance_status_data = {key: 0 for key in INSTANCE_STATUS_KEYS.values()}
+    instance_status_data['unknown'] = 0
+    query = db.session.query(CBInstance.connection_status, func.count()).group_by(CBInstance.connection_status)
+    if instance_id and instance_id != 'all':
+        query = query.filter(CBInstance.id == instance_id)
+    for connection_status, count in query.all():
+        instance_status_data[INSTANCE_STATUS_KEYS.get(connection_status, 'unknown')] += count
     
     return {
         'agentStatus': agent_status,
@@ -177,114 +231,108 @@ def generate_chart_data(instance_id, os_type, status, days):
     }
 
 def generate_alert_data(instance_id, days):
-    """Generate alert data for the dashboard."""
-    # In a real implementation, query the database
-    # For demonstration, return mock data
-    
-    alert_types = [
-        'Agent disconnected',
-        'Malware detected',
-        'Suspicious activity',
-        'Network connection blocked',
-        'Authentication failure',
-        'Process terminated'
-    ]
-    
-    severities = ['critical', 'warning', 'info']
-    severity_weights = [0.2, 0.3, 0.5]
-    
-    instance_names = [
-        'CB Response Server',
-        'CB Protection Server',
-        'CB Cloud Instance'
-    ]
-    
-    # Generate random alerts
-    num_alerts = random.randint(3, 8)
+    """Build dashboard alerts from failing instances and failed sync jobs."""
+    since = datetime.utcnow() - timedelta(days=days)
     alerts = []
     
-    for i in range(num_alerts):
-        # Random timestamp within the time period
-        timestamp = datetime.now() - timedelta(
-            days=random.randint(0, days-1), 
-            hours=random.randint(0, 23),
-            minutes=random.randint(0, 59)
-        )
-        
-        alert = {
-            'message': f"{random.choice(alert_types)} on device {random.randint(1000, 9999)}",
-            'severity': random.choices(severities, weights=severity_weights, k=1)[0],
-            'timestamp': timestamp.isoformat(),
-            'instance': random.choice(instance_names)
-        }
-        
-        alerts.append(alert)
+    # Active instances whose last connection check failed
+    query = CBInstance.query.filter(CBInstance.is_active == True,
+                                    CBInstance.connection_status.in_(INSTANCE_PROBLEM_STATUSES))
+    if instance_id and instance_id != 'all':
+        query = query.filter(CBInstance.id == instance_id)
+    for instance in query.all():
+        message = instance.connection_status
+        if instance.connection_message:
+            message += f": {instance.connection_message}"
+        alerts.append({
+            'message': message,
+            'severity': INSTANCE_PROBLEM_STATUSES[instance.connection_status],
+            'timestamp': instance.last_checked.isoformat() if instance.last_checked else None,
+            'instance': instance.name
+        })
+    
+    # Sync jobs that failed during the period
+    names = instance_names()
+    for job in recent_sync_jobs(instance_id, since, 'failed'):
+        alerts.append({
+            'message': f"Sync failed: {job.message}" if job.message else 'Sync failed',
+            'severity': 'warning',
+            'timestamp': job.finished_at.isoformat(),
+            'instance': names.get(job.instance_id, 'All instances')
+        })
     
     # Sort by timestamp (newest first)
-    alerts.sort(key=lambda x: x['timestamp'], reverse=True)
+    alerts.sort(key=lambda x: x['timestamp'] or '', reverse=True)
     
-    return alerts
+    return alerts[:MAX_DASHBOARD_ITEMS]
 
 def generate_event_data(instance_id, days):
-    """Generate event data for the dashboard."""
-    # In a real implementation, query the database
-    # For demonstration, return mock data
-    
-    event_types = [
-        'Agent registered',
-        'Agent updated',
-        'Agent synced',
-        'Policy updated',
-        'Scan completed',
-        'Instance restarted',
-        'Configuration changed',
-        'User login'
-    ]
-    
-    instance_names = [
-        'CB Response Server',
-        'CB Protection Server',
-        'CB Cloud Instance'
-    ]
-    
-    # Generate random events
-    num_events = random.randint(5, 10)
+    """Build dashboard events from completed sync jobs and agent registrations."""
+    since = datetime.utcnow() - timedelta(days=days)
     events = []
     
-    for i in range(num_events):
-        # Random timestamp within the time period
-        timestamp = datetime.now() - timedelta(
-            days=random.randint(0, days-1), 
-            hours=random.randint(0, 23),
-            minutes=random.randint(0, 59)
-        )
-        
-        event = {
-            'message': f"{random.choice(event_types)}",
-            'timestamp': timestamp.isoformat(),
-            'instance': random.choice(instance_names)
-        }
-        
-        events.append(event)
+    names = instance_names()
+    for job in recent_sync_jobs(instance_id, since, 'completed'):
+        events.append({
+            'message': f"Agent sync completed: {job.message}" if job.message else 'Agent sync completed',
+            'timestamp': job.finished_at.isoformat(),
+            'instance': names.get(job.instance_id, 'All instances')
+        })
+    
+    # Agents first seen during the period, one event per instance
+    query = db.session.query(Agent.instance_id, func.count(), func.max(Agent.created_at)) \
+        .filter(Agent.created_at >= since).group_by(Agent.instance_id)
+    if instance_id and instance_id != 'all':
+        query = query.filter(Agent.instance_id == instance_id)
+    for agent_instance_id, count, latest in query.all():
+        events.append({
+            'message': f"{count} agent{'s' if count != 1 else ''} registered",
+            'timestamp': latest.isoformat(),
+            'instance': names.get(agent_instance_id, agent_instance_id)
+        })
     
     # Sort by timestamp (newest first)
     events.sort(key=lambda x: x['timestamp'], reverse=True)
     
-    return events
+    return events[:MAX_DASHBOARD_ITEMS]
+
+def recent_sync_jobs(instance_id, since, status):
+    """Sync jobs with a status that finished since a point in time, newest first."""
+    query = SyncJob.query.filter(SyncJob.status == status, SyncJob.finished_at >= since)
+    if instance_id and instance_id != 'all':
+        query = query.filter(SyncJob.instance_id == instance_id)
+    return query.order_by(SyncJob.finished_at.desc()).limit(MAX_DASHBOARD_ITEMS).all()
+
+def instance_names():
+    """Map instance IDs to names."""
+    return dict(db.session.query(CBInstance.id, CBInstance.name).all())
 
 def get_instances():
     """Get all instances for filter dropdown."""
     instances = CBInstance.query.all()
     return [{'id': instance.id, 'name': instance.name} for instance in instances]
 
-def calculate_trends(instance_id, os_type, status, days):
-    """Calculate trend percentages."""
-    # In a real implementation, compare current period with previous period
-    # For demonstration, return random trends
+def calculate_trends(os_type, status, series):
+    """Calculate trend percentages.
+    
+    Compares agent counts at the end of the period with those at the first
+    bucket of the period that has any rollup data.
+    """
+    populated = [rows for _, rows in series if rows]
+    if not populated:
+        return {'totalAgents': 0, 'connectedAgents': 0, 'disconnectedAgents': 0, 'isolatedAgents': 0}
+    
+    first = summarize_rollup_rows(populated[0], os_type, status)
+    last = summarize_rollup_rows(populated[-1], os_type, status)
+    
+    def change(key):
+        if not first[key]:
+            return 0
+        return round((last[key] - first[key]) * 100 / first[key])
     
     return {
-        'totalAgents': random.randint(-10, 20),
-        'connectedAgents': random.randint(-5, 15),
-        'disconnectedAgents': random.randint(-15, 5),
-        'isolatedAgents': random.randint(-5, 5)
-    } 
\ No newline at end of file
+        'totalAgents': change('total'),
+        'connectedAgents': change('Connected'),
+        'disconnectedAgents': change('Disconnected'),
+        'isolatedAgents': change('Isolated')
+    }
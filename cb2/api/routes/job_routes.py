@@ -0,0 +1,66 @@
+from flask import Blueprint, request, jsonify, current_app
+from ..models import SyncJob
+
+job_bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+@job_bp.route('/', methods=['GET'])
+def get_jobs():
+    """Get recent background sync jobs."""
+    try:
+        limit = min(request.args.get('limit', 20, type=int), 100)
+        status = request.args.get('status')
+        instance_id = request.args.get('instance_id')
+
+        query = SyncJob.query
+
+        if status:
+            query = query.filter(SyncJob.status == status)
+
+        if instance_id:
+            query = query.filter(SyncJob.instance_id == instance_id)
+
+        jobs = query.order_by(SyncJob.created_at.desc()).limit(limit).all()
+
+        return jsonify({
+            'status': 'success',
+            'data': [job.to_dict() for job in jobs]
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error retrieving sync jobs: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Error retrieving sync jobs: {str(e)}'
+        }), 500
+
+@job_bp.route('/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status and progress of a background sync job."""
+    try:
+        job = SyncJob.query.get(job_id)
+
+        if not job:
+            return jsonify({
+                'status': 'error',
+                'message': f'Job {job_id} not found'
+            }), 404
+
+        return jsonify({
+            'status': 'success',
+            'data': job.to_dict()
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error retrieving sync job {job_id}: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Error retrieving sync job: {str(e)}'
+        }), 500
+
+def job_accepted_response(job, created):
+    """Build the response returned when a sync job is queued or reused."""
+    return jsonify({
+        'status': 'success',
+        'job_id': job.id,
+        'deduplicated': not created,
+        'message': 'Sync job queued' if created else 'A sync job for this target is already running',
+        'data': job.to_dict()
+    }), 202
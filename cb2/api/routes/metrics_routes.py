@@ -0,0 +1,21 @@
+from flask import Blueprint, jsonify
+from ..utils import cb_clients, license_snapshots, dashboard_cache, agent_facet_cache, audit_writer, audit_partitions, health_probe, cbapi_cache
+
+metrics_bp = Blueprint('metrics', __name__, url_prefix='/api/metrics')
+
+@metrics_bp.route('/', methods=['GET'])
+def get_metrics():
+    """Get in-process cache and connection pool metrics for this worker."""
+    return jsonify({
+        'status': 'success',
+        'data': {
+            'cb_client_pool': cb_clients.stats(),
+            'license_snapshots': license_snapshots.stats(),
+            'dashboard_cache': dashboard_cache.stats(),
+            'agent_facet_cache': agent_facet_cache.stats(),
+            'audit_writer': audit_writer.stats(),
+            'audit_partitions': audit_partitions.stats(),
+            'health_probe': health_probe.stats(),
+            'cbapi_cache': cbapi_cache.stats()
+        }
+    })
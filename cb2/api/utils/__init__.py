@@ -1,3 +1,23 @@
 from .cb_api_helper import CBAPIHelper
+from .client_registry import CBClientRegistry, cb_clients
+from .sync_scheduler import SyncScheduler, sync_scheduler
+from .sync_jobs import SyncJobRunner, sync_jobs
+from .license_snapshots import LicenseSnapshotStore, license_snapshots
+from .audit_writer import AuditWriter, audit_writer
+from .audit_partitions import AuditPartitionManager, audit_partitions
+from .health_probe import InstanceHealthProbe, health_probe
+from .response_cache import ResponseCache, dashboard_cache, agent_facet_cache, invalidate_agent_caches
+from .passthrough_cache import PassthroughCache, cbapi_cache
 
-__all__ = ['CBAPIHelper'] 
\ No newline at end of file
+__all__ = [
+    'CBAPIHelper',
+    'CBClientRegistry', 'cb_clients',
+    'SyncScheduler', 'sync_scheduler',
+    'SyncJobRunner', 'sync_jobs',
+    'LicenseSnapshotStore', 'license_snapshots',
+    'AuditWriter', 'audit_writer',
+    'AuditPartitionManager', 'audit_partitions',
+    'InstanceHealthProbe', 'health_probe',
+    'ResponseCache', 'dashboard_cache', 'agent_facet_cache', 'invalidate_agent_caches',
+    'PassthroughCache', 'cbapi_cache'
+] 
\ No newline at end of file
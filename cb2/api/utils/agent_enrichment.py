@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from cbapi.errors import ObjectNotFoundError
+from ..models import Agent, db
+from .fanout import fan_out
+from .license_service import get_instance_api, is_response
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the app does not configure agent enrichment
+DEFAULT_REMOTE_LIMIT = 200
+DEFAULT_REMOTE_WORKERS = 8
+DEFAULT_REMOTE_TIMEOUT = 10
+DEFAULT_CACHE_TTL = 3600
+DEFAULT_CACHE_MAX_ENTRIES = 10000
+
+# Seconds a failed lookup is remembered, so a struggling server is not
+# hammered by every page load but recovers quickly
+DEFAULT_ERROR_TTL = 60
+
+
+class AgentInfoCache:
+    """Thread-safe TTL cache of agent details fetched from Carbon Black servers.
+
+    Keyed by (instance ID, agent ID). Agents the server reported as not
+    found are cached as None too, so unknown agents are not re-requested on
+    every page load. Entries may carry their own TTL, and the least
+    recently used ones are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (found, value) for a key."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+
+
+# Process-wide cache of remotely fetched agent details
+agent_info_cache = AgentInfoCache()
+
+
+def agent_info_from_model(agent):
+    """Build the agent_info dict for a dropped connection from a local Agent row."""
+    return {
+        'os_type': agent.os or 'Unknown',
+        'computer_name': agent.hostname or 'Unknown',
+        'sensor_version': agent.version or 'Unknown'
+    }
+
+
+def fetch_remote_agent_info(cb_api, instance, agent_id):
+    """Fetch agent details for one agent from its Carbon Black server."""
+    if is_response(instance):
+        sensor = cb_api.get_object(f'/api/v1/sensor/{agent_id}') or {}
+        return {
+            'os_type': sensor.get('os_type', 'Unknown'),
+            'computer_name': sensor.get('computer_name', 'Unknown'),
+            'sensor_version': sensor.get('build_version_string', 'Unknown')
+        }
+
+    computer = cb_api.get_object(f'/api/bit9platform/v1/computer/{agent_id}') or {}
+    return {
+        'os_type': computer.get('osShortName', 'Unknown'),
+        'computer_name': computer.get('name', 'Unknown'),
+        'sensor_version': computer.get('agentVersion', 'Unknown')
+    }
+
+
+def _remote_task(task):
+    instance, agent_id = task
+    return fetch_remote_agent_info(get_instance_api(instance), instance, agent_id)
+
+
+def enrich_dropped_connections(connections, instances, remote_limit=None, max_workers=None, timeout=None):
+    """Attach agent_info to dropped connections.
+
+    Details come from the locally synced agents table in one query. Only
+    agents missing there are looked up on their Carbon Black server, at most
+    ``remote_limit`` per call, concurrently, with results cached process-wide.
+    Every connection gets an ``agent_info_source`` of 'local', 'cache',
+    'remote' or 'unavailable'.
+
+    Args:
+        connections: Dropped connection dicts with instance_id and agent_id
+        instances: CBInstance model objects the connections belong to
+        remote_limit: Maximum number of remote lookups for this call
+        max_workers: Maximum number of concurrent remote lookups
+        timeout: Per-lookup deadline in seconds
+
+    Returns:
+        list: The same connection dicts, enriched in place
+    """
+    remote_limit = DEFAULT_REMOTE_LIMIT if remote_limit is None else remote_limit
+    instances_by_id = {instance.id: instance for instance in instances}
+
+    keys = {
+        (connection['instance_id'], str(connection['agent_id']))
+        for connection in connections
+        if connection.get('agent_id') is not None
+    }
+
+    # One query for every agent referenced by any connection
+    local = {}
+    agent_ids = {agent_id for _, agent_id in keys}
+    if agent_ids:
+        rows = db.session.query(Agent.id, Agent.instance_id, Agent.hostname, Agent.os, Agent.version).filter(
+            Agent.id.in_(agent_ids)
+        ).all()
+        local = {(row.instance_id, row.id): agent_info_from_model(row) for row in rows}
+
+    resolved = {key: (info, 'local') for key, info in local.items() if key in keys}
+
+    missing = []
+    for key in keys - set(resolved):
+        found, info = agent_info_cache.get(key)
+        if found:
+            resolved[key] = (info, 'cache')
+        elif key[0] in instances_by_id:
+            missing.append(key)
+
+    if len(missing) > remote_limit:
+        logger.info(f"Skipping remote lookup of {len(missing) - remote_limit} agents over the per-request limit")
+        missing = missing[:remote_limit]
+
+    if missing:
+        tasks = [(instances_by_id[instance_id], agent_id) for instance_id, agent_id in missing]
+        for outcome in fan_out(_remote_task, tasks, max_workers or DEFAULT_REMOTE_WORKERS,
+                               timeout or DEFAULT_REMOTE_TIMEOUT):
+            instance, agent_id = outcome.item
+            key = (instance.id, agent_id)
+            if outcome.timed_out:
+                # Not cached, the next request may have better luck
+                continue
+            if isinstance(outcome.error, ObjectNotFoundError):
+                agent_info_cache.set(key, None)
+                continue
+            if outcome.error is not None:
+                # Possibly transient, so only remembered briefly
+                logger.debug(f"Could not look up agent {agent_id} on {instance.name}: {str(outcome.error)}")
+                agent_info_cache.set(key, None, DEFAULT_ERROR_TTL)
+                continue
+            agent_info_cache.set(key, outcome.value)
+            resolved[key] = (outcome.value, 'remote')
+
+    for connection in connections:
+        key = (connection['instance_id'], str(connection.get('agent_id')))
+        info, source = resolved.get(key, (None, 'unavailable'))
+        if info is None:
+            info, source = {}, 'unavailable'
+        connection['agent_info'] = info
+        connection['agent_info_source'] = source
+
+    return connections
@@ -0,0 +1,196 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import func, literal, select
+from ..models import Agent, AgentStatusRollup
+from .locks import try_transaction_lock, ROLLUP_DOWNSAMPLE_LOCK_KEY
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the app does not configure rollup retention
+DEFAULT_HOURLY_RETENTION_HOURS = 48
+DEFAULT_DAILY_RETENTION_DAYS = 400
+
+ROLLUP_COLUMNS = ('granularity', 'bucket', 'instance_id', 'os', 'status', 'sensor_version', 'agent_count')
+
+
+def hour_bucket(value):
+    """Truncate a datetime to the start of its hour."""
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(value):
+    """Truncate a datetime to the start of its day."""
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def record_agent_rollup(session, instance_id, now=None, hourly_retention=None, daily_retention=None):
+    """Snapshot an instance's agent counts into the current hourly bucket.
+
+    Counts are grouped by OS, status and sensor version and written with a
+    single INSERT ... SELECT, replacing any earlier snapshot of the instance
+    in the same hour, and committed. Old hourly buckets are then downsampled
+    to daily ones in a separate transaction, by one sync at a time; a failed
+    fold is logged and never loses the snapshot.
+
+    Args:
+        session: SQLAlchemy session; committed by this function
+        instance_id: ID of the CBInstance that was just synced
+        now: Snapshot time (naive UTC), defaults to now
+        hourly_retention: Hours of hourly buckets to keep before downsampling
+        daily_retention: Days of daily buckets to keep
+    """
+    now = now or datetime.utcnow()
+    bucket = hour_bucket(now)
+    table = AgentStatusRollup.__table__
+
+    session.execute(table.delete().where(
+        table.c.granularity == 'hour',
+        table.c.bucket == bucket,
+        table.c.instance_id == instance_id
+    ))
+
+    counts = select(
+        literal('hour'),
+        literal(bucket, table.c.bucket.type),
+        Agent.instance_id,
+        func.coalesce(Agent.os, 'Unknown'),
+        func.coalesce(Agent.status, 'Unknown'),
+        func.coalesce(Agent.version, 'Unknown'),
+        func.count()
+    ).where(Agent.instance_id == instance_id).group_by(
+        Agent.instance_id,
+        func.coalesce(Agent.os, 'Unknown'),
+        func.coalesce(Agent.status, 'Unknown'),
+        func.coalesce(Agent.version, 'Unknown')
+    )
+    session.execute(table.insert().from_select(list(ROLLUP_COLUMNS), counts))
+    session.commit()
+
+    try:
+        # Parallel syncs would fold the same days; whoever holds the lock folds for everyone
+        if try_transaction_lock(session, ROLLUP_DOWNSAMPLE_LOCK_KEY):
+            downsample_rollups(session, now, hourly_retention, daily_retention)
+        session.commit()
+    except Exception as e:
+        logger.error(f"Error downsampling agent rollups: {str(e)}")
+        session.rollback()
+
+
+def downsample_rollups(session, now=None, hourly_retention=None, daily_retention=None):
+    """Fold hourly buckets older than the hourly retention into daily buckets.
+
+    The counts are gauges, so a day keeps each instance's last hourly
+    snapshot of that day. Only whole days are folded. Daily buckets older
+    than the daily retention are deleted. The caller commits.
+    """
+    now = now or datetime.utcnow()
+    hourly_retention = hourly_retention or DEFAULT_HOURLY_RETENTION_HOURS
+    daily_retention = daily_retention or DEFAULT_DAILY_RETENTION_DAYS
+    table = AgentStatusRollup.__table__
+
+    cutoff = day_bucket(now - timedelta(hours=hourly_retention))
+
+    # Last hourly snapshot of every instance for every day due for folding
+    snapshots = session.execute(
+        select(table.c.instance_id, table.c.bucket).where(
+            table.c.granularity == 'hour',
+            table.c.bucket < cutoff
+        ).distinct()
+    ).all()
+
+    last_snapshot = {}
+    for instance_id, bucket in snapshots:
+        key = (instance_id, day_bucket(bucket))
+        if key not in last_snapshot or bucket > last_snapshot[key]:
+            last_snapshot[key] = bucket
+
+    for (instance_id, day), bucket in last_snapshot.items():
+        session.execute(table.delete().where(
+            table.c.granularity == 'day',
+            table.c.bucket == day,
+            table.c.instance_id == instance_id
+        ))
+        session.execute(table.insert().from_select(list(ROLLUP_COLUMNS), select(
+            literal('day'),
+            literal(day, table.c.bucket.type),
+            table.c.instance_id,
+            table.c.os,
+            table.c.status,
+            table.c.sensor_version,
+            table.c.agent_count
+        ).where(
+            table.c.granularity == 'hour',
+            table.c.bucket == bucket,
+            table.c.instance_id == instance_id
+        )))
+
+    if last_snapshot:
+        logger.info(f"Downsampled {len(last_snapshot)} instance-days of hourly agent rollups")
+        session.execute(table.delete().where(table.c.granularity == 'hour', table.c.bucket < cutoff))
+
+    session.execute(table.delete().where(
+        table.c.granularity == 'day',
+        table.c.bucket < day_bucket(now) - timedelta(days=daily_retention)
+    ))
+
+
+def rollup_series(session, buckets, step, instance_id='all'):
+    """Reconstruct agent counts at each of a series of buckets.
+
+    Every bucket reflects each instance's latest snapshot taken before the
+    bucket ends, so instances that were not synced during a bucket carry
+    their previous counts forward. Reads O(buckets x instances) rows, never
+    the agents table.
+
+    Args:
+        session: SQLAlchemy session
+        buckets: Ascending list of bucket start datetimes (naive UTC)
+        step: timedelta length of a bucket
+        instance_id: Restrict to one instance, or 'all'
+
+    Returns:
+        list: One list per bucket of (instance_id, os, status, sensor_version, count) tuples
+    """
+    if not buckets:
+        return []
+
+    table = AgentStatusRollup.__table__
+    start, end = buckets[0], buckets[-1] + step
+    scope = [] if not instance_id or instance_id == 'all' else [table.c.instance_id == instance_id]
+    columns = [table.c.bucket, table.c.instance_id, table.c.os, table.c.status,
+               table.c.sensor_version, table.c.agent_count]
+
+    # Seed every instance with its last snapshot before the window
+    seeds = select(table.c.instance_id, func.max(table.c.bucket).label('bucket')).where(
+        table.c.bucket < start, *scope
+    ).group_by(table.c.instance_id).subquery()
+    seed_rows = session.execute(select(*columns).join(
+        seeds,
+        (table.c.instance_id == seeds.c.instance_id) & (table.c.bucket == seeds.c.bucket)
+    )).all()
+
+    window_rows = session.execute(select(*columns).where(
+        table.c.bucket >= start, table.c.bucket < end, *scope
+    )).all()
+
+    # Group rows into snapshots: (taken at, instance) -> rows
+    snapshots = defaultdict(list)
+    for row in list(seed_rows) + list(window_rows):
+        snapshots[(row.bucket, row.instance_id)].append(
+            (row.instance_id, row.os, row.status, row.sensor_version, row.agent_count)
+        )
+    ordered = sorted(snapshots.items(), key=lambda item: item[0][0])
+
+    series = []
+    current = {}
+    position = 0
+    for bucket in buckets:
+        bucket_end = bucket + step
+        while position < len(ordered) and ordered[position][0][0] < bucket_end:
+            (_, snapshot_instance), rows = ordered[position]
+            current[snapshot_instance] = rows
+            position += 1
+        series.append([row for rows in current.values() for row in rows])
+
+    return series
@@ -0,0 +1,197 @@
+import logging
+import threading
+from sqlalchemy import func, or_, text, cast, Float, Integer, Text, literal_column
+from ..models import db, Agent
+
+logger = logging.getLogger(__name__)
+
+# Trigram indexes cannot narrow down terms shorter than this
+MIN_INDEXED_TERM = 3
+
+# Name of the immutable function whose result the PostgreSQL trigram index covers
+SEARCH_FUNCTION = 'agent_search_text'
+
+# PostgreSQL search index: one trigram GIN index over the searchable columns,
+# plus one over hostname for the hostname filter. array_to_string is only
+# STABLE, so it is wrapped in a function declared IMMUTABLE to be indexable.
+POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"""
+    CREATE OR REPLACE FUNCTION {SEARCH_FUNCTION}(hostname text, os text, version text, status text, groups text[])
+    RETURNS text LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT coalesce(hostname, '') || ' ' || coalesce(os, '') || ' ' || coalesce(version, '') || ' ' ||
+               coalesce(status, '') || ' ' || coalesce(array_to_string(groups, ' '), '')
+    $$
+    """,
+    f"""
+    CREATE INDEX IF NOT EXISTS ix_agents_search_trgm ON agents
+    USING gin ({SEARCH_FUNCTION}(hostname, os, version, status, groups) gin_trgm_ops)
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_agents_hostname_trgm ON agents USING gin (hostname gin_trgm_ops)"
+]
+
+# SQLite fallback: an external content FTS5 table with the trigram tokenizer
+# (SQLite 3.34+), kept in sync with agents by triggers
+SQLITE_SEARCH_COLUMNS = 'hostname, os, version, status, groups'
+SQLITE_SEARCH_DDL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS agents_fts USING fts5(
+        {SQLITE_SEARCH_COLUMNS}, content='agents', content_rowid='rowid', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS agents_fts_insert AFTER INSERT ON agents BEGIN
+        INSERT INTO agents_fts(rowid, {SQLITE_SEARCH_COLUMNS})
+        VALUES (new.rowid, new.hostname, new.os, new.version, new.status, new.groups);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS agents_fts_delete AFTER DELETE ON agents BEGIN
+        INSERT INTO agents_fts(agents_fts, rowid, {SQLITE_SEARCH_COLUMNS})
+        VALUES ('delete', old.rowid, old.hostname, old.os, old.version, old.status, old.groups);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS agents_fts_update AFTER UPDATE ON agents BEGIN
+        INSERT INTO agents_fts(agents_fts, rowid, {SQLITE_SEARCH_COLUMNS})
+        VALUES ('delete', old.rowid, old.hostname, old.os, old.version, old.status, old.groups);
+        INSERT INTO agents_fts(rowid, {SQLITE_SEARCH_COLUMNS})
+        VALUES (new.rowid, new.hostname, new.os, new.version, new.status, new.groups);
+    END
+    """
+]
+
+# Detected search backend per database URL
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def install_search_index(engine):
+    """Create the search index for the engine's database.
+
+    Idempotent. On PostgreSQL this builds GIN indexes over every agent and
+    needs permission to create the pg_trgm extension, so it is run by the
+    migrate_add_agent_search.py script rather than at startup.
+
+    Returns:
+        str: The search backend now available
+    """
+    with engine.begin() as conn:
+        if engine.dialect.name == 'postgresql':
+            for statement in POSTGRES_SEARCH_DDL:
+                conn.execute(text(statement))
+        elif engine.dialect.name == 'sqlite':
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'agents_fts'"
+            )).first()
+            for statement in SQLITE_SEARCH_DDL:
+                conn.execute(text(statement))
+            if not exists:
+                # Index the agents that were there before the triggers
+                conn.execute(text("INSERT INTO agents_fts(agents_fts) VALUES ('rebuild')"))
+
+    with _backends_lock:
+        _backends.pop(str(engine.url), None)
+    return search_backend(engine)
+
+
+def search_backend(engine=None):
+    """Detect which search implementation the database supports.
+
+    Returns:
+        str: 'trigram' (PostgreSQL pg_trgm), 'fts5' (SQLite) or 'like'
+    """
+    engine = engine or db.engine
+    key = str(engine.url)
+    with _backends_lock:
+        if key in _backends:
+            return _backends[key]
+
+    backend = 'like'
+    try:
+        with engine.connect() as conn:
+            if engine.dialect.name == 'postgresql':
+                if conn.execute(text(
+                    "SELECT 1 FROM pg_indexes WHERE tablename = 'agents' AND indexname = 'ix_agents_search_trgm'"
+                )).first():
+                    backend = 'trigram'
+            elif engine.dialect.name == 'sqlite':
+                if conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'agents_fts'"
+                )).first():
+                    backend = 'fts5'
+    except Exception as e:
+        logger.warning(f"Could not detect agent search index, using LIKE search: {str(e)}")
+
+    if backend == 'like':
+        logger.info("No agent search index found, agent search will scan the agents table")
+
+    with _backends_lock:
+        _backends[key] = backend
+    return backend
+
+
+def like_pattern(term):
+    """Escape LIKE wildcards in a search term and wrap it for a substring match."""
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def search_text():
+    """The expression covered by the PostgreSQL trigram index."""
+    return getattr(func, SEARCH_FUNCTION)(Agent.hostname, Agent.os, Agent.version, Agent.status, Agent.groups)
+
+
+def groups_text():
+    """The groups column as searchable text, for the unindexed LIKE search."""
+    if db.engine.dialect.name == 'postgresql':
+        return func.array_to_string(Agent.groups, ' ')
+    # SQLite stores groups as a JSON list, whose text holds every group name
+    return cast(Agent.groups, Text)
+
+
+def apply_search(query, term):
+    """Restrict an Agent query to agents matching a free-text search term.
+
+    Matches the term as a case-insensitive substring of the hostname, OS,
+    version, status or groups, using the search index when there is one.
+
+    Args:
+        query: Agent query
+        term: Search term
+
+    Returns:
+        tuple: (query, rank) where rank is a relevance expression (higher is
+        better) or None when the backend cannot rank
+    """
+    term = (term or '').strip()
+    if not term:
+        return query, None
+
+    backend = search_backend()
+
+    if backend == 'trigram':
+        document = search_text()
+        query = query.filter(document.ilike(like_pattern(term), escape='\\'))
+        # Best match of the term against any word of the document
+        rank = func.word_similarity(term, document)
+        return query, rank
+
+    if backend == 'fts5' and len(term) >= MIN_INDEXED_TERM:
+        # FTS5 string literal: a trigram substring match on every column
+        phrase = '"' + term.replace('"', '""') + '"'
+        matches = text(
+            "SELECT rowid AS rowid, -bm25(agents_fts) AS rank FROM agents_fts WHERE agents_fts MATCH :phrase"
+        ).bindparams(phrase=phrase).columns(rowid=Integer, rank=Float).subquery('search_matches')
+        query = query.join(matches, literal_column('agents.rowid') == matches.c.rowid)
+        return query, matches.c.rank
+
+    pattern = like_pattern(term)
+    query = query.filter(or_(
+        Agent.hostname.ilike(pattern, escape='\\'),
+        Agent.os.ilike(pattern, escape='\\'),
+        Agent.version.ilike(pattern, escape='\\'),
+        Agent.status.ilike(pattern, escape='\\'),
+        groups_text().ilike(pattern, escape='\\')
+    ))
+    return query, None
@@ -0,0 +1,335 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from dateutil import parser as date_parser
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from cbapi.response import Sensor
+from ..models import Agent
+
+logger = logging.getLogger(__name__)
+
+# Default number of rows written per INSERT ... ON CONFLICT statement
+DEFAULT_BATCH_SIZE = 1000
+
+# Columns compared to decide whether an existing agent row has changed
+COMPARED_FIELDS = ('hostname', 'os', 'version', 'status', 'last_check_in', 'groups')
+
+# Sensors are re-read this far behind the stored watermark to absorb clock skew
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+# Rows requested per page when walking the sensor list for an incremental sync
+SENSOR_PAGE_SIZE = 100
+
+
+class SyncCancelled(Exception):
+    """Raised inside a sync at its next batch once it has been cancelled."""
+
+
+def normalize_checkin(value):
+    """Normalize a sensor check-in time to a timezone-aware UTC datetime.
+
+    Args:
+        value: datetime, ISO formatted string or None
+
+    Returns:
+        datetime or None
+    """
+    if not value:
+        return None
+
+    if isinstance(value, str):
+        try:
+            value = date_parser.parse(value)
+        except (ValueError, OverflowError):
+            return None
+
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def agent_row_from_sensor(device, instance_id, existing_groups=None):
+    """Build an agents table row from a CB Response sensor.
+
+    Args:
+        device: cbapi Sensor object
+        instance_id: ID of the CBInstance the sensor belongs to
+        existing_groups: Groups already stored for this agent, if any
+
+    Returns:
+        dict: Column values for the agents table
+    """
+    groups = list(existing_groups or [])
+    group_name = getattr(device, 'group_name', None)
+    if group_name and group_name not in groups:
+        groups.append(group_name)
+
+    return {
+        'id': str(device.id),
+        'instance_id': instance_id,
+        'hostname': getattr(device, 'hostname', None) or 'Unknown',
+        'os': getattr(device, 'os_type', None) or 'Unknown',
+        'version': getattr(device, 'build_version_string', None) or 'Unknown',
+        'status': getattr(device, 'status', None) or 'Unknown',
+        'last_check_in': normalize_checkin(getattr(device, 'last_checkin_time', None)),
+        'groups': groups
+    }
+
+
+def load_existing_agents(session, instance_id, agent_ids=None):
+    """Load the comparable state of every stored agent for an instance in one query.
+
+    Args:
+        session: SQLAlchemy session
+        instance_id: ID of the CBInstance
+        agent_ids: Optional agent ids to restrict the query to
+
+    Returns:
+        dict: Mapping of agent id to a dict of the compared columns
+    """
+    columns = [Agent.id] + [getattr(Agent, field) for field in COMPARED_FIELDS]
+    query = session.query(*columns).filter(Agent.instance_id == instance_id)
+    if agent_ids is not None:
+        query = query.filter(Agent.id.in_(agent_ids))
+    rows = query.all()
+
+    existing = {}
+    for row in rows:
+        state = dict(zip(COMPARED_FIELDS, row[1:]))
+        state['last_check_in'] = normalize_checkin(state['last_check_in'])
+        state['groups'] = list(state['groups'] or [])
+        existing[row[0]] = state
+    return existing
+
+
+def row_changed(row, current):
+    """Check whether a freshly built row differs from the stored agent state."""
+    return any(row[field] != current.get(field) for field in COMPARED_FIELDS)
+
+
+def _upsert_statement(session):
+    """Build a dialect-specific INSERT ... ON CONFLICT DO UPDATE for the agents table."""
+    table = Agent.__table__
+    dialect = session.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        stmt = pg_insert(table)
+    elif dialect == 'sqlite':
+        stmt = sqlite_insert(table)
+    else:
+        raise ValueError(f"Bulk agent upsert is not supported on {dialect}")
+
+    update_columns = {field: stmt.excluded[field] for field in COMPARED_FIELDS}
+    update_columns['updated_at'] = datetime.utcnow()
+
+    # Never let a sensor from one instance overwrite an agent owned by another;
+    # such rows are skipped and missing from RETURNING
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_=update_columns,
+        where=table.c.instance_id == stmt.excluded.instance_id
+    ).returning(table.c.id)
+
+
+def write_agent_rows(session, rows):
+    """Write a batch of agent rows with a single upsert statement.
+
+    Args:
+        session: SQLAlchemy session
+        rows: List of row dicts as built by agent_row_from_sensor
+
+    Returns:
+        set: IDs of the rows actually written; rows whose ID belongs to an
+        agent of another instance are left out
+    """
+    if not rows:
+        return set()
+
+    now = datetime.utcnow()
+    for row in rows:
+        row.setdefault('created_at', now)
+        row.setdefault('updated_at', now)
+
+    return set(session.execute(_upsert_statement(session), rows).scalars().all())
+
+
+def iter_sensors_since(cb_api, since, page_size=SENSOR_PAGE_SIZE):
+    """Yield CB Response sensors that checked in at or after a point in time.
+
+    The sensor list is paged newest check-in first so paging can stop as soon
+    as it reaches sensors older than ``since``. If the server does not honour
+    the requested sort order the whole list is scanned and filtered instead.
+
+    Args:
+        cb_api: CbResponseAPI client
+        since: Timezone-aware datetime lower bound
+        page_size: Sensors requested per page
+
+    Yields:
+        Sensor: cbapi Sensor objects built from the page results
+    """
+    args = {'sort.col': 'last_checkin_time', 'sort.dir': 'desc', 'start': 0, 'rows': page_size}
+    ordered = True
+    previous = None
+
+    while True:
+        page = cb_api.get_object('/api/v2/sensor', query_parameters=args) or {}
+        results = page.get('results') or []
+        checkins = [normalize_checkin(item.get('last_checkin_time')) for item in results]
+
+        # Verify the whole page is newest first before trusting it to stop early
+        known = [checkin for checkin in checkins if checkin]
+        if previous:
+            known.insert(0, previous)
+        if ordered and any(later > earlier for earlier, later in zip(known, known[1:])):
+            logger.warning("Sensor list is not sorted by check-in time, scanning all sensors")
+            ordered = False
+        if known:
+            previous = known[-1]
+
+        reached_since = False
+        for item, checkin in zip(results, checkins):
+            if checkin and checkin < since:
+                reached_since = True
+                continue
+            yield Sensor.new_object(cb_api, item, full_doc=True)
+
+        if ordered and reached_since:
+            return
+
+        args['start'] += len(results)
+        if not results or args['start'] >= page.get('total_results', 0):
+            return
+
+
+def check_cancelled(cancel, instance_id):
+    """Raise SyncCancelled if a sync's cancel event is set."""
+    if cancel is not None and cancel.is_set():
+        raise SyncCancelled(f"Sync of instance {instance_id} cancelled")
+
+
+def delete_missing_agents(session, instance_id, stale_ids, batch_size=None):
+    """Delete agents that no longer exist on the Carbon Black server.
+
+    Args:
+        session: SQLAlchemy session
+        instance_id: ID of the CBInstance
+        stale_ids: Agent IDs to delete
+        batch_size: IDs per DELETE statement
+
+    Returns:
+        int: Number of agents deleted
+    """
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    table = Agent.__table__
+    stale_ids = list(stale_ids)
+
+    for i in range(0, len(stale_ids), batch_size):
+        batch = stale_ids[i:i + batch_size]
+        session.execute(
+            table.delete().where(table.c.instance_id == instance_id, table.c.id.in_(batch))
+        )
+    return len(stale_ids)
+
+
+def bulk_upsert_agents(session, instance_id, devices, batch_size=None, existing=None, prune=False,
+                       progress=None, cancel=None):
+    """Upsert sensors into the agents table in batches.
+
+    Existing agents for the instance are preloaded in a single query so that
+    unchanged sensors can be skipped without touching the database, and
+    changed or new sensors are written with batched INSERT ... ON CONFLICT
+    DO UPDATE statements.
+
+    Args:
+        session: SQLAlchemy session
+        instance_id: ID of the CBInstance being synced
+        devices: Iterable of cbapi Sensor objects
+        batch_size: Rows per upsert statement (defaults to DEFAULT_BATCH_SIZE)
+        existing: Optional preloaded mapping from load_existing_agents
+        prune: If True, ``devices`` is the complete sensor list and stored
+            agents missing from it are deleted
+        progress: Optional callable invoked as ``progress(processed, written)``
+            after every batch of sensors
+        cancel: Optional threading.Event checked after every batch of sensors
+            and before the final writes; once set, SyncCancelled is raised and
+            the caller rolls back
+
+    Returns:
+        dict: Counts with keys 'total', 'inserted', 'updated', 'unchanged',
+            'deleted' and 'collisions', plus 'max_checkin', the newest check-in
+            time seen. Sensors whose ID already belongs to an agent of another
+            instance are not written; they count as collisions only.
+    """
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    if existing is None:
+        existing = load_existing_agents(session, instance_id)
+
+    counts = {'total': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'collisions': 0,
+              'max_checkin': None}
+    pending = []
+    seen = set()
+    written = 0
+    processed = 0
+
+    def write(rows):
+        written_ids = write_agent_rows(session, rows)
+        collided = [row['id'] for row in rows if row['id'] not in written_ids]
+        if collided:
+            # Only new rows can collide, stored ones already belong to this instance
+            logger.warning(f"Skipped {len(collided)} sensors of instance {instance_id} whose IDs belong to "
+                           f"agents of another instance: {', '.join(collided[:10])}")
+            counts['collisions'] += len(collided)
+            counts['inserted'] -= len(collided)
+            counts['total'] -= len(collided)
+        return len(written_ids)
+
+    for device in devices:
+        processed += 1
+        # Check in at every batch boundary of sensors read, changed or not
+        if processed % batch_size == 0:
+            check_cancelled(cancel, instance_id)
+            if progress:
+                progress(counts['total'], written)
+
+        device_id = str(device.id)
+        # A single upsert statement cannot touch the same row twice
+        if device_id in seen:
+            continue
+        seen.add(device_id)
+
+        current = existing.get(device_id)
+        row = agent_row_from_sensor(device, instance_id, current['groups'] if current else None)
+        counts['total'] += 1
+
+        checkin = row['last_check_in']
+        if checkin and (counts['max_checkin'] is None or checkin > counts['max_checkin']):
+            counts['max_checkin'] = checkin
+
+        if current is None:
+            counts['inserted'] += 1
+        elif row_changed(row, current):
+            counts['updated'] += 1
+        else:
+            counts['unchanged'] += 1
+            continue
+
+        pending.append(row)
+        if len(pending) >= batch_size:
+            logger.debug(f"Writing batch of {len(pending)} agents for instance {instance_id}")
+            written += write(pending)
+            pending = []
+
+    check_cancelled(cancel, instance_id)
+    written += write(pending)
+
+    if prune:
+        stale_ids = set(existing) - seen
+        if stale_ids:
+            logger.info(f"Removing {len(stale_ids)} agents no longer present on instance {instance_id}")
+            counts['deleted'] = delete_missing_agents(session, instance_id, stale_ids, batch_size)
+
+    if progress:
+        progress(counts['total'], written + counts['deleted'])
+
+    return counts
@@ -0,0 +1,399 @@
+import gzip
+import json
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+import logging
+import os
+import re
+import threading
+import traceback
+from datetime import datetime
+from sqlalchemy import text
+from ..models import db, AuditLog
+from .audit_rollups import delete_audit_rollups
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the app does not configure audit log maintenance
+DEFAULT_PREMAKE_MONTHS = 3
+DEFAULT_RETENTION_MONTHS = 0
+DEFAULT_MAINTENANCE_INTERVAL = 3600
+
+# Seconds the maintenance thread waits after startup before its first pass
+STARTUP_DELAY = 30
+
+# Monthly partitions are named audit_logs_pYYYYMM; rows outside every
+# partition land in audit_logs_default
+PARTITION_PREFIX = 'audit_logs_p'
+DEFAULT_PARTITION = 'audit_logs_default'
+PARTITION_PATTERN = re.compile(rf'^{PARTITION_PREFIX}(\d{{4}})(\d{{2}})$')
+
+# Advisory lock key, so only one worker maintains partitions at a time
+MAINTENANCE_LOCK_KEY = 72616401
+
+# Lock file in the archive directory serializing retention where there are
+# no advisory locks
+ARCHIVE_LOCK_FILE = '.retention.lock'
+
+# Rows read per round trip when archiving
+ARCHIVE_BATCH_SIZE = 5000
+
+
+def month_start(value):
+    """Truncate a datetime to the start of its month."""
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, count):
+    """Shift the start of a month by a number of months."""
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f'{PARTITION_PREFIX}{month.year:04d}{month.month:02d}'
+
+
+def is_partitioned(conn):
+    """Whether audit_logs is a partitioned table (PostgreSQL only)."""
+    if conn.dialect.name != 'postgresql':
+        return False
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = 'audit_logs' AND pg_table_is_visible(c.oid)"
+    )).first() is not None
+
+
+def list_partitions(conn):
+    """Map the start of each month to its partition's table name."""
+    rows = conn.execute(text(
+        "SELECT child.relname FROM pg_inherits i "
+        "JOIN pg_class parent ON parent.oid = i.inhparent "
+        "JOIN pg_class child ON child.oid = i.inhrelid "
+        "WHERE parent.relname = 'audit_logs' AND pg_table_is_visible(parent.oid)"
+    )).scalars()
+
+    partitions = {}
+    for name in rows:
+        match = PARTITION_PATTERN.match(name)
+        if match:
+            partitions[datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def create_partition(conn, month):
+    """Create the partition for a month.
+
+    Rows of that month which already landed in the default partition are
+    moved into the new partition, since PostgreSQL refuses to create a
+    partition whose range overlaps rows in the default one.
+    """
+    name = partition_name(month)
+    bounds = {'start': month, 'end': add_months(month, 1)}
+
+    has_default = conn.execute(text(
+        "SELECT 1 FROM pg_class WHERE relname = :name AND pg_table_is_visible(oid)"
+    ), {'name': DEFAULT_PARTITION}).first() is not None
+
+    moved = 0
+    if has_default:
+        conn.execute(text(
+            "CREATE TEMP TABLE audit_logs_moving (LIKE audit_logs INCLUDING DEFAULTS) ON COMMIT DROP"
+        ))
+        moved = conn.execute(text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            f"WHERE timestamp >= :start AND timestamp < :end RETURNING *) "
+            f"INSERT INTO audit_logs_moving SELECT * FROM moved"
+        ), bounds).rowcount
+
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF audit_logs "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d %H:%M:%S}') TO ('{bounds['end']:%Y-%m-%d %H:%M:%S}')"
+    ))
+
+    if has_default:
+        if moved:
+            conn.execute(text("INSERT INTO audit_logs SELECT * FROM audit_logs_moving"))
+            logger.info(f"Moved {moved} audit log rows from {DEFAULT_PARTITION} into {name}")
+        conn.execute(text("DROP TABLE audit_logs_moving"))
+
+    logger.info(f"Created audit log partition {name}")
+    return name
+
+
+def ensure_partitions(conn, now=None, premake=DEFAULT_PREMAKE_MONTHS):
+    """Create partitions for the current month and the next ``premake`` months.
+
+    Returns:
+        list: Names of the partitions created
+    """
+    current = month_start(now or datetime.utcnow())
+    existing = list_partitions(conn)
+    created = []
+    for offset in range(premake + 1):
+        month = add_months(current, offset)
+        if month not in existing:
+            created.append(create_partition(conn, month))
+    return created
+
+
+def archive_path(archive_dir, month):
+    return os.path.join(archive_dir, f'audit_logs_{month:%Y_%m}.jsonl.gz')
+
+
+def export_month(conn, source, month, archive_dir):
+    """Write a month of audit logs from a table to a gzipped JSONL file.
+
+    The file is written under a temporary name, synced to disk and then
+    renamed, so a file with the final name is always complete.
+
+    Returns:
+        tuple: (path, number of rows written)
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = archive_path(archive_dir, month)
+    partial = f'{path}.{os.getpid()}.partial'
+    columns = [column.name for column in AuditLog.__table__.columns]
+
+    result = conn.execute(text(
+        f"SELECT {', '.join(columns)} FROM {source} "
+        f"WHERE timestamp >= :start AND timestamp < :end ORDER BY timestamp, id"
+    ), {'start': month, 'end': add_months(month, 1)},
+        execution_options={'stream_results': True, 'yield_per': ARCHIVE_BATCH_SIZE})
+
+    count = 0
+    with gzip.open(partial, 'wt', encoding='utf-8') as archive:
+        for row in result:
+            archive.write(json.dumps(dict(row._mapping), default=str) + '\n')
+            count += 1
+        archive.flush()
+        os.fsync(archive.fileno())
+    os.replace(partial, path)
+    return path, count
+
+
+def apply_retention(engine, archive_dir, now=None, retention_months=DEFAULT_RETENTION_MONTHS, plain_table=False):
+    """Archive and remove audit logs of months older than the retention.
+
+    On a partitioned table whole partitions are exported, detached and
+    dropped. A plain table is only touched with ``plain_table``; then each
+    expired month is exported and deleted. Every month is handled in its
+    own transaction and only removed once its archive file is on disk, so
+    the table is locked only briefly. The month's hourly rollups are
+    removed with it. Callers serialize runs, see run_maintenance().
+
+    Args:
+        engine: SQLAlchemy engine
+        archive_dir: Absolute path of the directory archives are written to
+        now: Current time, defaults to utcnow
+        retention_months: Months to keep besides the current one
+        plain_table: Also delete from a table that is not partitioned
+
+    Returns:
+        list: (month, archive path, row count) for every archived month
+    """
+    if not archive_dir or not os.path.isabs(archive_dir):
+        raise ValueError(f"Audit archive directory must be an absolute path, got '{archive_dir}'")
+
+    cutoff = add_months(month_start(now or datetime.utcnow()), -retention_months)
+    archived = []
+
+    with engine.connect() as conn:
+        partitioned = is_partitioned(conn)
+        if not partitioned and not plain_table:
+            logger.debug("audit_logs is not partitioned and plain table retention is disabled")
+            return archived
+        if partitioned:
+            months = [(month, name) for month, name in sorted(list_partitions(conn).items()) if month < cutoff]
+        else:
+            oldest = conn.execute(text("SELECT min(timestamp) FROM audit_logs")).scalar()
+            if isinstance(oldest, str):
+                oldest = datetime.fromisoformat(oldest)
+            months = []
+            month = month_start(oldest) if oldest else cutoff
+            while month < cutoff:
+                months.append((month, 'audit_logs'))
+                month = add_months(month, 1)
+
+    for month, source in months:
+        with engine.begin() as conn:
+            path, count = export_month(conn, source, month, archive_dir)
+            if partitioned:
+                conn.execute(text(f"ALTER TABLE audit_logs DETACH PARTITION {source}"))
+                conn.execute(text(f"DROP TABLE {source}"))
+            elif count:
+                conn.execute(text("DELETE FROM audit_logs WHERE timestamp >= :start AND timestamp < :end"),
+                             {'start': month, 'end': add_months(month, 1)})
+            else:
+                os.remove(path)
+                continue
+            delete_audit_rollups(conn, month, add_months(month, 1))
+        logger.info(f"Archived {count} audit logs of {month:%Y-%m} to {path}")
+        archived.append((month, path, count))
+
+    return archived
+
+
+class AuditPartitionManager:
+    """Keeps audit_logs partitions ahead of time and applies the retention policy.
+
+    A background thread periodically creates the partitions for the coming
+    months (on PostgreSQL, once migrate_partition_audit_logs.py has converted
+    the table). Retention is opt-in: with AUDIT_RETENTION_MONTHS set, months
+    older than that are archived to gzipped JSONL files in AUDIT_ARCHIVE_DIR,
+    which must be an absolute path, and removed. Only partitions are dropped
+    unless AUDIT_RETENTION_PLAIN_TABLE allows deleting from a table that was
+    never partitioned. An interval of 0 disables the thread.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.premake = DEFAULT_PREMAKE_MONTHS
+        self.retention_months = DEFAULT_RETENTION_MONTHS
+        self.interval = DEFAULT_MAINTENANCE_INTERVAL
+        self.archive_dir = None
+        self.plain_table = False
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.partitions_created = 0
+        self.months_archived = 0
+        self.last_run = None
+        self.last_error = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the manager to a Flask application, read its settings and start the thread."""
+        self.app = app
+        self.premake = app.config.get('AUDIT_PARTITION_PREMAKE_MONTHS', DEFAULT_PREMAKE_MONTHS)
+        self.retention_months = app.config.get('AUDIT_RETENTION_MONTHS', DEFAULT_RETENTION_MONTHS)
+        self.interval = app.config.get('AUDIT_MAINTENANCE_INTERVAL', DEFAULT_MAINTENANCE_INTERVAL)
+        self.archive_dir = app.config.get('AUDIT_ARCHIVE_DIR') or None
+        self.plain_table = app.config.get('AUDIT_RETENTION_PLAIN_TABLE', False)
+        app.extensions['audit_partitions'] = self
+
+        if self.retention_months > 0 and not (self.archive_dir and os.path.isabs(self.archive_dir)):
+            logger.error("AUDIT_RETENTION_MONTHS is set but AUDIT_ARCHIVE_DIR is not an absolute path, "
+                         "audit log retention is disabled")
+            self.retention_months = 0
+
+        if self.interval > 0 and not app.config.get('TESTING'):
+            self.start()
+
+    def run_maintenance(self, now=None):
+        """Create upcoming partitions and archive expired months.
+
+        Returns:
+            dict: Partitions created and months archived, or skipped=True
+            when another worker holds the maintenance lock
+        """
+        engine = db.engine
+        # Session-level lock, held on its own connection for the whole run
+        with engine.connect() as lock_conn:
+            postgres = engine.dialect.name == 'postgresql'
+            if postgres and not lock_conn.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {'key': MAINTENANCE_LOCK_KEY}
+            ).scalar():
+                return {'skipped': True}
+
+            lock_file = None
+            try:
+                with engine.begin() as conn:
+                    partitioned = is_partitioned(conn)
+                    created = ensure_partitions(conn, now, self.premake) if partitioned else []
+
+                archived = []
+                if self.retention_months > 0:
+                    if not postgres:
+                        lock_file = self._lock_archive_dir()
+                        if lock_file is None:
+                            return {'skipped': True}
+                    archived = apply_retention(engine, self.archive_dir, now, self.retention_months,
+                                               self.plain_table)
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+                if postgres:
+                    lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': MAINTENANCE_LOCK_KEY})
+                    lock_conn.commit()
+
+        with self._lock:
+            self.runs += 1
+            self.partitions_created += len(created)
+            self.months_archived += len(archived)
+            self.last_run = datetime.utcnow()
+            self.last_error = None
+
+        return {
+            'partitioned': partitioned,
+            'created': created,
+            'archived': [{'month': f'{month:%Y-%m}', 'path': path, 'rows': count}
+                         for month, path, count in archived]
+        }
+
+    def _lock_archive_dir(self):
+        """Take the archive directory's lock file without waiting.
+
+        Returns:
+            file: The open lock file, held until closed, or None when another
+            process holds the lock
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.archive_dir, ARCHIVE_LOCK_FILE), 'a')
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def start(self):
+        """Start the background maintenance thread."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._maintenance_loop, name='audit-maintenance', daemon=True)
+            self._thread.start()
+
+    def _maintenance_loop(self):
+        delay = STARTUP_DELAY
+        while not self._stop.wait(delay):
+            delay = self.interval
+            with self.app.app_context():
+                try:
+                    self.run_maintenance()
+                except Exception as e:
+                    logger.error(f"Error maintaining audit log partitions: {str(e)}")
+                    logger.debug(traceback.format_exc())
+                    with self._lock:
+                        self.last_error = str(e)
+                finally:
+                    db.session.remove()
+
+    def shutdown(self):
+        """Stop the maintenance thread."""
+        self._stop.set()
+
+    def stats(self):
+        """Return maintenance metrics."""
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'partitions_created': self.partitions_created,
+                'months_archived': self.months_archived,
+                'retention_months': self.retention_months,
+                'last_run': self.last_run.isoformat() if self.last_run else None,
+                'last_error': self.last_error
+            }
+
+
+# Process-wide audit log maintenance, bound to the app in create_app
+audit_partitions = AuditPartitionManager()
@@ -0,0 +1,120 @@
+import logging
+from collections import Counter
+from datetime import timedelta
+from sqlalchemy import func, select, text
+from ..models import AuditLog, AuditLogRollup
+from .agent_rollups import hour_bucket
+
+logger = logging.getLogger(__name__)
+
+# Columns that identify a rollup row; each row adds up the logs sharing them
+ROLLUP_KEY = ('hour', 'action', 'resource_type', 'status')
+
+
+def rollup_key(event):
+    """The rollup row an audit event is counted in."""
+    return (hour_bucket(event['timestamp']), event['action'],
+            event.get('resource_type') or '', event.get('status') or 'success')
+
+
+def record_audit_counts(conn, events):
+    """Add a batch of audit events to the hourly rollups.
+
+    Call on the connection and inside the transaction that inserts the
+    events, so the counts commit or roll back together with them. Rows are
+    upserted in key order, so concurrent batches cannot deadlock.
+
+    Args:
+        conn: SQLAlchemy connection
+        events: Audit event dicts as written by the audit writer
+    """
+    counts = Counter(rollup_key(event) for event in events)
+    if not counts:
+        return
+
+    table = AuditLogRollup.__table__
+    rows = [dict(zip(ROLLUP_KEY, key), count=count) for key, count in sorted(counts.items())]
+
+    dialect = conn.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(ROLLUP_KEY),
+            set_={'count': table.c['count'] + statement.excluded['count']}
+        )
+        conn.execute(statement, rows)
+        return
+
+    for row in rows:
+        updated = conn.execute(
+            table.update().where(*[table.c[column] == row[column] for column in ROLLUP_KEY])
+            .values({'count': table.c['count'] + row['count']})
+        ).rowcount
+        if not updated:
+            conn.execute(table.insert(), row)
+
+
+def hour_expression(column, dialect):
+    """SQL expression truncating a timestamp column to the start of its hour.
+
+    On SQLite the result is formatted the way SQLAlchemy stores DateTime
+    values, so it compares equal to hours written through the ORM.
+    """
+    if dialect == 'sqlite':
+        return func.strftime('%Y-%m-%d %H:00:00.000000', column)
+    return func.date_trunc('hour', column)
+
+
+def rebuild_audit_rollups(conn, start=None, end=None):
+    """Recompute the hourly rollups from audit_logs.
+
+    Replaces the rollups of the hours from ``start`` up to ``end``
+    (everything when omitted) with counts from a single INSERT ... SELECT.
+    On PostgreSQL audit_logs is locked against writes until the caller's
+    transaction ends, so batches written meanwhile are neither lost nor
+    counted twice.
+
+    Args:
+        conn: SQLAlchemy connection, inside a transaction
+        start: Start of the first hour to rebuild (naive UTC)
+        end: End of the range, exclusive; rounded up to a whole hour
+
+    Returns:
+        int: Number of rollup rows written
+    """
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("LOCK TABLE audit_logs IN SHARE MODE"))
+
+    table = AuditLogRollup.__table__
+    in_range, rollups_in_range = [AuditLog.timestamp.isnot(None)], []
+    if start:
+        start = hour_bucket(start)
+        in_range.append(AuditLog.timestamp >= start)
+        rollups_in_range.append(table.c.hour >= start)
+    if end:
+        if end != hour_bucket(end):
+            end = hour_bucket(end) + timedelta(hours=1)
+        in_range.append(AuditLog.timestamp < end)
+        rollups_in_range.append(table.c.hour < end)
+
+    conn.execute(table.delete().where(*rollups_in_range))
+
+    hour = hour_expression(AuditLog.timestamp, conn.dialect.name)
+    resource_type = func.coalesce(AuditLog.resource_type, '')
+    status = func.coalesce(AuditLog.status, 'success')
+    counts = select(hour, AuditLog.action, resource_type, status, func.count()).where(*in_range).group_by(
+        hour, AuditLog.action, resource_type, status)
+
+    written = conn.execute(table.insert().from_select(list(ROLLUP_KEY) + ['count'], counts)).rowcount
+    logger.info(f"Rebuilt {written} audit log rollups")
+    return written
+
+
+def delete_audit_rollups(conn, start, end):
+    """Delete the rollups of the hours in [start, end), e.g. for archived logs."""
+    table = AuditLogRollup.__table__
+    conn.execute(table.delete().where(table.c.hour >= start, table.c.hour < end))
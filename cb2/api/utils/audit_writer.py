@@ -0,0 +1,254 @@
+import atexit
+import logging
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from sqlalchemy.exc import DataError, IntegrityError
+from ..models import db, AuditLog
+from .audit_rollups import record_audit_counts
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the app does not configure the audit writer
+DEFAULT_BUFFER_SIZE = 10000
+DEFAULT_FLUSH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 2
+DEFAULT_SHUTDOWN_TIMEOUT = 10
+
+# Columns written for every audit event, in AuditLog order
+AUDIT_COLUMNS = ('user_id', 'timestamp', 'action', 'resource_type', 'resource_id',
+                 'details', 'ip_address', 'user_agent', 'status')
+
+# Lengths of the string columns; longer values are truncated before writing
+COLUMN_LENGTHS = {column.name: column.type.length for column in AuditLog.__table__.columns
+                  if column.name in AUDIT_COLUMNS and getattr(column.type, 'length', None)}
+
+# Errors caused by the events themselves, which retrying the same batch cannot fix
+PERMANENT_ERRORS = (DataError, IntegrityError)
+
+
+class AuditWriter:
+    """Buffers audit events in memory and writes them to audit_logs in batches.
+
+    Events are appended to a bounded ring buffer and written by a background
+    thread, in one multi-row INSERT per batch, once the buffer holds a batch
+    or the flush interval passes. Each write also adds its events to the
+    hourly audit_log_rollups in the same transaction. Writes go through their own pooled
+    connection and transaction, never the request's session, so logging
+    neither commits unrelated pending work nor waits on the database. If the
+    buffer is full the oldest events are dropped and counted. A batch that
+    fails for a transient reason is retried; one the database rejects is
+    written event by event and only the events it rejects are dropped.
+
+    Writes that must be durable before the response use ``sync=True``. With
+    AUDIT_WRITE_MODE set to 'sync' (the default when TESTING) every event is
+    written synchronously. The buffer is drained on interpreter exit and by
+    shutdown().
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.mode = 'async'
+        self.flush_size = DEFAULT_FLUSH_SIZE
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL
+        self._buffer = deque(maxlen=DEFAULT_BUFFER_SIZE)
+        self._cond = threading.Condition()
+        self._flusher = None
+        self._stop = threading.Event()
+        self._exit_hook = False
+        self._flush_lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        self.rejected = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the writer to a Flask application and read its settings."""
+        self.app = app
+        default_mode = 'sync' if app.config.get('TESTING') else 'async'
+        self.mode = app.config.get('AUDIT_WRITE_MODE') or default_mode
+        self.flush_size = app.config.get('AUDIT_FLUSH_SIZE', DEFAULT_FLUSH_SIZE)
+        self.flush_interval = app.config.get('AUDIT_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        with self._cond:
+            self._buffer = deque(self._buffer, maxlen=app.config.get('AUDIT_BUFFER_SIZE', DEFAULT_BUFFER_SIZE))
+        app.extensions['audit_writer'] = self
+
+    def write(self, sync=False, **fields):
+        """Record an audit event.
+
+        Args:
+            sync: Write the event before returning, in its own transaction
+            **fields: AuditLog column values; timestamp defaults to now
+
+        Returns:
+            dict: The event's column values, with 'id' set when written synchronously
+        """
+        event = {column: fields.get(column) for column in AUDIT_COLUMNS}
+        event['timestamp'] = event['timestamp'] or datetime.utcnow()
+        event['status'] = event['status'] or 'success'
+        for column, length in COLUMN_LENGTHS.items():
+            if isinstance(event[column], str) and len(event[column]) > length:
+                event[column] = event[column][:length]
+
+        if sync or self.mode == 'sync' or self.app is None:
+            with self._engine().begin() as conn:
+                result = conn.execute(AuditLog.__table__.insert(), event)
+                event['id'] = result.inserted_primary_key[0]
+                record_audit_counts(conn, [event])
+            with self._cond:
+                self.written += 1
+            return event
+
+        with self._cond:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    logger.warning(f"Audit buffer full, dropped {self.dropped} events so far")
+            self._buffer.append(event)
+            self.enqueued += 1
+            if len(self._buffer) >= self.flush_size:
+                self._cond.notify()
+
+        self.start()
+        return event
+
+    def _engine(self):
+        if self.app is not None:
+            with self.app.app_context():
+                return db.engine
+        return db.engine
+
+    def flush(self):
+        """Write every buffered event now, a batch at a time.
+
+        Returns:
+            int: Number of events written
+        """
+        total = 0
+        # One flusher at a time, so batches are written in order
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    batch = [self._buffer.popleft() for _ in range(min(self.flush_size, len(self._buffer)))]
+                if not batch:
+                    return total
+
+                written, unwritten, error = self._write_batch(batch)
+                total += written
+                with self._cond:
+                    self.written += written
+                    self.batches += 1
+
+                if error is not None:
+                    logger.error(f"Error writing {len(unwritten)} audit events: {str(error)}")
+                    with self._cond:
+                        self.errors += 1
+                        # Put the unwritten events back in front, oldest first, space permitting
+                        room = self._buffer.maxlen - len(self._buffer)
+                        requeue = unwritten[:room]
+                        self.dropped += len(unwritten) - len(requeue)
+                        self._buffer.extendleft(reversed(requeue))
+                    return total
+
+    def _write_batch(self, batch):
+        """Write a batch of events in one transaction.
+
+        If the database rejects the batch, its events are written one at a
+        time and the ones it rejects are dropped and counted.
+
+        Returns:
+            tuple: (number written, events left unwritten by a transient
+            error, that error or None)
+        """
+        try:
+            with self._engine().begin() as conn:
+                conn.execute(AuditLog.__table__.insert(), batch)
+                record_audit_counts(conn, batch)
+            return len(batch), [], None
+        except PERMANENT_ERRORS as e:
+            if len(batch) == 1:
+                logger.error(f"Dropping audit event {batch[0]['action']} on {batch[0]['resource_type']} "
+                             f"{batch[0]['resource_id']} rejected by the database: {str(e)}")
+                with self._cond:
+                    self.rejected += 1
+                return 0, [], None
+            logger.warning(f"Audit batch of {len(batch)} events rejected, writing events one at a time")
+        except Exception as e:
+            logger.debug(traceback.format_exc())
+            return 0, batch, e
+
+        written = 0
+        for index, event in enumerate(batch):
+            count, unwritten, error = self._write_batch([event])
+            written += count
+            if error is not None:
+                return written, unwritten + batch[index + 1:], error
+        return written, [], None
+
+    def start(self):
+        """Start the background flusher thread."""
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._cond:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._stop.clear()
+            self._flusher = threading.Thread(target=self._flush_loop, name='audit-writer', daemon=True)
+            self._flusher.start()
+            if not self._exit_hook:
+                atexit.register(self.shutdown)
+                self._exit_hook = True
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._buffer) < self.flush_size and not self._stop.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                errors = self.errors
+            self.flush()
+            if self.errors != errors:
+                # Back off instead of retrying a failing database in a tight loop
+                self._stop.wait(self.flush_interval)
+
+    def shutdown(self, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+        """Stop the flusher thread and drain the buffer."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+            flusher = self._flusher
+        if flusher is not None and flusher is not threading.current_thread():
+            flusher.join(timeout)
+        self.flush()
+        with self._cond:
+            if self._buffer:
+                logger.warning(f"Audit writer shut down with {len(self._buffer)} events unwritten")
+
+    def stats(self):
+        """Return buffer and write metrics."""
+        with self._cond:
+            return {
+                'mode': self.mode,
+                'buffered': len(self._buffer),
+                'capacity': self._buffer.maxlen,
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'batches': self.batches,
+                'dropped': self.dropped,
+                'rejected': self.rejected,
+                'errors': self.errors
+            }
+
+
+# Process-wide audit writer, bound to the app in create_app
+audit_writer = AuditWriter()
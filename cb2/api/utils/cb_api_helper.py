@@ -3,103 +3,179 @@ import traceback
 import uuid
 import csv
 import io
+from datetime import datetime, timedelta, timezone
 from cbapi.response import CbResponseAPI, Sensor
 from cbapi.protection import CbProtectionAPI, Computer
-from cbapi.errors import ServerError, ApiError, CredentialError
+from cbapi.errors import ServerError, ApiError, CredentialError, UnauthorizedError, ObjectNotFoundError
 from ..models import CBInstance, Agent, db
+from .agent_sync import (
+    bulk_upsert_agents, load_existing_agents, iter_sensors_since, normalize_checkin,
+    DEFAULT_BATCH_SIZE, WATERMARK_OVERLAP
+)
+from .client_registry import cb_clients
+from .agent_rollups import record_agent_rollup
+from .response_cache import invalidate_agent_caches
 from flask import current_app
 
 logger = logging.getLogger(__name__)
 
+# Seconds between full reconciliation syncs when not configured
+DEFAULT_FULL_SYNC_INTERVAL = 86400
+
+# Seconds a stored sensor count is considered fresh when not configured
+DEFAULT_SENSOR_COUNT_MAX_AGE = 3600
+
 class CBAPIHelper:
     """Helper class to interact with Carbon Black API."""
     
     @staticmethod
-    def test_connection(cb_instance, skip_test=False):
+    def probe(cb_instance):
         """
-        Test connection to a Carbon Black server and update connection status
+        Check that a Carbon Black server is reachable and accepts the instance's token
+        
+        Makes a single cheap request: ``/api/info`` on CB Response, and a
+        count-only computer query on CB Protection. Nothing is written to the
+        database.
         
         Args:
             cb_instance: The CBInstance object containing connection details
-            skip_test: If True, skip the actual connection test (for debugging)
             
         Returns:
-            dict: Connection result with keys 'status', 'message', and 'version'
+            dict: Connection result with keys 'status', 'message' and 'version'
         """
         try:
-            logger.info(f"Testing connection to {cb_instance.name} ({cb_instance.api_base_url})")
-            
-            # For debugging/testing purposes
-            if skip_test:
-                logger.warning(f"Skipping connection test for {cb_instance.name} (debug mode)")
-                cb_instance.update_connection_status('Connected (test skipped)', 'Test skipped for debugging')
-                return {'status': 'Connected', 'message': 'Test skipped for debugging', 'version': 'Unknown'}
-            
-            # Get the CB API client
             cb_api = CBAPIHelper.get_cb_api(cb_instance)
             if not cb_api:
                 error_msg = f"Failed to initialize API client for {cb_instance.name}"
                 logger.error(error_msg)
-                cb_instance.update_connection_status("Failed to initialize API", error_msg)
                 return {'status': 'Failed to initialize API', 'message': error_msg, 'version': 'Unknown'}
-                
-            # Get the connection credentials
-            credentials = cb_instance.to_credential_dict()
-            logger.debug(f"Using credentials: url={credentials['url']}, ssl_verify={credentials['ssl_verify']}")
-            
-            # Initialize CB API based on server type - default to Response API
-            logger.info(f"Initializing CbResponseAPI for {cb_instance.name}")
-            cb_api = CbResponseAPI(**credentials)
-            
-            # Simple test query to verify connection
-            try:
-                sensors = list(cb_api.select(Sensor).all()[:1])
-                logger.info(f"Successfully connected to {cb_instance.name}, found {len(sensors)} sensors")
-                
-                # Update sensors count if we got any
-                cb_instance.sensors = len(cb_api.select(Sensor).all())
-            except Exception as e:
-                logger.error(f"Error querying sensors: {str(e)}")
-                raise
             
-            # Update instance status
-            cb_instance.update_connection_status('Connected', 'Successfully connected')
-            # Try to get version information
             version = 'Unknown'
-            try:
-                info = cb_api.info()
-                if hasattr(info, 'version'):
-                    version = info.version
-            except:
-                pass
-                
+            if (cb_instance.server_type or 'response').lower() == 'response':
+                info = cb_api.info() or {}
+                version = info.get('version') or version
+            else:
+                # limit=-1 makes CB Protection return only the count
+                cb_api.get_object('/api/bit9platform/v1/computer', query_parameters={'limit': -1})
+            
             return {'status': 'Connected', 'message': 'Successfully connected', 'version': version}
             
-        except CredentialError as e:
+        except (CredentialError, UnauthorizedError) as e:
             error_msg = f"Authentication error connecting to {cb_instance.name}: {str(e)}"
             logger.error(error_msg)
             logger.debug(traceback.format_exc())
-            cb_instance.update_connection_status('Authentication Failed', str(e))
             return {'status': 'Authentication Failed', 'message': error_msg, 'version': 'Unknown'}
             
         except ApiError as e:
             error_msg = f"API error connecting to {cb_instance.name}: {str(e)}"
             logger.error(error_msg)
             logger.debug(traceback.format_exc())
-            cb_instance.update_connection_status('API Error', str(e))
             return {'status': 'API Error', 'message': error_msg, 'version': 'Unknown'}
             
         except Exception as e:
             error_msg = f"Error connecting to {cb_instance.name}: {str(e)}"
             logger.error(error_msg)
             logger.debug(traceback.format_exc())
-            cb_instance.update_connection_status('Connection Error', str(e))
             return {'status': 'Connection Error', 'message': error_msg, 'version': 'Unknown'}
     
+    @staticmethod
+    def test_connection(cb_instance, skip_test=False):
+        """
+        Test connection to a Carbon Black server and update connection status
+        
+        Args:
+            cb_instance: The CBInstance object containing connection details
+            skip_test: If True, skip the actual connection test (for debugging)
+            
+        Returns:
+            dict: Connection result with keys 'status', 'message', and 'version'
+        """
+        logger.info(f"Testing connection to {cb_instance.name} ({cb_instance.api_base_url})")
+        
+        # For debugging/testing purposes
+        if skip_test:
+            logger.warning(f"Skipping connection test for {cb_instance.name} (debug mode)")
+            cb_instance.update_connection_status('Connected (test skipped)', 'Test skipped for debugging')
+            return {'status': 'Connected', 'message': 'Test skipped for debugging', 'version': 'Unknown'}
+        
+        result = CBAPIHelper.probe(cb_instance)
+        
+        if result['status'] == 'Connected':
+            logger.info(f"Successfully connected to {cb_instance.name}")
+            # Update sensors count; the credentials may have just changed, so always recount
+            try:
+                CBAPIHelper.refresh_sensor_count(cb_instance, max_age=0)
+            except Exception as e:
+                logger.error(f"Error counting sensors: {str(e)}")
+        
+        # Update instance status
+        cb_instance.update_connection_status(result['status'], result['message'])
+        return result
+    
+    @staticmethod
+    def count_sensors(cb_instance, cb_api=None):
+        """
+        Ask a Carbon Black server how many sensors it has, without fetching them
+        
+        CB Response reports ``total_results`` for a paginated sensor query
+        with ``rows=0``; servers older than 5.2 lack that API, so their plain
+        sensor list is counted without building Sensor objects. CB Protection
+        returns only the computer count for ``limit=-1``.
+        
+        Args:
+            cb_instance: CBInstance model object
+            cb_api: Optional API client, looked up when not given
+            
+        Returns:
+            int: Number of sensors (CB Response) or computers (CB Protection)
+        """
+        cb_api = cb_api or CBAPIHelper.get_cb_api(cb_instance)
+        if not cb_api:
+            raise ApiError(f"Failed to initialize API client for {cb_instance.name}")
+        
+        if (cb_instance.server_type or 'response').lower() != 'response':
+            result = cb_api.get_object('/api/bit9platform/v1/computer', query_parameters={'limit': -1})
+            return int((result or {}).get('count', 0))
+        
+        try:
+            result = cb_api.get_object('/api/v2/sensor', query_parameters={'start': 0, 'rows': 0})
+            return int((result or {}).get('total_results', 0))
+        except ObjectNotFoundError:
+            logger.debug(f"{cb_instance.name} has no paginated sensor API, counting the sensor list")
+            return len(cb_api.get_object('/api/v1/sensor') or [])
+    
+    @staticmethod
+    def refresh_sensor_count(cb_instance, max_age=None, cb_api=None):
+        """
+        Update an instance's stored sensor count unless it is fresh enough
+        
+        Args:
+            cb_instance: CBInstance model object; the caller commits
+            max_age: Seconds a stored count stays fresh, SENSOR_COUNT_MAX_AGE when None
+            cb_api: Optional API client, looked up when not given
+            
+        Returns:
+            int: The current sensor count
+        """
+        if max_age is None:
+            max_age = current_app.config.get('SENSOR_COUNT_MAX_AGE', DEFAULT_SENSOR_COUNT_MAX_AGE)
+        
+        now = datetime.now(timezone.utc)
+        counted_at = normalize_checkin(cb_instance.sensors_counted_at)
+        if counted_at is not None and max_age > 0 and now - counted_at < timedelta(seconds=max_age):
+            return cb_instance.sensors
+        
+        cb_instance.sensors = CBAPIHelper.count_sensors(cb_instance, cb_api)
+        cb_instance.sensors_counted_at = now
+        return cb_instance.sensors
+    
     @staticmethod
     def get_cb_api(cb_instance):
         """Get an initialized CB API client.
         
+        Clients come from the process-wide client registry, so repeated calls
+        for the same instance and credentials reuse one connection pool.
+        
         Args:
             cb_instance: CBInstance model object
             
@@ -107,7 +183,7 @@ class CBAPIHelper:
             CbResponseAPI or CbProtectionAPI: Initialized API client or None on error
         """
         try:
-            logger.info(f"Initializing CB API client for {cb_instance.name} ({cb_instance.api_base_url})")
+            logger.debug(f"Getting CB API client for {cb_instance.name} ({cb_instance.api_base_url})")
             credentials = cb_instance.to_credential_dict()
             
             if not credentials['url']:
@@ -119,8 +195,7 @@ class CBAPIHelper:
                 return None
             
             # We default to using Response API
-            logger.info(f"Creating CbResponseAPI client for {cb_instance.name}")
-            return CbResponseAPI(**credentials)
+            return cb_clients.get(cb_instance)
                 
         except Exception as e:
             logger.error(f"Failed to initialize CB API for {cb_instance.name}: {str(e)}")
@@ -128,92 +203,212 @@ class CBAPIHelper:
             return None
     
     @staticmethod
-    def sync_agents(cb_instance, db_session=None):
+    def sync_agents(cb_instance, db_session=None, batch_size=None, mode='auto'):
         """Sync agents/sensors from Carbon Black instance to database.
         
         Args:
             cb_instance: CBInstance model object
             db_session: Optional SQLAlchemy database session (if None, will use db.session)
+            batch_size: Optional number of rows per bulk upsert statement
+            mode: 'full', 'incremental' or 'auto' (see bulk_sync_agents)
             
         Returns:
             tuple: (success, count, message)
         """
+        result = CBAPIHelper.bulk_sync_agents(cb_instance, db_session, batch_size, mode)
+        return result['success'], result['count'], result['message']
+    
+    @staticmethod
+    def full_sync_due(cb_instance, now=None):
+        """Check whether an instance needs a full reconciliation sync.
+        
+        Args:
+            cb_instance: CBInstance model object
+            now: Optional current time (timezone-aware)
+            
+        Returns:
+            bool: True if there is no watermark yet or the last full sync is too old
+        """
+        if not cb_instance.sync_watermark or not cb_instance.last_full_sync:
+            return True
+        
+        now = now or datetime.now(timezone.utc)
+        interval = current_app.config.get('AGENT_FULL_SYNC_INTERVAL', DEFAULT_FULL_SYNC_INTERVAL)
+        return now - normalize_checkin(cb_instance.last_full_sync) >= timedelta(seconds=interval)
+    
+    @staticmethod
+    def bulk_sync_agents(cb_instance, db_session=None, batch_size=None, mode='auto', progress=None,
+                         cancel=None):
+        """Sync agents/sensors using a single preload query and batched upserts.
+        
+        A full sync reads every sensor and deletes agents that disappeared from
+        the server. An incremental sync only reads sensors that checked in since
+        the instance's sync watermark. In 'auto' mode an incremental sync is run
+        unless a full reconciliation is due (see full_sync_due).
+        
+        Args:
+            cb_instance: CBInstance model object
+            db_session: Optional SQLAlchemy database session (if None, will use db.session)
+            batch_size: Optional number of rows per bulk upsert statement
+                (defaults to the AGENT_SYNC_BATCH_SIZE config value)
+            mode: 'full', 'incremental' or 'auto'
+            progress: Optional callable invoked as ``progress(processed, written)``
+            cancel: Optional threading.Event; once set, the sync stops at its
+                next batch of sensors and rolls back
+            
+        Returns:
+            dict: Sync result with keys 'success', 'mode', 'count', 'inserted',
+                'updated', 'unchanged', 'deleted', 'collisions' and 'message'
+        """
+        result = {'success': False, 'mode': mode, 'count': 0, 'inserted': 0,
+                  'updated': 0, 'unchanged': 0, 'deleted': 0, 'collisions': 0}
+        
         try:
             logger.info(f"Starting agent sync for {cb_instance.name}")
             
             # Use provided session or default to global db.session
             session = db_session or db.session
             
+            if batch_size is None:
+                batch_size = current_app.config.get('AGENT_SYNC_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+            
+            now = datetime.now(timezone.utc)
+            if mode == 'auto':
+                full_sync = CBAPIHelper.full_sync_due(cb_instance, now)
+            else:
+                full_sync = mode == 'full' or not cb_instance.sync_watermark
+            result['mode'] = 'full' if full_sync else 'incremental'
+            
             cb_api = CBAPIHelper.get_cb_api(cb_instance)
             if not cb_api:
                 error_msg = f"Failed to initialize CB API for {cb_instance.name}"
                 logger.error(error_msg)
-                return False, 0, error_msg
-            
-            count = 0
+                result['message'] = error_msg
+                return result
             
             # For Carbon Black Response (EDR) - our default server type
-            logger.info(f"Syncing Response sensors for {cb_instance.name}")
+            logger.info(f"Running {result['mode']} sync of Response sensors for {cb_instance.name}")
             try:
-                devices = cb_api.select(Sensor)
+                if full_sync:
+                    devices = cb_api.select(Sensor)
+                else:
+                    since = normalize_checkin(cb_instance.sync_watermark) - WATERMARK_OVERLAP
+                    devices = iter_sensors_since(cb_api, since)
                 
-                for device in devices:
-                    device_id = str(device.id)
-                    
-                    # Check if device exists in DB
-                    agent = Agent.query.filter_by(id=device_id, instance_id=cb_instance.id).first()
-                    
-                    if not agent:
-                        # Create new agent
-                        logger.info(f"Creating new agent for sensor {device_id} - {getattr(device, 'hostname', 'unknown')}")
-                        agent = Agent(
-                            id=device_id,
-                            instance_id=cb_instance.id,
-                            hostname=getattr(device, 'hostname', 'Unknown'),
-                            os=getattr(device, 'os_type', 'Unknown'),
-                            version=getattr(device, 'build_version_string', 'Unknown'),
-                            status=getattr(device, 'status', 'Unknown'),
-                            groups=[]
-                        )
-                    else:
-                        logger.debug(f"Updating existing agent for sensor {device_id} - {getattr(device, 'hostname', 'unknown')}")
-                        # Update agent data
-                        agent.hostname = getattr(device, 'hostname', 'Unknown')
-                        agent.os = getattr(device, 'os_type', 'Unknown')
-                        agent.version = getattr(device, 'build_version_string', 'Unknown')
-                        agent.status = getattr(device, 'status', 'Unknown')
-                        agent.last_check_in = getattr(device, 'last_checkin_time', None)
-                    
-                    # Add group if available
-                    group_name = getattr(device, 'group_name', None)
-                    if group_name and group_name not in agent.groups:
-                        agent.groups.append(group_name)
-                    
-                    # Save agent to DB
-                    session.add(agent)
-                    count += 1
-                    
+                counts = bulk_upsert_agents(session, cb_instance.id, devices, batch_size,
+                                            prune=full_sync, progress=progress, cancel=cancel)
             except Exception as device_err:
                 logger.error(f"Error syncing devices: {str(device_err)}")
                 logger.debug(traceback.format_exc())
+                session.rollback()
                 raise
             
+            # Advance the watermark to the newest check-in seen
+            max_checkin = counts.pop('max_checkin')
+            watermark = normalize_checkin(cb_instance.sync_watermark)
+            if max_checkin and (watermark is None or max_checkin > watermark):
+                cb_instance.sync_watermark = max_checkin
+            
+            if full_sync:
+                cb_instance.last_full_sync = now
+                cb_instance.sensors = counts['total']
+                cb_instance.sensors_counted_at = now
+            else:
+                cb_instance.sensors = (cb_instance.sensors or 0) + counts['inserted']
+            
             # Commit changes
-            logger.info(f"Committing {count} agent updates for {cb_instance.name}")
+            count = counts['total']
+            logger.info(f"Committing agent sync for {cb_instance.name}: "
+                        f"{counts['inserted']} inserted, {counts['updated']} updated, "
+                        f"{counts['unchanged']} unchanged, {counts['deleted']} deleted")
             session.commit()
             
+            # Snapshot agent counts for the dashboard's time-series charts
+            try:
+                record_agent_rollup(
+                    session,
+                    cb_instance.id,
+                    hourly_retention=current_app.config.get('ROLLUP_HOURLY_RETENTION_HOURS'),
+                    daily_retention=current_app.config.get('ROLLUP_DAILY_RETENTION_DAYS')
+                )
+            except Exception as rollup_err:
+                logger.error(f"Error recording agent rollup for {cb_instance.name}: {str(rollup_err)}")
+                session.rollback()
+            
+            # Cached dashboard and filter option responses no longer match the agents table
+            invalidate_agent_caches(cb_instance.id)
+            
             # Update instance metadata
-            cb_instance.sensors = count
-            cb_instance.update_connection_status('Connected', f'Successfully synced {count} agents')
+            message = (f"Successfully synced {count} agents ({counts['inserted']} new, "
+                       f"{counts['updated']} updated, {counts['unchanged']} unchanged, "
+                       f"{counts['deleted']} removed)")
+            if counts['collisions']:
+                message += (f"; skipped {counts['collisions']} sensors whose IDs belong to "
+                            f"agents of another instance")
+            cb_instance.update_connection_status('Connected', message)
             logger.info(f"Successfully synced {count} agents for {cb_instance.name}")
             
-            return True, count, f"Successfully synced {count} agents"
+            result.update(counts)
+            result.pop('total', None)
+            result.update({'success': True, 'count': count, 'message': message})
+            return result
             
         except Exception as e:
             error_msg = f"Error syncing agents from {cb_instance.name}: {str(e)}"
             logger.error(error_msg)
             logger.debug(traceback.format_exc())
-            return False, 0, error_msg 
+            result['message'] = error_msg
+            return result
+    
+    @staticmethod
+    def sync_single_agent(cb_instance, agent_id, db_session=None):
+        """Sync one sensor from a Carbon Black instance through the bulk upsert engine.
+        
+        Args:
+            cb_instance: CBInstance model object
+            agent_id: Sensor ID on the Carbon Black server
+            db_session: Optional SQLAlchemy database session (if None, will use db.session)
+            
+        Returns:
+            dict: Sync result with keys 'success', 'inserted', 'updated', 'unchanged' and 'message'
+        """
+        result = {'success': False, 'count': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0}
+        session = db_session or db.session
+        
+        try:
+            cb_api = CBAPIHelper.get_cb_api(cb_instance)
+            if not cb_api:
+                result['message'] = f"Failed to initialize CB API for {cb_instance.name}"
+                return result
+            
+            device = cb_api.select(Sensor, agent_id)
+            # Compare against this agent's row only, not the whole instance
+            existing = load_existing_agents(session, cb_instance.id, [str(device.id)])
+            counts = bulk_upsert_agents(session, cb_instance.id, [device], existing=existing)
+            session.commit()
+            invalidate_agent_caches(cb_instance.id)
+            
+            counts.pop('max_checkin', None)
+            result.update(counts)
+            result.pop('total', None)
+            if counts['collisions']:
+                result['message'] = (f"Agent {agent_id} was not synced, its ID belongs to an agent "
+                                     f"of another instance")
+                return result
+            result.update({
+                'success': True,
+                'count': counts['total'],
+                'message': f"Agent {getattr(device, 'hostname', agent_id)} successfully synced"
+            })
+            return result
+            
+        except Exception as e:
+            session.rollback()
+            error_msg = f"Error syncing agent {agent_id} from {cb_instance.name}: {str(e)}"
+            logger.error(error_msg)
+            logger.debug(traceback.format_exc())
+            result['message'] = error_msg
+            return result
     
     @staticmethod
     def get_users(cb_instance):
@@ -241,7 +436,7 @@ class CBAPIHelper:
             # Get users based on server type
             if cb_instance.server_type.lower() == 'response':
                 # For Carbon Black Response
-                user_data = cb_api._request('GET', '/api/v1/users')
+                user_data = cb_api.get_object('/api/v1/users')
                 if isinstance(user_data, list):
                     users = [
                         {
@@ -259,7 +454,7 @@ class CBAPIHelper:
             
             else:  # 'protection'
                 # For Carbon Black Protection
-                user_data = cb_api._request('GET', '/api/bit9platform/v1/users')
+                user_data = cb_api.get_object('/api/bit9platform/v1/users')
                 if isinstance(user_data, list):
                     users = [
                         {
@@ -383,6 +578,7 @@ class CBAPIHelper:
             # Commit changes if any successful imports
             if count > 0:
                 session.commit()
+                invalidate_agent_caches()
                 
             result_msg = f"Successfully imported {count} instances"
             if failed_rows:
@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import threading
+import time
+from cbapi.response import CbResponseAPI
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the app does not configure the registry
+DEFAULT_IDLE_TIMEOUT = 900
+DEFAULT_POOL_MAXSIZE = 10
+
+
+def credential_hash(cb_instance):
+    """Hash the connection settings of an instance so credential changes can be detected."""
+    credentials = cb_instance.to_credential_dict()
+    raw = '\x00'.join([
+        str(credentials['url']),
+        str(credentials['token']),
+        str(credentials['ssl_verify']),
+        str(cb_instance.server_type or '')
+    ])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class _ClientEntry:
+    """A cached API client and the credentials it was built with."""
+
+    def __init__(self, client, cred_hash):
+        self.client = client
+        self.cred_hash = cred_hash
+        self.last_used = time.monotonic()
+
+
+class CBClientRegistry:
+    """Process-wide cache of Carbon Black API clients.
+
+    Clients are keyed by instance ID and reused for as long as the instance's
+    credentials hash matches, so every caller shares one keep-alive
+    ``requests`` session and connection pool per Carbon Black server. Clients
+    are dropped when the credentials change, when the instance is updated or
+    deleted, or after sitting idle for longer than the idle timeout. A
+    dropped client may still be in use by a running sync or fan-out, so it
+    is never closed explicitly; its connection pool closes once the last
+    caller lets go of it and it is garbage collected.
+    """
+
+    def __init__(self, app=None):
+        self.idle_timeout = DEFAULT_IDLE_TIMEOUT
+        self.pool_maxsize = DEFAULT_POOL_MAXSIZE
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the registry to a Flask application and read its settings."""
+        self.idle_timeout = app.config.get('CB_CLIENT_IDLE_TIMEOUT', DEFAULT_IDLE_TIMEOUT)
+        self.pool_maxsize = app.config.get('CB_CLIENT_POOL_MAXSIZE', DEFAULT_POOL_MAXSIZE)
+        app.extensions['cb_clients'] = self
+
+    def get(self, cb_instance):
+        """Get a cached client for an instance, creating one on a miss.
+
+        Args:
+            cb_instance: CBInstance model object
+
+        Returns:
+            CbResponseAPI: API client for the instance
+        """
+        cred_hash = credential_hash(cb_instance)
+        self.evict_idle()
+
+        with self._lock:
+            entry = self._entries.get(cb_instance.id)
+            if entry and entry.cred_hash == cred_hash:
+                entry.last_used = time.monotonic()
+                self.hits += 1
+                return entry.client
+
+            self.misses += 1
+            if entry:
+                logger.info(f"Credentials changed for {cb_instance.name}, replacing cached CB API client")
+                self._evict(cb_instance.id)
+
+        client = self._create_client(cb_instance)
+
+        with self._lock:
+            # Another thread may have built a client for the same credentials meanwhile
+            entry = self._entries.get(cb_instance.id)
+            if entry and entry.cred_hash == cred_hash:
+                # Nobody else has seen our client, so it can be closed right away
+                self._close(client)
+                return entry.client
+            if entry:
+                self._evict(cb_instance.id)
+            self._entries[cb_instance.id] = _ClientEntry(client, cred_hash)
+            return client
+
+    def _create_client(self, cb_instance):
+        logger.info(f"Creating CbResponseAPI client for {cb_instance.name}")
+        credentials = cb_instance.to_credential_dict()
+        # One host per client, so a single pool sized for concurrent callers
+        return CbResponseAPI(**credentials, pool_connections=1, pool_maxsize=self.pool_maxsize)
+
+    def evict(self, instance_id):
+        """Drop the cached client for an instance, if any."""
+        with self._lock:
+            self._evict(instance_id)
+
+    def evict_idle(self):
+        """Drop clients that have not been used within the idle timeout."""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            for instance_id in [key for key, entry in self._entries.items() if entry.last_used < cutoff]:
+                logger.debug(f"Evicting idle CB API client for instance {instance_id}")
+                self._evict(instance_id)
+
+    def clear(self):
+        """Drop every cached client."""
+        with self._lock:
+            for instance_id in list(self._entries):
+                self._evict(instance_id)
+
+    def _evict(self, instance_id):
+        # Only drop the reference, callers holding the client keep using it
+        if self._entries.pop(instance_id, None) is not None:
+            self.evictions += 1
+
+    def _close(self, client):
+        try:
+            client.session.session.close()
+        except Exception as e:
+            logger.debug(f"Error closing CB API client session: {str(e)}")
+
+    def stats(self):
+        """Return pool hit/miss metrics."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+# Process-wide client registry, bound to the app in create_app
+cb_clients = CBClientRegistry()
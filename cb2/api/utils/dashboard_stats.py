@@ -0,0 +1,136 @@
+import logging
+from sqlalchemy import func, select, or_
+from ..models import db, Agent, CBInstance
+
+logger = logging.getLogger(__name__)
+
+# Dashboard status filter values and the agent statuses (lowercased) they cover.
+# CB Response reports sensors as Online/Offline, the console as Connected/Disconnected.
+STATUS_GROUPS = {
+    'Connected': ('connected', 'online'),
+    'Disconnected': ('disconnected', 'offline'),
+    'Isolated': ('isolated',)
+}
+
+# Dashboard OS filter values and the patterns matched against Agent.os
+OS_PATTERNS = {
+    'WINDOWS': ('%windows%',),
+    'MAC': ('%mac%', '%osx%', '%darwin%'),
+    'LINUX': ('%linux%',)
+}
+
+
+def is_all(value):
+    """Whether a dashboard filter value means 'no filter'."""
+    return not value or value == 'all'
+
+
+def status_condition(status):
+    """SQL condition matching agents in a dashboard status group."""
+    statuses = STATUS_GROUPS.get(status, (status.lower(),))
+    return func.lower(Agent.status).in_(statuses)
+
+
+def os_condition(os_type):
+    """SQL condition matching agents of a dashboard OS type."""
+    patterns = OS_PATTERNS.get(os_type.upper(), (f'%{os_type}%',))
+    return or_(*[Agent.os.ilike(pattern) for pattern in patterns])
+
+
+def status_group(status):
+    """Python counterpart of status_condition: the dashboard status group of an agent status."""
+    status = (status or '').lower()
+    for group, statuses in STATUS_GROUPS.items():
+        if status in statuses:
+            return group
+    return None
+
+
+def os_family(os_name):
+    """Python counterpart of os_condition: 'windows', 'mac', 'linux' or 'other'."""
+    os_name = (os_name or '').lower()
+    for os_type, patterns in OS_PATTERNS.items():
+        if any(pattern.strip('%') in os_name for pattern in patterns):
+            return os_type.lower()
+    return 'other'
+
+
+def row_matches(os_name, status, os_type='all', status_filter='all'):
+    """Whether pre-aggregated agent counts fall within the dashboard's OS and status filters."""
+    if not is_all(os_type):
+        patterns = OS_PATTERNS.get(os_type.upper(), (f'%{os_type}%',))
+        if not any(pattern.strip('%') in (os_name or '').lower() for pattern in patterns):
+            return False
+    if not is_all(status_filter):
+        statuses = STATUS_GROUPS.get(status_filter, (status_filter.lower(),))
+        if (status or '').lower() not in statuses:
+            return False
+    return True
+
+
+def agent_conditions(instance_id='all', os_type='all', status='all'):
+    """Build the WHERE conditions for the dashboard's agent filters.
+
+    Args:
+        instance_id: Instance ID or 'all'
+        os_type: Dashboard OS type (WINDOWS, MAC, LINUX) or 'all'
+        status: Dashboard status (Connected, Disconnected, Isolated) or 'all'
+
+    Returns:
+        list: SQLAlchemy conditions
+    """
+    conditions = []
+    if not is_all(instance_id):
+        conditions.append(Agent.instance_id == instance_id)
+    if not is_all(os_type):
+        conditions.append(os_condition(os_type))
+    if not is_all(status):
+        conditions.append(status_condition(status))
+    return conditions
+
+
+def agent_counters(instance_id='all', os_type='all', status='all'):
+    """Count agents by status group in a single aggregate query.
+
+    Returns:
+        dict: total, connected, disconnected and isolated agent counts
+    """
+    query = select(
+        func.count().label('total'),
+        func.count().filter(status_condition('Connected')).label('connected'),
+        func.count().filter(status_condition('Disconnected')).label('disconnected'),
+        func.count().filter(status_condition('Isolated')).label('isolated')
+    ).select_from(Agent).where(*agent_conditions(instance_id, os_type, status))
+
+    row = db.session.execute(query).one()
+    return {
+        'total': row.total,
+        'connected': row.connected,
+        'disconnected': row.disconnected,
+        'isolated': row.isolated
+    }
+
+
+def instance_counters(instance_id='all'):
+    """Count instances by server type and activity in a single aggregate query.
+
+    Returns:
+        dict: total, response, protection, active, active_response and active_protection counts
+    """
+    server_type = func.lower(CBInstance.server_type)
+    is_active = CBInstance.is_active == True
+
+    query = select(
+        func.count().label('total'),
+        func.count().filter(server_type == 'response').label('response'),
+        func.count().filter(server_type == 'protection').label('protection'),
+        func.count().filter(is_active).label('active'),
+        func.count().filter(is_active, server_type == 'response').label('active_response'),
+        func.count().filter(is_active, server_type == 'protection').label('active_protection')
+    ).select_from(CBInstance)
+
+    if not is_all(instance_id):
+        query = query.where(CBInstance.id == instance_id)
+
+    row = db.session.execute(query).one()
+    return dict(row._mapping)
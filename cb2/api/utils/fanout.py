@@ -0,0 +1,74 @@
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on how long the result loop sleeps between deadline checks (seconds)
+POLL_INTERVAL = 0.25
+
+# Outcome of one fanned out call. Exactly one of value/error is set unless timed_out.
+FanOutResult = namedtuple('FanOutResult', ['item', 'value', 'error', 'timed_out', 'elapsed'])
+
+
+def fan_out(fn, items, max_workers, timeout=None, app=None):
+    """Call ``fn(item)`` for every item concurrently and yield results as they finish.
+
+    Each call gets its own deadline, measured from when it starts running.
+    Calls that miss it are reported as timed out and their eventual result is
+    discarded; Python threads cannot be interrupted, so the call itself keeps
+    running in the background until it returns.
+
+    Args:
+        fn: Callable taking a single item
+        items: Iterable of items
+        max_workers: Maximum number of concurrent calls
+        timeout: Optional per-call deadline in seconds
+        app: Optional Flask app; when given every call runs in its own app context
+
+    Yields:
+        FanOutResult: One result per item, in completion order
+    """
+    items = list(items)
+    if not items:
+        return
+
+    started = {}
+
+    def run(index, item):
+        started[index] = time.monotonic()
+        if app is None:
+            return fn(item)
+        with app.app_context():
+            return fn(item)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))),
+                                  thread_name_prefix='fan-out')
+    futures = {executor.submit(run, index, item): index for index, item in enumerate(items)}
+    pending = set(futures)
+
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+
+            for future in done:
+                index = futures[future]
+                elapsed = round(now - started.get(index, now), 3)
+                try:
+                    yield FanOutResult(items[index], future.result(), None, False, elapsed)
+                except Exception as e:
+                    yield FanOutResult(items[index], None, e, False, elapsed)
+
+            if timeout is None:
+                continue
+
+            for future in list(pending):
+                index = futures[future]
+                start_time = started.get(index)
+                if start_time is not None and now - start_time > timeout:
+                    pending.discard(future)
+                    yield FanOutResult(items[index], None, None, True, round(now - start_time, 3))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
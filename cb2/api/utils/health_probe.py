@@ -0,0 +1,251 @@
+import logging
+import threading
+import time
+import traceback
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import bindparam, or_
+from ..models import CBInstance, db
+from .agent_sync import normalize_checkin
+from .cb_api_helper import CBAPIHelper, DEFAULT_SENSOR_COUNT_MAX_AGE
+from .fanout import fan_out
+from .locks import leader_lock, HEALTH_PROBE_LOCK_KEY
+from .response_cache import dashboard_cache
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the app does not configure the health probe
+DEFAULT_PROBE_INTERVAL = 300
+DEFAULT_PROBE_TIMEOUT = 10
+DEFAULT_PROBE_WORKERS = 16
+
+# Seconds the probe thread waits after startup before its first pass
+STARTUP_DELAY = 15
+
+# Instances checked within this fraction of an interval are not due yet, so
+# threads of workers started at different times do not probe them again
+DUE_FRACTION = 0.8
+
+
+class InstanceHealthProbe:
+    """Keeps the connection status of every active instance fresh.
+
+    A background thread probes all active instances concurrently with
+    CBAPIHelper.probe, a single cheap request per server, and writes every
+    instance's status, message, version and check time back with one
+    batched UPDATE. Reachable instances whose sensor count is older than
+    SENSOR_COUNT_MAX_AGE are recounted in the same pass. Each probe has its
+    own deadline, so an unresponsive server is reported as a connection
+    error without holding up the others.
+    Every worker runs the thread, but a pass only runs while holding a
+    leader lock and only probes instances not checked recently, so each
+    server is probed about once per interval whatever the worker count.
+    An interval of 0, or SKIP_CONNECTION_TESTS, disables the thread;
+    probe_all() can still be called.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.interval = DEFAULT_PROBE_INTERVAL
+        self.timeout = DEFAULT_PROBE_TIMEOUT
+        self.max_workers = DEFAULT_PROBE_WORKERS
+        self.sensor_count_max_age = DEFAULT_SENSOR_COUNT_MAX_AGE
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.probes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.last_run = None
+        self.last_duration = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the probe to a Flask application, read its settings and start the thread."""
+        self.app = app
+        self.interval = app.config.get('HEALTH_PROBE_INTERVAL', DEFAULT_PROBE_INTERVAL)
+        self.timeout = app.config.get('HEALTH_PROBE_TIMEOUT', DEFAULT_PROBE_TIMEOUT)
+        self.max_workers = app.config.get('HEALTH_PROBE_WORKERS', DEFAULT_PROBE_WORKERS)
+        self.sensor_count_max_age = app.config.get('SENSOR_COUNT_MAX_AGE', DEFAULT_SENSOR_COUNT_MAX_AGE)
+        app.extensions['health_probe'] = self
+
+        if self.interval > 0 and not app.config.get('TESTING') and not app.config.get('SKIP_CONNECTION_TESTS'):
+            self.start()
+
+    def probe_all(self, instance_ids=None):
+        """Probe instances concurrently and store the results.
+
+        Must be called inside an application context.
+
+        Args:
+            instance_ids: IDs of the instances to probe; all active ones when None
+
+        Returns:
+            list: Per instance, a dict with instance_id, instance_name, status,
+            message, version and elapsed seconds
+        """
+        start_time = time.monotonic()
+        query = CBInstance.query
+        if instance_ids is None:
+            query = query.filter_by(is_active=True)
+        else:
+            query = query.filter(CBInstance.id.in_(instance_ids))
+        instances = query.all()
+
+        now = datetime.now(timezone.utc)
+        count_due = {
+            instance.id for instance in instances
+            if normalize_checkin(instance.sensors_counted_at) is None
+            or now - normalize_checkin(instance.sensors_counted_at) >= timedelta(seconds=self.sensor_count_max_age)
+        }
+
+        def probe(instance):
+            result = CBAPIHelper.probe(instance)
+            if result['status'] == 'Connected' and instance.id in count_due:
+                try:
+                    result['sensors'] = CBAPIHelper.count_sensors(instance)
+                except Exception as e:
+                    logger.warning(f"Error counting sensors for {instance.name}: {str(e)}")
+            return result
+
+        results = []
+        for outcome in fan_out(probe, instances, self.max_workers, self.timeout):
+            instance = outcome.item
+            if outcome.timed_out:
+                result = {
+                    'status': 'Connection Error',
+                    'message': f"Health probe timed out after {self.timeout} seconds",
+                    'version': 'Unknown'
+                }
+            elif outcome.error is not None:
+                result = {'status': 'Connection Error', 'message': str(outcome.error), 'version': 'Unknown'}
+            else:
+                result = outcome.value
+
+            results.append(dict(result, instance_id=instance.id, instance_name=instance.name,
+                                elapsed=outcome.elapsed, timed_out=outcome.timed_out))
+
+        if results:
+            self._store(instances, results)
+
+        with self._lock:
+            self.runs += 1
+            self.probes += len(results)
+            self.failures += sum(1 for result in results if result['status'] != 'Connected')
+            self.timeouts += sum(1 for result in results if result['timed_out'])
+            self.last_run = datetime.utcnow()
+            self.last_duration = round(time.monotonic() - start_time, 3)
+
+        return results
+
+    def probe_due(self):
+        """Probe the active instances whose last check is older than most of an interval.
+
+        Returns:
+            list: Results as returned by probe_all
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.interval * DUE_FRACTION)
+        instance_ids = [instance_id for (instance_id,) in db.session.query(CBInstance.id).filter(
+            CBInstance.is_active.is_(True),
+            or_(CBInstance.last_checked.is_(None), CBInstance.last_checked < cutoff)
+        )]
+        if not instance_ids:
+            return []
+        return self.probe_all(instance_ids)
+
+    def _store(self, instances, results):
+        """Write probe results with one batched UPDATE, plus one for new sensor counts, and commit."""
+        current = {instance.id: instance for instance in instances}
+        now = datetime.utcnow()
+        rows = []
+        counts = []
+        changed = False
+        for result in results:
+            instance = current[result['instance_id']]
+            # A failed probe tells nothing about the version, keep the last known one
+            version = result['version'] if result['version'] != 'Unknown' else instance.version
+            changed = changed or instance.connection_status != result['status']
+            rows.append({
+                'instance_id': instance.id,
+                'status': result['status'],
+                'message': result['message'],
+                'version': version,
+                'checked': now
+            })
+            if 'sensors' in result:
+                counts.append({'instance_id': instance.id, 'sensors': result['sensors'],
+                               'counted': datetime.now(timezone.utc)})
+
+        table = CBInstance.__table__
+        statement = table.update().where(table.c.id == bindparam('instance_id')).values(
+            connection_status=bindparam('status'),
+            connection_message=bindparam('message'),
+            version=bindparam('version'),
+            last_checked=bindparam('checked')
+        )
+        try:
+            db.session.execute(statement, rows)
+            if counts:
+                db.session.execute(table.update().where(table.c.id == bindparam('instance_id')).values(
+                    sensors=bindparam('sensors'),
+                    sensors_counted_at=bindparam('counted')
+                ), counts)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        # Loaded instances are stale now
+        db.session.expire_all()
+
+        if changed:
+            # The dashboard charts instance connection statuses
+            dashboard_cache.invalidate_all()
+
+    def start(self):
+        """Start the background probe thread."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._probe_loop, name='health-probe', daemon=True)
+            self._thread.start()
+
+    def _probe_loop(self):
+        delay = STARTUP_DELAY
+        while not self._stop.wait(delay):
+            delay = self.interval
+            with self.app.app_context():
+                try:
+                    with leader_lock(db.engine, HEALTH_PROBE_LOCK_KEY) as leader:
+                        if leader:
+                            self.probe_due()
+                        else:
+                            logger.debug("Another worker is probing instance health")
+                except Exception as e:
+                    logger.error(f"Error probing instance health: {str(e)}")
+                    logger.debug(traceback.format_exc())
+                finally:
+                    db.session.remove()
+
+    def shutdown(self):
+        """Stop the probe thread."""
+        self._stop.set()
+
+    def stats(self):
+        """Return probe metrics."""
+        with self._lock:
+            return {
+                'interval': self.interval,
+                'runs': self.runs,
+                'probes': self.probes,
+                'failures': self.failures,
+                'timeouts': self.timeouts,
+                'last_run': self.last_run.isoformat() if self.last_run else None,
+                'last_duration': self.last_duration
+            }
+
+
+# Process-wide instance health probe, bound to the app in create_app
+health_probe = InstanceHealthProbe()
@@ -0,0 +1,262 @@
+import logging
+from .cb_api_helper import CBAPIHelper
+from .fanout import fan_out
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the app does not configure license fetching
+DEFAULT_LICENSE_TIMEOUT = 15
+DEFAULT_LICENSE_WORKERS = 8
+
+
+def is_response(instance):
+    """Whether an instance is a CB Response (EDR) server."""
+    return (instance.server_type or 'response').lower() == 'response'
+
+
+def get_instance_api(instance):
+    """Get the API client for an instance or raise if it cannot be initialized."""
+    cb_api = CBAPIHelper.get_cb_api(instance)
+    if not cb_api:
+        raise Exception(f"Failed to initialize CB API for instance {instance.name}")
+    return cb_api
+
+
+def fetch_license_data(cb_api, instance):
+    """Fetch the raw license payload from a Carbon Black server."""
+    if is_response(instance):
+        return cb_api.get_object('/api/v1/license', default={})
+    return cb_api.get_object('/api/bit9platform/v1/license', default={})
+
+
+def parse_license(instance, license_data):
+    """Normalize a raw license payload into the console's license summary."""
+    if is_response(instance):
+        # For Carbon Black Response (EDR)
+        return {
+            'id': instance.id,
+            'name': instance.name,
+            'license_type': license_data.get('edr_license_type', 'Standard'),
+            'seats_used': license_data.get('sensors_active', 0),
+            'total_seats': license_data.get('sensors_maximum', 0),
+            'start_date': license_data.get('license_valid_from'),
+            'expiration_date': license_data.get('license_valid_to')
+        }
+
+    # For Carbon Black Protection (App Control)
+    return {
+        'id': instance.id,
+        'name': instance.name,
+        'license_type': license_data.get('type', 'Standard'),
+        'seats_used': license_data.get('agentsUsed', 0),
+        'total_seats': license_data.get('maxAgents', 0),
+        'start_date': license_data.get('startDate'),
+        'expiration_date': license_data.get('expirationDate')
+    }
+
+
+def fetch_license_events(cb_api, instance):
+    """Fetch sensor events about connections dropped because of license limits.
+
+    Returns:
+        list: Raw event dicts as returned by the server
+    """
+    if is_response(instance):
+        # This endpoint might vary depending on CB Response version
+        events = cb_api.get_object('/api/v1/sensor/events', query_parameters={'q': 'license'})
+        if events and 'results' in events:
+            return [event for event in events['results']
+                    if 'license' in event.get('description', '').lower()]
+        return []
+
+    # This endpoint might vary depending on CB Protection version
+    events = cb_api.get_object('/api/bit9platform/v1/events', query_parameters={'q': 'licenseLimit'})
+    return list(events) if events else []
+
+
+def fetch_license_agents(cb_api, instance):
+    """Fetch the agents registered on an instance for the license detail view."""
+    agents_data = []
+
+    if is_response(instance):
+        sensors = cb_api.select('Sensor')
+        for sensor in sensors:
+            agents_data.append({
+                'id': sensor.id,
+                'hostname': getattr(sensor, 'hostname', 'Unknown'),
+                'status': getattr(sensor, 'status', 'Unknown'),
+                'last_checkin': getattr(sensor, 'last_checkin_time', None),
+                'registration_time': getattr(sensor, 'registration_time', None),
+                'os_type': getattr(sensor, 'os_type', 'Unknown'),
+                'computer_name': getattr(sensor, 'computer_name', 'Unknown')
+            })
+    else:
+        computers = cb_api.select('Computer')
+        for computer in computers:
+            agents_data.append({
+                'id': computer.id,
+                'hostname': getattr(computer, 'name', 'Unknown'),
+                'status': 'Connected' if getattr(computer, 'connected', False) else 'Disconnected',
+                'last_checkin': getattr(computer, 'lastPollDate', None),
+                'registration_time': getattr(computer, 'dateCreated', None),
+                'os_type': getattr(computer, 'osShortName', 'Unknown'),
+                'computer_name': getattr(computer, 'name', 'Unknown')
+            })
+
+    return agents_data
+
+
+def dropped_connection(instance, event):
+    """Convert a license-limit event into a dropped connection dict."""
+    if is_response(instance):
+        return {
+            'instance_id': instance.id,
+            'instance_name': instance.name,
+            'agent_id': event.get('sensor_id'),
+            'agent_hostname': event.get('hostname', 'Unknown'),
+            'timestamp': event.get('timestamp'),
+            'reason': event.get('description', 'License limit reached')
+        }
+
+    return {
+        'instance_id': instance.id,
+        'instance_name': instance.name,
+        'agent_id': event.get('agentId'),
+        'agent_hostname': event.get('computerName', 'Unknown'),
+        'timestamp': event.get('timestamp'),
+        'reason': event.get('description', 'License limit reached')
+    }
+
+
+# Fetches that make up an instance's license data
+LICENSE_FETCHES = {
+    'license': fetch_license_data,
+    'events': fetch_license_events,
+    'agents': fetch_license_agents
+}
+
+
+def _license_task(task):
+    instance, kind = task
+    cb_api = get_instance_api(instance)
+    return LICENSE_FETCHES[kind](cb_api, instance)
+
+
+def fetch_live(instances, kinds=('license', 'events'), timeout=None, max_workers=None):
+    """Fetch license data for many instances concurrently.
+
+    Every (instance, kind) pair is a separate call fanned out on a thread pool,
+    so one slow server or endpoint does not hold up the others. Calls that
+    miss the per-call deadline are reported as timed out.
+
+    Args:
+        instances: List of CBInstance model objects
+        kinds: Which of LICENSE_FETCHES to run for every instance
+        timeout: Per-call deadline in seconds
+        max_workers: Maximum number of concurrent calls
+
+    Returns:
+        dict: Per instance ID, a dict with the fetched value of every kind that
+        succeeded plus 'errors' and 'timed_out' describing the ones that did not
+    """
+    timeout = timeout or DEFAULT_LICENSE_TIMEOUT
+    max_workers = max_workers or DEFAULT_LICENSE_WORKERS
+
+    fetched = {instance.id: {'errors': {}, 'timed_out': []} for instance in instances}
+
+    tasks = [(instance, kind) for instance in instances for kind in kinds]
+    for outcome in fan_out(_license_task, tasks, max_workers, timeout):
+        instance, kind = outcome.item
+        entry = fetched[instance.id]
+
+        if outcome.timed_out:
+            logger.warning(f"Timed out getting {kind} for {instance.name} after {timeout} seconds")
+            entry['timed_out'].append(kind)
+            entry['errors'][kind] = f"Timed out after {timeout} seconds"
+        elif outcome.error is not None:
+            logger.error(f"Error getting {kind} for instance {instance.name}: {str(outcome.error)}")
+            entry['errors'][kind] = str(outcome.error)
+        else:
+            entry[kind] = outcome.value
+
+    return fetched
+
+
+def error_license(instance, error):
+    """Placeholder license entry for an instance whose license could not be read."""
+    return {
+        'id': instance.id,
+        'name': instance.name,
+        'license_type': 'Unknown',
+        'seats_used': 0,
+        'total_seats': 0,
+        'start_date': None,
+        'expiration_date': None,
+        'error': error
+    }
+
+
+def build_summary(instances, entries):
+    """Build the /api/licenses payload from per-instance license data.
+
+    Args:
+        instances: List of CBInstance model objects, in response order
+        entries: Per instance ID, a dict shaped like the values returned by
+            fetch_live, optionally carrying a 'snapshot' metadata dict
+
+    Returns:
+        dict: License summary in the /api/licenses response format
+    """
+    license_info = []
+    dropped_connections = []
+    timed_out = []
+
+    for instance in instances:
+        entry = entries.get(instance.id)
+        if entry is None:
+            continue
+
+        if 'license' in entry:
+            instance_license = parse_license(instance, entry['license'])
+        else:
+            instance_license = error_license(instance, entry['errors'].get('license', 'License data unavailable'))
+            if 'license' in entry['timed_out']:
+                instance_license['timed_out'] = True
+        if entry.get('snapshot'):
+            instance_license['snapshot'] = entry['snapshot']
+        license_info.append(instance_license)
+
+        for event in entry.get('events') or []:
+            dropped_connections.append(dropped_connection(instance, event))
+
+        for kind in entry['timed_out']:
+            timed_out.append({'instance_id': instance.id, 'instance_name': instance.name, 'fetch': kind})
+
+    total_seats = sum(entry['total_seats'] for entry in license_info)
+    used_seats = sum(entry['seats_used'] for entry in license_info)
+
+    return {
+        'status': 'success',
+        'total_seats': total_seats,
+        'used_seats': used_seats,
+        'available_seats': total_seats - used_seats,
+        'dropped_connections_count': len(dropped_connections),
+        'instances': license_info,
+        'dropped_connections': dropped_connections,
+        'partial': bool(timed_out),
+        'timed_out': timed_out
+    }
+
+
+def aggregate_licenses(instances, timeout=None, max_workers=None):
+    """Fetch license and dropped-connection data live for many instances concurrently.
+
+    Args:
+        instances: List of CBInstance model objects
+        timeout: Per-call deadline in seconds
+        max_workers: Maximum number of concurrent calls
+
+    Returns:
+        dict: License summary in the /api/licenses response format
+    """
+    return build_summary(instances, fetch_live(instances, timeout=timeout, max_workers=max_workers))
@@ -0,0 +1,348 @@
+import json
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from ..models import CBInstance, LicenseSnapshot, db
+from .license_service import fetch_live, build_summary, DEFAULT_LICENSE_TIMEOUT, DEFAULT_LICENSE_WORKERS
+from .locks import leader_lock, LICENSE_REFRESH_LOCK_KEY
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the app does not configure the snapshot store
+DEFAULT_SNAPSHOT_TTL = 3600
+DEFAULT_SNAPSHOT_MAX_STALE = 604800
+DEFAULT_REFRESH_INTERVAL = 900
+
+# Seconds the background refresher waits after startup before its first pass
+STARTUP_DELAY = 10
+
+
+class LicenseSnapshotStore:
+    """Serves license data from the license_snapshots table.
+
+    Snapshots younger than the TTL are served as is. Older ones are still
+    served, marked stale, while a background revalidation fetches new data
+    (stale-while-revalidate). Instances without a snapshot, or whose snapshot
+    is older than the maximum staleness, are fetched live. A failed fetch
+    never discards data: the previous snapshot keeps being served and the
+    error is recorded next to it.
+
+    A background refresher thread keeps snapshots ahead of the TTL so that
+    requests normally never wait on a Carbon Black server. Every worker runs
+    one, but a pass only runs while holding a leader lock and only refreshes
+    snapshots that are due, so the servers see one refresh per interval
+    however many workers there are.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.ttl = DEFAULT_SNAPSHOT_TTL
+        self.max_stale = DEFAULT_SNAPSHOT_MAX_STALE
+        self.refresh_interval = DEFAULT_REFRESH_INTERVAL
+        self.fetch_timeout = DEFAULT_LICENSE_TIMEOUT
+        self.fetch_workers = DEFAULT_LICENSE_WORKERS
+        self._executor = None
+        self._refresher = None
+        self._stop = threading.Event()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.forced = 0
+        self.refreshes = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the store to a Flask application, read its settings and start the refresher."""
+        self.app = app
+        self.ttl = app.config.get('LICENSE_SNAPSHOT_TTL', DEFAULT_SNAPSHOT_TTL)
+        self.max_stale = app.config.get('LICENSE_SNAPSHOT_MAX_STALE', DEFAULT_SNAPSHOT_MAX_STALE)
+        self.refresh_interval = app.config.get('LICENSE_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL)
+        self.fetch_timeout = app.config.get('LICENSE_FETCH_TIMEOUT', DEFAULT_LICENSE_TIMEOUT)
+        self.fetch_workers = app.config.get('LICENSE_FETCH_WORKERS', DEFAULT_LICENSE_WORKERS)
+        app.extensions['license_snapshots'] = self
+
+        if self.refresh_interval > 0 and not app.config.get('TESTING'):
+            self.start()
+
+    @property
+    def executor(self):
+        """Lazily create the single-threaded revalidation pool."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='license-refresh')
+            return self._executor
+
+    def _state(self, snapshot, kinds):
+        """Classify a snapshot as 'fresh', 'stale' or 'missing' for the requested kinds."""
+        if snapshot is None or snapshot.fetched_at is None:
+            return 'missing'
+        if 'agents' in kinds and snapshot.agents is None:
+            return 'missing'
+        age = snapshot.age
+        if age > self.max_stale:
+            return 'missing'
+        if age > self.ttl:
+            return 'stale'
+        return 'fresh'
+
+    def _entry(self, snapshot, kinds, source, stale):
+        """Shape a snapshot like a fetch_live entry."""
+        entry = {
+            'license': snapshot.get_license_data(),
+            'events': snapshot.get_events(),
+            'errors': {},
+            'timed_out': [],
+            'snapshot': dict(snapshot.to_dict(), source=source, stale=stale)
+        }
+        if 'agents' in kinds:
+            entry['agents'] = snapshot.get_agents() or []
+        return entry
+
+    def get(self, instances, kinds=('license', 'events'), fresh=False, timeout=None):
+        """Get license data for instances, from snapshots where possible.
+
+        Args:
+            instances: List of CBInstance model objects
+            kinds: Which license fetches the caller needs ('license', 'events', 'agents')
+            fresh: Force a live fetch for every instance
+            timeout: Per-call deadline for live fetches in seconds
+
+        Returns:
+            dict: Per instance ID, an entry shaped like fetch_live's with an
+            added 'snapshot' dict describing where the data came from
+        """
+        ids = [instance.id for instance in instances]
+        snapshots = {
+            snapshot.instance_id: snapshot
+            for snapshot in LicenseSnapshot.query.filter(LicenseSnapshot.instance_id.in_(ids)).all()
+        } if ids else {}
+
+        entries = {}
+        live = []
+        stale = []
+
+        for instance in instances:
+            snapshot = snapshots.get(instance.id)
+            state = self._state(snapshot, kinds)
+
+            if fresh or state == 'missing':
+                live.append(instance)
+            else:
+                entries[instance.id] = self._entry(snapshot, kinds, 'cache', state == 'stale')
+                if state == 'stale':
+                    stale.append(instance.id)
+
+        with self._lock:
+            self.hits += len(entries) - len(stale)
+            self.stale_hits += len(stale)
+            if fresh:
+                self.forced += len(live)
+            else:
+                self.misses += len(live)
+
+        if live:
+            fetched = fetch_live(live, kinds, timeout or self.fetch_timeout, self.fetch_workers)
+            self._store(fetched, snapshots)
+
+            for instance in live:
+                entry = fetched[instance.id]
+                snapshot = snapshots.get(instance.id)
+                if 'license' not in entry and snapshot is not None and snapshot.fetched_at is not None:
+                    # Live fetch failed, fall back to whatever we had before
+                    entries[instance.id] = self._entry(snapshot, kinds, 'cache', True)
+                    entries[instance.id]['errors'] = entry['errors']
+                    entries[instance.id]['timed_out'] = entry['timed_out']
+                else:
+                    entry['snapshot'] = {
+                        'instance_id': instance.id,
+                        'fetched_at': datetime.utcnow().isoformat(),
+                        'age': 0,
+                        'source': 'live',
+                        'stale': False
+                    }
+                    entries[instance.id] = entry
+
+        if stale:
+            self.revalidate(stale, kinds)
+
+        return entries
+
+    def summary(self, instances, fresh=False, timeout=None):
+        """Get the /api/licenses payload for instances, served from snapshots where possible."""
+        return build_summary(instances, self.get(instances, fresh=fresh, timeout=timeout))
+
+    def _store(self, fetched, snapshots):
+        """Write live fetch results into snapshots.
+
+        Only kinds that were fetched successfully overwrite stored data, so a
+        failing server keeps its last good snapshot. Each instance is written
+        in its own savepoint, so one conflicting snapshot does not discard
+        the rest of the batch.
+        """
+        now = datetime.utcnow()
+        try:
+            for instance_id, entry in fetched.items():
+                try:
+                    with db.session.begin_nested():
+                        snapshot = snapshots.get(instance_id)
+                        if snapshot is None:
+                            snapshot = LicenseSnapshot(instance_id=instance_id)
+                            db.session.add(snapshot)
+
+                        snapshot.last_attempt_at = now
+                        snapshot.last_error = '; '.join(
+                            f"{kind}: {error}" for kind, error in entry['errors'].items()
+                        ) or None
+
+                        if 'license' in entry:
+                            snapshot.license_data = json.dumps(entry['license'], default=str)
+                            snapshot.fetched_at = now
+                        if 'events' in entry:
+                            snapshot.events = json.dumps(entry['events'], default=str)
+                        if 'agents' in entry:
+                            snapshot.agents = json.dumps(entry['agents'], default=str)
+                    snapshots[instance_id] = snapshot
+                except IntegrityError:
+                    # Another worker created the same snapshot concurrently; its data is as good as ours
+                    logger.debug(f"License snapshot for {instance_id} written concurrently by another worker")
+
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error storing license snapshots: {str(e)}")
+
+    def refresh(self, instances):
+        """Fetch and store license data for instances.
+
+        Instances whose snapshot already holds an agent list get it refreshed too.
+        """
+        if not instances:
+            return
+
+        ids = [instance.id for instance in instances]
+        snapshots = {
+            snapshot.instance_id: snapshot
+            for snapshot in LicenseSnapshot.query.filter(LicenseSnapshot.instance_id.in_(ids)).all()
+        }
+
+        with_agents = [instance for instance in instances
+                       if instance.id in snapshots and snapshots[instance.id].agents is not None]
+        without_agents = [instance for instance in instances if instance not in with_agents]
+
+        for group, kinds in ((without_agents, ('license', 'events')), (with_agents, ('license', 'events', 'agents'))):
+            if group:
+                self._store(fetch_live(group, kinds, self.fetch_timeout, self.fetch_workers), snapshots)
+
+        with self._lock:
+            self.refreshes += len(instances)
+
+    def revalidate(self, instance_ids, kinds=('license', 'events')):
+        """Refresh snapshots in the background, skipping ones already being refreshed."""
+        with self._lock:
+            instance_ids = [instance_id for instance_id in instance_ids if instance_id not in self._in_flight]
+            self._in_flight.update(instance_ids)
+
+        if instance_ids:
+            logger.debug(f"Revalidating license snapshots for {instance_ids}")
+            self.executor.submit(self._revalidate, instance_ids)
+
+    def _revalidate(self, instance_ids):
+        with self.app.app_context():
+            try:
+                self.refresh(CBInstance.query.filter(CBInstance.id.in_(instance_ids)).all())
+            except Exception as e:
+                logger.error(f"Error revalidating license snapshots: {str(e)}")
+                logger.debug(traceback.format_exc())
+            finally:
+                with self._lock:
+                    self._in_flight.difference_update(instance_ids)
+                db.session.remove()
+
+    def refresh_due(self):
+        """Refresh every active instance whose snapshot would go stale before the next pass."""
+        horizon = self.ttl - self.refresh_interval
+        instances = CBInstance.query.filter_by(is_active=True).all()
+        snapshots = {snapshot.instance_id: snapshot for snapshot in LicenseSnapshot.query.all()}
+
+        with self._lock:
+            in_flight = set(self._in_flight)
+
+        due = [
+            instance for instance in instances
+            if instance.id not in in_flight and (
+                instance.id not in snapshots
+                or snapshots[instance.id].age is None
+                or snapshots[instance.id].age >= horizon
+            )
+        ]
+        if due:
+            logger.info(f"Refreshing license snapshots for {len(due)} instances")
+            self.refresh(due)
+
+    def invalidate(self, instance_id):
+        """Delete an instance's snapshot. The caller commits the session."""
+        LicenseSnapshot.query.filter_by(instance_id=instance_id).delete()
+
+    def start(self):
+        """Start the background refresher thread."""
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._stop.clear()
+            self._refresher = threading.Thread(target=self._refresh_loop, name='license-refresher', daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        delay = STARTUP_DELAY
+        while not self._stop.wait(delay):
+            delay = self.refresh_interval
+            with self.app.app_context():
+                try:
+                    with leader_lock(db.engine, LICENSE_REFRESH_LOCK_KEY) as leader:
+                        if leader:
+                            self.refresh_due()
+                        else:
+                            logger.debug("Another worker is refreshing license snapshots")
+                except Exception as e:
+                    logger.error(f"Error refreshing license snapshots: {str(e)}")
+                    logger.debug(traceback.format_exc())
+                finally:
+                    db.session.remove()
+
+    def shutdown(self):
+        """Stop the refresher thread and the revalidation pool."""
+        self._stop.set()
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def stats(self):
+        """Return snapshot hit/miss metrics."""
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'forced_refreshes': self.forced,
+                'background_refreshes': self.refreshes,
+                'in_flight': len(self._in_flight),
+                'hit_ratio': round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0
+            }
+
+
+def fresh_requested(args):
+    """Whether the request asked to bypass snapshots with ?fresh=1."""
+    return args.get('fresh', '').lower() in ('1', 'true', 'yes')
+
+
+# Process-wide snapshot store, bound to the app in create_app
+license_snapshots = LicenseSnapshotStore()
@@ -0,0 +1,52 @@
+import logging
+from contextlib import contextmanager
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL advisory lock keys of the background tasks that must run in a
+# single process at a time; audit log maintenance uses 72616401
+LICENSE_REFRESH_LOCK_KEY = 72616402
+HEALTH_PROBE_LOCK_KEY = 72616403
+ROLLUP_DOWNSAMPLE_LOCK_KEY = 72616404
+
+
+@contextmanager
+def leader_lock(engine, key):
+    """Try to become the one process running a background task.
+
+    On PostgreSQL a session-level advisory lock is taken without waiting, on
+    its own connection, and held until the block ends. Other databases have
+    no advisory locks and are assumed to serve a single process, so the
+    block always runs there.
+
+    Yields:
+        bool: Whether this process holds the lock and should run the task
+    """
+    if engine.dialect.name != 'postgresql':
+        yield True
+        return
+
+    with engine.connect() as conn:
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': key}).scalar()
+        conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': key})
+                conn.commit()
+
+
+def try_transaction_lock(session, key):
+    """Take a PostgreSQL advisory lock held until the session's transaction ends.
+
+    Does not wait. Other databases have no advisory locks and serialize
+    writers anyway, so the lock always counts as taken there.
+
+    Returns:
+        bool: Whether the lock was taken
+    """
+    if session.get_bind().dialect.name != 'postgresql':
+        return True
+    return bool(session.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {'key': key}).scalar())
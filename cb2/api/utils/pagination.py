@@ -0,0 +1,150 @@
+import base64
+import json
+import logging
+from datetime import datetime
+from dateutil import parser as date_parser
+from sqlalchemy import tuple_, literal, DateTime
+from ..models import db
+
+logger = logging.getLogger(__name__)
+
+# Page size limits for keyset paginated endpoints
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class CursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded or does not match the request."""
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Clamp a requested page size to [1, maximum]."""
+    try:
+        limit = int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(sort, values):
+    """Encode the sort key and the last row's key values as an opaque cursor."""
+    payload = {
+        's': sort,
+        'v': [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort, columns):
+    """Decode a cursor produced by encode_cursor for the same sort.
+
+    Returns:
+        list: Key values, converted back to datetimes for DateTime columns
+
+    Raises:
+        CursorError: If the cursor is malformed or was issued for another sort
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        values = payload['v']
+    except (ValueError, KeyError, TypeError):
+        raise CursorError('Invalid cursor')
+
+    if payload.get('s') != sort or len(values) != len(columns):
+        raise CursorError('Cursor does not match the requested sort')
+
+    decoded = []
+    for column, value in zip(columns, values):
+        if value is not None and isinstance(column.type, DateTime):
+            try:
+                value = date_parser.parse(value)
+            except (ValueError, OverflowError):
+                raise CursorError('Invalid cursor')
+        decoded.append(value)
+    return decoded
+
+
+def paginate_keyset(query, columns, sort, limit, cursor=None, descending=False, offset=0):
+    """Fetch one page of a query using keyset (seek) pagination.
+
+    Rows are ordered by ``columns``, which must end with a unique key so the
+    order is total, and the page starts after the row the cursor points at.
+    Unlike OFFSET, the cost of a page does not grow with its position.
+
+    Args:
+        query: SQLAlchemy query to page through, with filters applied
+        columns: Column expressions to order and seek on; none may be NULL.
+            Computed expressions must be labeled and added to the query
+        sort: Name of the sort, bound into cursors so they cannot be reused across sorts
+        limit: Page size
+        cursor: Cursor returned with the previous page, if any
+        descending: Order by the columns descending instead of ascending
+        offset: Rows to skip first, for endpoints that still address pages
+            by number; the returned cursor lets clients continue by keyset
+
+    Returns:
+        tuple: (rows, next_cursor) where next_cursor is None on the last page
+    """
+    if cursor:
+        values = decode_cursor(cursor, sort, columns)
+        key = tuple_(*columns)
+        bound = tuple_(*[literal(value, column.type) for column, value in zip(columns, values)])
+        query = query.filter(key < bound if descending else key > bound)
+
+    order = [column.desc() if descending else column.asc() for column in columns]
+    rows = query.order_by(*order).offset(offset or None).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, [_column_value(last, column) for column in columns])
+
+    return rows, next_cursor
+
+
+def _column_value(row, column):
+    """Read the value of an ordering column from an ORM row.
+    
+    Rows of queries with extra labeled columns, e.g. (Agent, rank), are
+    looked up by label first and then on their leading entity.
+    """
+    name = getattr(column, 'key', None) or column.name
+    mapping = getattr(row, '_mapping', None)
+    if mapping is not None:
+        if name in mapping:
+            return mapping[name]
+        row = row[0]
+    return getattr(row, name)
+
+
+def estimate_count(query):
+    """Estimate how many rows a query returns.
+
+    On PostgreSQL this reads the planner's row estimate from EXPLAIN, which
+    costs about as much as planning the query. Other databases fall back to
+    an exact COUNT.
+
+    Returns:
+        tuple: (count, is_estimate)
+    """
+    query = query.order_by(None)
+    bind = db.session.get_bind()
+
+    if bind.dialect.name == 'postgresql':
+        try:
+            compiled = query.statement.compile(dialect=bind.dialect, compile_kwargs={'render_postcompile': True})
+            # Savepoint, so a failed EXPLAIN does not abort the request's transaction
+            with db.session.begin_nested():
+                plan = db.session.connection().exec_driver_sql(
+                    f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params
+                ).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows']), True
+        except Exception as e:
+            logger.debug(f"Could not estimate row count, counting instead: {str(e)}")
+
+    return query.count(), False
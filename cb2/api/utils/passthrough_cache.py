@@ -0,0 +1,179 @@
+import logging
+import re
+from urllib.parse import parse_qsl, urlencode
+from .response_cache import ResponseCache, GLOBAL_SCOPE
+
+logger = logging.getLogger(__name__)
+
+# Seconds to cache GET responses of endpoints no rule matches
+DEFAULT_PASSTHROUGH_TTL = 30
+
+# Per-endpoint TTLs as (path prefix, seconds); the longest matching prefix
+# wins and 0 means never cache. Live data is kept briefly, slowly changing
+# server configuration longer, and live response sessions not at all.
+DEFAULT_TTL_RULES = [
+    ('/api/info', 300),
+    ('/api/server_info', 300),
+    ('/api/v1/license', 300),
+    ('/api/bit9platform/v1/license', 300),
+    ('/api/bit9platform/v1/serverConfig', 300),
+    ('/api/v1/users', 120),
+    ('/api/users', 120),
+    ('/api/bit9platform/v1/users', 120),
+    ('/api/group', 120),
+    ('/api/v1/group', 120),
+    ('/api/v1/watchlist', 60),
+    ('/api/v1/sensor', 30),
+    ('/api/v2/sensor', 30),
+    ('/api/bit9platform/v1/computer', 30),
+    ('/api/v1/alert', 10),
+    ('/api/v2/alert', 10),
+    ('/api/v1/process', 15),
+    ('/api/v2/process', 15),
+    ('/api/v1/binary', 60),
+    ('/api/v1/cblr', 0),
+]
+
+# API version path segments, e.g. v1; the segment after one names the resource
+VERSION_SEGMENT = re.compile(r'^v\d+$')
+
+# Request header that refetches and refreshes a cached entry, like
+# Cache-Control: no-cache; Cache-Control: no-store skips the cache entirely
+BYPASS_HEADER = 'X-Cache-Bypass'
+
+
+def parse_ttl_rules(value):
+    """Parse TTL rules written as 'prefix=seconds,prefix=seconds'."""
+    rules = []
+    for item in (value or '').split(','):
+        prefix, _, ttl = item.strip().partition('=')
+        if not prefix or not ttl:
+            continue
+        try:
+            rules.append((prefix.strip(), int(ttl)))
+        except ValueError:
+            logger.warning(f"Ignoring invalid passthrough cache rule '{item}'")
+    return rules
+
+
+def split_endpoint(endpoint, params=None):
+    """Split an endpoint into its path and a normalized query string.
+
+    Query parameters given in the endpoint and in params are merged and
+    sorted, so equivalent requests map to the same cache entry.
+    """
+    path, _, query = endpoint.partition('?')
+    path = '/' + path.strip('/')
+    pairs = parse_qsl(query, keep_blank_values=True)
+    for name, value in (params or {}).items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        pairs.extend((str(name), str(item)) for item in values)
+    return path, urlencode(sorted(pairs))
+
+
+def resource_prefix(path):
+    """The resource a path belongs to, e.g. /api/v1/sensor for /api/v1/sensor/12/activity.
+
+    Writes to any path of a resource invalidate every cached read of it.
+    """
+    segments = [segment for segment in path.split('/') if segment]
+    for index, segment in enumerate(segments):
+        if VERSION_SEGMENT.match(segment):
+            return '/' + '/'.join(segments[:index + 2])
+    return '/' + '/'.join(segments[:2])
+
+
+def bypass_mode(headers):
+    """How a request asked to bypass the cache: None, 'refresh' or 'skip'."""
+    directives = {part.strip().lower() for part in headers.get('Cache-Control', '').split(',')}
+    if 'no-store' in directives:
+        return 'skip'
+    if 'no-cache' in directives or headers.get(BYPASS_HEADER, '').lower() in ('1', 'true', 'yes'):
+        return 'refresh'
+    return None
+
+
+class PassthroughCache(ResponseCache):
+    """Read-through cache of GET requests forwarded to Carbon Black servers.
+
+    Entries are keyed by instance, endpoint path and normalized query
+    parameters, and kept for the TTL of the longest matching endpoint rule.
+    Invalidation is hierarchical: a POST, PUT or DELETE through the
+    passthrough invalidates the cached reads of the same resource on the
+    same instance, and changing or deleting an instance invalidates all of
+    its entries.
+
+    Besides the ResponseCache settings, CBAPI_CACHE_RULES adds or
+    overrides endpoint rules ('prefix=seconds,...'). Set
+    CBAPI_CACHE_MAX_BYTES to bound the in-process cache by size.
+    """
+
+    def __init__(self, namespace, config_prefix, app=None):
+        self.rules = sorted(DEFAULT_TTL_RULES, key=lambda rule: len(rule[0]), reverse=True)
+        super().__init__(namespace, config_prefix, app)
+        if app is None:
+            self.ttl = DEFAULT_PASSTHROUGH_TTL
+
+    def init_app(self, app, backend=None):
+        super().init_app(app, backend)
+        self.ttl = app.config.get(f'{self.config_prefix}_TTL', DEFAULT_PASSTHROUGH_TTL)
+        rules = dict(DEFAULT_TTL_RULES)
+        rules.update(parse_ttl_rules(app.config.get(f'{self.config_prefix}_RULES')))
+        self.rules = sorted(rules.items(), key=lambda rule: len(rule[0]), reverse=True)
+
+    def ttl_for(self, path):
+        """Seconds to cache a path's responses; 0 when it must not be cached."""
+        for prefix, ttl in self.rules:
+            if path == prefix or path.startswith(prefix.rstrip('/') + '/'):
+                return ttl
+        return self.ttl
+
+    def _generation_keys(self, scope):
+        # Scopes are 'instance' or 'instance|resource'; each depends on its parents
+        scopes = [GLOBAL_SCOPE]
+        if scope != GLOBAL_SCOPE:
+            instance_id, _, resource = scope.partition('|')
+            scopes.append(instance_id)
+            if resource:
+                scopes.append(scope)
+        return [f'{self.namespace}:gen:{name}' for name in scopes]
+
+    def fetch(self, instance_id, endpoint, params, fetch, bypass=None):
+        """Serve a GET from the cache, calling fetch() and caching its result on a miss.
+
+        Args:
+            instance_id: ID of the CBInstance the request goes to
+            endpoint: Endpoint path, optionally with a query string
+            params: Query parameters
+            fetch: Callable performing the request
+            bypass: None, 'refresh' or 'skip', see bypass_mode()
+
+        Returns:
+            tuple: (response, cache status 'HIT', 'MISS' or 'BYPASS')
+        """
+        path, query = split_endpoint(endpoint, params)
+        ttl = self.ttl_for(path)
+        if not self.enabled or not ttl or bypass == 'skip':
+            return fetch(), 'BYPASS'
+
+        scope = f'{instance_id}|{resource_prefix(path)}'
+        key, cached = self.lookup(scope, path, query, bypass=bypass == 'refresh')
+        if cached is not None:
+            return cached, 'HIT'
+
+        response = fetch()
+        self.store(key, response, ttl)
+        return response, 'BYPASS' if bypass else 'MISS'
+
+    def invalidate_resource(self, instance_id, endpoint):
+        """Invalidate the cached reads of the resource an endpoint belongs to."""
+        path, _ = split_endpoint(endpoint)
+        self._bump([f'{instance_id}|{resource_prefix(path)}'])
+
+    def invalidate_instance(self, instance_id):
+        """Invalidate every cached read of an instance."""
+        self._bump([str(instance_id)])
+
+
+# Process-wide cache of CB API passthrough reads, bound to the app in create_app
+cbapi_cache = PassthroughCache('cbapi', 'CBAPI_CACHE')
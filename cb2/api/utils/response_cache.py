@@ -0,0 +1,320 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the app does not configure a response cache
+DEFAULT_CACHE_TTL = 60
+DEFAULT_CACHE_MAX_ENTRIES = 256
+DEFAULT_CACHE_MAX_BYTES = 0
+DEFAULT_CACHE_BACKEND = 'memory'
+
+# Generation counter scope that every cached entry depends on
+GLOBAL_SCOPE = '*'
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache backend with per-entry expiry.
+
+    Evicts the least recently used entries once there are more than
+    max_entries of them or, when max_bytes is set, once the stored values
+    add up to more than max_bytes characters. Each worker process has its own copy, so invalidations only reach the
+    worker that performed them. Use a shared backend when running several
+    workers.
+
+    A backend stores strings under string keys and keeps integer counters.
+    Any object with the same get/set/get_counters/incr/clear/stats methods
+    can be used as a shared backend.
+    """
+
+    name = 'memory'
+
+    def __init__(self, max_entries=DEFAULT_CACHE_MAX_ENTRIES, url=None, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.size_bytes = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the value stored under a key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.size_bytes -= len(value)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        """Store a value for ttl seconds, evicting the least recently used entries."""
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= len(previous[1])
+            if self.max_bytes and len(value) > self.max_bytes:
+                # Would evict everything else and still not fit
+                self.evictions += 1
+                return
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self.size_bytes += len(value)
+            while len(self._entries) > self.max_entries or (self.max_bytes and self.size_bytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted)
+                self.evictions += 1
+
+    def get_counters(self, keys):
+        """Return the current value of several counters, 0 for unset ones."""
+        with self._lock:
+            return [self._counters.get(key, 0) for key in keys]
+
+    def incr(self, key):
+        """Increment a counter and return its new value."""
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self.size_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'evictions': self.evictions
+            }
+            if self.max_bytes:
+                stats.update({'size_bytes': self.size_bytes, 'max_bytes': self.max_bytes})
+            return stats
+
+
+class RedisCacheBackend:
+    """Redis cache backend shared by every worker process.
+
+    Entries expire through Redis TTLs and eviction is left to the server's
+    maxmemory policy. Requires the ``redis`` package.
+    """
+
+    name = 'redis'
+
+    def __init__(self, max_entries=None, url=None, max_bytes=None):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis cache backend requires the 'redis' package")
+        if not url:
+            raise RuntimeError("The redis cache backend requires a cache URL")
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value, ttl):
+        self._client.set(key, value, ex=max(1, int(ttl)))
+
+    def get_counters(self, keys):
+        return [int(value or 0) for value in self._client.mget(keys)]
+
+    def incr(self, key):
+        return self._client.incr(key)
+
+    def clear(self):
+        # Entries expire on their own; invalidate_all() already made them unreachable
+        pass
+
+    def stats(self):
+        return {}
+
+
+# Available cache backends by config name
+CACHE_BACKENDS = {
+    'memory': MemoryCacheBackend,
+    'redis': RedisCacheBackend
+}
+
+
+class ResponseCache:
+    """TTL cache of JSON-serializable responses with scoped invalidation.
+
+    Every entry belongs to a scope, normally an instance ID or 'all'.
+    Invalidation does not delete entries: it bumps generation counters
+    that are part of every key, which works the same way for in-process
+    and shared backends. Invalidating an instance also invalidates the
+    'all' scope, since fleet-wide responses include that instance.
+
+    Settings are read from the app config under a prefix, e.g. with the
+    prefix DASHBOARD_CACHE: DASHBOARD_CACHE_TTL (0 disables the cache),
+    DASHBOARD_CACHE_MAX_ENTRIES, DASHBOARD_CACHE_MAX_BYTES (0 for no byte
+    limit), DASHBOARD_CACHE_BACKEND ('memory' or 'redis') and
+    DASHBOARD_CACHE_URL.
+    """
+
+    def __init__(self, namespace, config_prefix, app=None):
+        self.namespace = namespace
+        self.config_prefix = config_prefix
+        self.ttl = DEFAULT_CACHE_TTL
+        self.backend = MemoryCacheBackend()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, backend=None):
+        """Bind the cache to a Flask application and create its backend.
+
+        Args:
+            app: Flask application
+            backend: Optional backend object, overriding the configured one
+        """
+        prefix = self.config_prefix
+        self.ttl = app.config.get(f'{prefix}_TTL', DEFAULT_CACHE_TTL)
+        max_entries = app.config.get(f'{prefix}_MAX_ENTRIES', DEFAULT_CACHE_MAX_ENTRIES)
+        max_bytes = app.config.get(f'{prefix}_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES)
+
+        if backend is None:
+            name = app.config.get(f'{prefix}_BACKEND', DEFAULT_CACHE_BACKEND) or DEFAULT_CACHE_BACKEND
+            try:
+                backend = CACHE_BACKENDS[name](max_entries=max_entries, url=app.config.get(f'{prefix}_URL'),
+                                               max_bytes=max_bytes)
+            except (KeyError, RuntimeError) as e:
+                logger.warning(f"Cannot use cache backend '{name}' for {self.namespace}, "
+                               f"falling back to in-process cache: {str(e)}")
+                backend = MemoryCacheBackend(max_entries=max_entries, max_bytes=max_bytes)
+
+        self.backend = backend
+        app.extensions[f'{self.namespace}_cache'] = self
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _generation_keys(self, scope):
+        scopes = [GLOBAL_SCOPE] if scope == GLOBAL_SCOPE else [GLOBAL_SCOPE, scope]
+        return [f'{self.namespace}:gen:{name}' for name in scopes]
+
+    def make_key(self, scope, *parts):
+        """Build the backend key for an entry, tied to the scope's current generation."""
+        generations = self.backend.get_counters(self._generation_keys(str(scope)))
+        return ':'.join([self.namespace, '.'.join(str(g) for g in generations), str(scope)] +
+                        [str(part) for part in parts])
+
+    def lookup(self, scope, *parts, bypass=False):
+        """Look up the cached value for a scope and key parts.
+
+        With bypass=True only the key is built, so the caller recomputes the
+        value and refreshes the entry.
+
+        Returns:
+            tuple: (key, value) where value is None on a miss. Pass the key
+            to store() so a value computed while an invalidation happened is
+            stored under the old, already unreachable generation.
+        """
+        if not self.enabled:
+            return None, None
+        try:
+            key = self.make_key(scope, *parts)
+            if bypass:
+                return key, None
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"{self.namespace} cache read failed: {str(e)}")
+            with self._lock:
+                self.errors += 1
+            return None, None
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return key, json.loads(value) if value is not None else None
+
+    def store(self, key, value, ttl=None):
+        """Cache a JSON-serializable value under a key returned by lookup().
+
+        Args:
+            key: Key returned by lookup()
+            value: Value to cache
+            ttl: Seconds to keep the value, the cache's TTL when None
+        """
+        if not self.enabled or key is None:
+            return
+        try:
+            self.backend.set(key, json.dumps(value), ttl or self.ttl)
+        except Exception as e:
+            logger.warning(f"{self.namespace} cache write failed: {str(e)}")
+            with self._lock:
+                self.errors += 1
+
+    def invalidate(self, scope):
+        """Invalidate every entry of a scope and of the 'all' scope."""
+        self._bump([str(scope), 'all'])
+
+    def invalidate_all(self):
+        """Invalidate every entry."""
+        self._bump([GLOBAL_SCOPE])
+        self.backend.clear()
+
+    def _bump(self, scopes):
+        try:
+            for scope in dict.fromkeys(scopes):
+                self.backend.incr(f'{self.namespace}:gen:{scope}')
+        except Exception as e:
+            logger.warning(f"{self.namespace} cache invalidation failed: {str(e)}")
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self):
+        """Return cache hit/miss metrics for this worker."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'backend': getattr(self.backend, 'name', type(self.backend).__name__),
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'errors': self.errors,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+        stats.update(self.backend.stats())
+        return stats
+
+
+# Process-wide response caches, bound to the app in create_app
+dashboard_cache = ResponseCache('dashboard', 'DASHBOARD_CACHE')
+agent_facet_cache = ResponseCache('agent_facets', 'AGENT_FACET_CACHE')
+
+
+def invalidate_agent_caches(instance_id=None):
+    """Invalidate cached responses derived from the agents and instances tables.
+
+    Args:
+        instance_id: Instance whose agents changed, or None when instances
+            themselves were created, changed or deleted
+    """
+    for cache in (dashboard_cache, agent_facet_cache):
+        if instance_id is None:
+            cache.invalidate_all()
+        else:
+            cache.invalidate(instance_id)
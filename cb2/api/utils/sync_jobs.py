@@ -0,0 +1,404 @@
+import json
+import logging
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from ..models import CBInstance, SyncJob, db
+from .cb_api_helper import CBAPIHelper
+from .sync_scheduler import sync_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the app does not configure the job runner
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_STALE_AFTER = 1800
+
+# Minimum seconds between progress writes for a single job
+PROGRESS_INTERVAL = 1.0
+
+# Attempts at claiming a dedupe key whose holder finishes while we look at it
+CLAIM_ATTEMPTS = 3
+
+
+def insert_unless_active(session, values):
+    """Insert a sync_jobs row unless an active job already holds its dedupe key.
+
+    Relies on the partial unique index over the dedupe keys of queued and
+    running jobs, so concurrent workers cannot both insert. The caller
+    commits.
+
+    Returns:
+        bool: Whether the row was inserted
+    """
+    table = SyncJob.__table__
+    dialect = session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table).values(**values).on_conflict_do_nothing(
+            index_elements=['dedupe_key'],
+            index_where=table.c.status.in_(SyncJob.ACTIVE_STATUSES)
+        )
+        return session.execute(statement).rowcount == 1
+
+    try:
+        with session.begin_nested():
+            session.execute(table.insert().values(**values))
+        return True
+    except IntegrityError:
+        return False
+
+
+class JobProgress:
+    """Collects progress reported by sync workers and writes it to the job row.
+
+    Progress arrives from several sync pool threads at once, so counters are
+    kept per instance under a lock and written through their own connection,
+    outside the sync's transaction, at most once per PROGRESS_INTERVAL.
+    Per-instance jobs claimed by a sync-all job are kept fresh with it.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.claims = {}
+        self.instances_total = 0
+        self.instances_done = 0
+        self._per_instance = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def __call__(self, instance_id, processed, written):
+        with self._lock:
+            self._per_instance[instance_id] = (processed, written)
+        self.flush()
+
+    def add_claim(self, instance_id, claim_id):
+        """Keep a claimed per-instance job fresh until the instance is done."""
+        with self._lock:
+            self.claims[instance_id] = claim_id
+
+    def pop_claim(self, instance_id):
+        """Stop tracking an instance's claimed job and return its ID, if any."""
+        with self._lock:
+            return self.claims.pop(instance_id, None)
+
+    def set_total(self, total):
+        self.instances_total = total
+        self.flush(force=True)
+
+    def instance_done(self):
+        with self._lock:
+            self.instances_done += 1
+        self.flush(force=True)
+
+    def flush(self, force=False):
+        """Write the aggregated counters to the sync_jobs table."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_flush < PROGRESS_INTERVAL:
+                return
+            self._last_flush = now
+            values = {
+                'sensors_processed': sum(p for p, _ in self._per_instance.values()),
+                'rows_written': sum(w for _, w in self._per_instance.values()),
+                'instances_total': self.instances_total,
+                'instances_done': self.instances_done,
+                'updated_at': datetime.utcnow()
+            }
+            claims = list(self.claims.values())
+
+        table = SyncJob.__table__
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.update().where(table.c.id == self.job_id).values(**values))
+                if claims:
+                    conn.execute(table.update().where(table.c.id.in_(claims)).values(
+                        updated_at=values['updated_at']))
+        except Exception as e:
+            logger.warning(f"Could not record progress for sync job {self.job_id}: {str(e)}")
+
+
+class SyncJobRunner:
+    """Starts agent syncs as background jobs and tracks them in the sync_jobs table.
+
+    Job bodies run on a small coordinator pool while the syncs themselves run
+    on the shared SyncScheduler pool, so the scheduler's concurrency limit
+    still applies. Starting a job while an identical one is queued or running
+    returns the existing job instead of starting a duplicate; a unique index
+    makes this hold across workers. A sync-all job claims the per-instance
+    job of every instance it syncs and skips instances already being synced.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.max_workers = DEFAULT_JOB_WORKERS
+        self.stale_after = DEFAULT_STALE_AFTER
+        self._executor = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the job runner to a Flask application and read its settings."""
+        self.app = app
+        self.max_workers = app.config.get('SYNC_JOB_WORKERS', DEFAULT_JOB_WORKERS)
+        self.stale_after = app.config.get('SYNC_JOB_STALE_AFTER', DEFAULT_STALE_AFTER)
+        app.extensions['sync_jobs'] = self
+
+    @property
+    def executor(self):
+        """Lazily create the coordinator pool."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='sync-job'
+                )
+            return self._executor
+
+    def start_sync_all(self, mode='auto'):
+        """Start a job syncing every active instance.
+
+        Returns:
+            tuple: (job, created) where created is False if an identical job was already running
+        """
+        return self._start('sync_all', 'sync_all', None, self._sync_all, mode)
+
+    def stream_sync_all(self, mode='auto', timeout=None):
+        """Claim a sync-all job that runs in the caller's thread instead of the pool.
+
+        The job and its per-instance claims are taken exactly as for a
+        background sync-all job, so a streamed sync cannot overlap a queued
+        or running one.
+
+        Returns:
+            tuple: (job, created, results) where results is a generator of
+            per-instance results that drives the sync, or None if an
+            identical job was already running
+        """
+        job, created = self._claim('sync_all', 'sync_all', None, status='running',
+                                   message='Streaming sync in progress')
+        if not created:
+            logger.info(f"Not streaming a sync of all instances, job {job.id} is already running")
+            return job, False, None
+
+        logger.info(f"Streaming sync job {job.id} (sync_all)")
+        return job, True, self._stream(job.id, mode, timeout)
+
+    def start_instance_sync(self, instance_id, mode='auto'):
+        """Start a job syncing a single instance.
+
+        Returns:
+            tuple: (job, created) where created is False if an identical job was already running
+        """
+        return self._start('sync_instance', f'sync_instance:{instance_id}', instance_id,
+                           self._sync_instances, [instance_id], mode)
+
+    def start_agent_sync(self, instance_id, agent_id):
+        """Start a job syncing a single agent.
+
+        Returns:
+            tuple: (job, created) where created is False if an identical job was already running
+        """
+        return self._start('sync_agent', f'sync_agent:{instance_id}:{agent_id}', instance_id,
+                           self._sync_agent, instance_id, agent_id)
+
+    def _start(self, job_type, dedupe_key, instance_id, body, *args):
+        job, created = self._claim(job_type, dedupe_key, instance_id)
+        if not created:
+            logger.info(f"Reusing running sync job {job.id} for {dedupe_key}")
+            return job, False
+
+        logger.info(f"Queued sync job {job.id} ({dedupe_key})")
+        self.executor.submit(self._run, job.id, body, *args)
+        return job, True
+
+    def _claim(self, job_type, dedupe_key, instance_id, status='queued', message=''):
+        """Insert a job holding a dedupe key, or find the active job that holds it.
+
+        Returns:
+            tuple: (job, created)
+        """
+        for _ in range(CLAIM_ATTEMPTS):
+            SyncJob.expire_stale(dedupe_key, self.stale_after)
+            now = datetime.utcnow()
+            values = {
+                'id': str(uuid.uuid4()),
+                'job_type': job_type,
+                'dedupe_key': dedupe_key,
+                'instance_id': instance_id,
+                'status': status,
+                'message': message,
+                'created_at': now,
+                'started_at': now if status == 'running' else None,
+                'updated_at': now
+            }
+            created = insert_unless_active(db.session, values)
+            db.session.commit()
+            if created:
+                return db.session.get(SyncJob, values['id']), True
+
+            existing = SyncJob.find_active(dedupe_key)
+            if existing:
+                return existing, False
+        raise RuntimeError(f"Could not claim sync job {dedupe_key}")
+
+    def _finish_claim(self, job_id, result):
+        """Record the result of an instance synced under a sync-all job's claim."""
+        table = SyncJob.__table__
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            conn.execute(table.update().where(table.c.id == job_id).values(
+                status='completed' if result.get('success') else 'failed',
+                message=result.get('message', ''),
+                results=json.dumps([result], default=str),
+                instances_total=1,
+                instances_done=1,
+                finished_at=now,
+                updated_at=now
+            ))
+
+    def _run(self, job_id, body, *args):
+        with self.app.app_context():
+            job = None
+            try:
+                job = db.session.get(SyncJob, job_id)
+                job.status = 'running'
+                job.started_at = datetime.utcnow()
+                db.session.commit()
+
+                progress = JobProgress(job_id)
+                results = body(progress, *args)
+                progress.flush(force=True)
+
+                succeeded = [result for result in results if result.get('success')]
+                db.session.refresh(job)
+                job.results = json.dumps(results, default=str)
+                job.status = 'failed' if results and not succeeded else 'completed'
+                job.message = f"Synced {len(succeeded)} of {len(results)} targets successfully"
+            except Exception as e:
+                logger.error(f"Sync job {job_id} failed: {str(e)}")
+                logger.debug(traceback.format_exc())
+                db.session.rollback()
+                job = db.session.get(SyncJob, job_id)
+                job.status = 'failed'
+                job.message = f"Error running sync job: {str(e)}"
+            finally:
+                if job is not None:
+                    job.finished_at = datetime.utcnow()
+                    db.session.commit()
+                db.session.remove()
+
+    def _stream(self, job_id, mode, timeout):
+        progress = JobProgress(job_id)
+        results = []
+        complete = False
+        try:
+            for result in self._iter_sync_all(progress, mode, timeout):
+                results.append(result)
+                yield result
+            complete = True
+        finally:
+            progress.flush(force=True)
+            self._finish_stream(job_id, results, complete)
+
+    def _finish_stream(self, job_id, results, complete):
+        """Record the outcome of a streamed sync-all job."""
+        succeeded = [result for result in results if result.get('success')]
+        if not complete:
+            status = 'failed'
+            message = f"Stream ended after {len(results)} targets, before every instance finished"
+        else:
+            status = 'failed' if results and not succeeded else 'completed'
+            message = f"Synced {len(succeeded)} of {len(results)} targets successfully"
+
+        table = SyncJob.__table__
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            conn.execute(table.update().where(table.c.id == job_id).values(
+                status=status,
+                message=message,
+                results=json.dumps(results, default=str),
+                finished_at=now,
+                updated_at=now
+            ))
+
+    def _sync_all(self, progress, mode):
+        return list(self._iter_sync_all(progress, mode))
+
+    def _iter_sync_all(self, progress, mode, timeout=None):
+        skipped = []
+        for instance in CBInstance.query.filter_by(is_active=True).all():
+            claim, created = self._claim('sync_instance', f'sync_instance:{instance.id}', instance.id,
+                                         status='running', message=f"Part of sync job {progress.job_id}")
+            if created:
+                progress.add_claim(instance.id, claim.id)
+            else:
+                skipped.append({
+                    'instance_id': instance.id,
+                    'instance_name': instance.name,
+                    'success': True,
+                    'skipped': True,
+                    'count': 0,
+                    'message': f"Already being synced by job {claim.id}"
+                })
+
+        try:
+            yield from skipped
+            yield from self._iter_sync_instances(progress, list(progress.claims), mode, timeout)
+        finally:
+            # Release the claims of instances that did not report a result
+            for instance_id in list(progress.claims):
+                self._finish_claim(progress.pop_claim(instance_id), {
+                    'instance_id': instance_id,
+                    'success': False,
+                    'message': 'Sync job ended before this instance finished'
+                })
+
+    def _sync_instances(self, progress, instance_ids, mode):
+        return list(self._iter_sync_instances(progress, instance_ids, mode))
+
+    def _iter_sync_instances(self, progress, instance_ids, mode, timeout=None):
+        instances = CBInstance.query.filter(CBInstance.id.in_(instance_ids)).all()
+        targets = [(instance.id, instance.name) for instance in instances]
+        progress.set_total(len(targets))
+
+        for result in sync_scheduler.sync_instances(targets, timeout=timeout, mode=mode, progress=progress):
+            claim_id = progress.pop_claim(result['instance_id'])
+            if claim_id:
+                self._finish_claim(claim_id, result)
+            progress.instance_done()
+            yield result
+
+    def _sync_agent(self, progress, instance_id, agent_id):
+        progress.set_total(1)
+
+        def sync_one():
+            instance = db.session.get(CBInstance, instance_id)
+            if not instance:
+                return {'success': False, 'message': f"Instance {instance_id} not found"}
+            return CBAPIHelper.sync_single_agent(instance, agent_id, db.session)
+
+        result = sync_scheduler.submit(sync_one).result()
+        result.update({'instance_id': instance_id, 'agent_id': agent_id})
+        progress(instance_id, 1, result.get('inserted', 0) + result.get('updated', 0))
+        progress.instance_done()
+        return [result]
+
+    def shutdown(self, wait=True):
+        """Stop the coordinator pool."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+# Process-wide job runner, bound to the app in create_app
+sync_jobs = SyncJobRunner()
@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ..models import CBInstance, db
+from .cb_api_helper import CBAPIHelper
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the app does not configure the scheduler
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_INSTANCE_TIMEOUT = 600
+DEFAULT_MAX_TIMEOUT = 3600
+
+# How often the result loop wakes up to check for timed out instances (seconds)
+POLL_INTERVAL = 1.0
+
+
+class SyncScheduler:
+    """Runs agent syncs for many Carbon Black instances on a bounded worker pool.
+
+    The pool is shared by the whole process, so its size is a global limit on
+    how many instances are synced at the same time. Every worker pushes its own
+    application context and therefore gets its own scoped database session.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.max_workers = DEFAULT_MAX_WORKERS
+        self.instance_timeout = DEFAULT_INSTANCE_TIMEOUT
+        self.max_timeout = DEFAULT_MAX_TIMEOUT
+        self._executor = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the scheduler to a Flask application and read its settings."""
+        self.app = app
+        self.max_workers = app.config.get('SYNC_MAX_WORKERS', DEFAULT_MAX_WORKERS)
+        self.instance_timeout = app.config.get('SYNC_INSTANCE_TIMEOUT', DEFAULT_INSTANCE_TIMEOUT)
+        self.max_timeout = app.config.get('SYNC_MAX_TIMEOUT', DEFAULT_MAX_TIMEOUT)
+        app.extensions['sync_scheduler'] = self
+
+    @property
+    def executor(self):
+        """Lazily create the shared worker pool."""
+        with self._lock:
+            if self._executor is None:
+                logger.info(f"Starting agent sync pool with {self.max_workers} workers")
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='agent-sync'
+                )
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Run a callable on the sync pool inside its own application context.
+
+        Args:
+            fn: Callable to execute
+            *args, **kwargs: Arguments passed to the callable
+
+        Returns:
+            Future: Future for the callable's result
+        """
+        return self.executor.submit(self._run_in_context, fn, *args, **kwargs)
+
+    def _run_in_context(self, fn, *args, **kwargs):
+        with self.app.app_context():
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                db.session.remove()
+
+    def sync_instance(self, instance_id, started=None, mode='auto', progress=None, cancel=None):
+        """Sync a single instance. Must be called inside an application context.
+
+        Args:
+            instance_id: ID of the CBInstance to sync
+            started: Optional dict in which the start time is recorded, keyed by instance ID
+            mode: Sync mode passed to CBAPIHelper.bulk_sync_agents
+            progress: Optional callable invoked as ``progress(instance_id, processed, written)``
+            cancel: Optional threading.Event; once set, the sync stops at its next
+                batch and rolls back instead of committing
+
+        Returns:
+            dict: Sync result including the instance ID, name and elapsed seconds
+        """
+        start_time = time.monotonic()
+        if started is not None:
+            started[instance_id] = start_time
+
+        result = {'instance_id': instance_id, 'instance_name': None}
+        try:
+            instance = db.session.get(CBInstance, instance_id)
+            if not instance:
+                result.update({'success': False, 'count': 0, 'message': f"Instance {instance_id} not found"})
+            else:
+                logger.info(f"Syncing agents for instance: {instance.name}")
+                result['instance_name'] = instance.name
+                instance_progress = None
+                if progress:
+                    def instance_progress(processed, written):
+                        progress(instance_id, processed, written)
+                result.update(CBAPIHelper.bulk_sync_agents(instance, db.session, mode=mode,
+                                                           progress=instance_progress, cancel=cancel))
+        except Exception as e:
+            logger.error(f"Unexpected error syncing instance {instance_id}: {str(e)}")
+            logger.debug(traceback.format_exc())
+            result.update({'success': False, 'count': 0, 'message': f"Error syncing agents: {str(e)}"})
+
+        result['elapsed'] = round(time.monotonic() - start_time, 3)
+        return result
+
+    def sync_instances(self, instances, timeout=None, mode='auto', progress=None):
+        """Sync several instances concurrently and yield each result as it finishes.
+
+        An instance whose sync runs longer than the timeout is reported as timed
+        out and cancelled. Python threads cannot be killed, so the sync only
+        stops at its next batch, rolling back what it has not committed; the
+        worker keeps its pool slot until then and its result is discarded.
+        A sync already past its last batch may still commit.
+
+        Args:
+            instances: Iterable of (instance_id, instance_name) tuples
+            timeout: Optional per-instance timeout in seconds, capped by SYNC_MAX_TIMEOUT
+            mode: Sync mode passed to CBAPIHelper.bulk_sync_agents
+            progress: Optional callable invoked as ``progress(instance_id, processed, written)``
+
+        Yields:
+            dict: Sync result for one instance
+        """
+        timeout = max(1, min(timeout or self.instance_timeout, self.max_timeout))
+        started = {}
+        futures = {}
+        cancels = {}
+
+        for instance_id, instance_name in instances:
+            cancels[instance_id] = threading.Event()
+            future = self.submit(self.sync_instance, instance_id, started, mode, progress, cancels[instance_id])
+            futures[future] = (instance_id, instance_name)
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                instance_id, instance_name = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {
+                        'instance_id': instance_id,
+                        'success': False,
+                        'count': 0,
+                        'message': f"Error syncing agents: {str(e)}"
+                    }
+                result['instance_name'] = result.get('instance_name') or instance_name
+                yield result
+
+            now = time.monotonic()
+            for future in list(pending):
+                instance_id, instance_name = futures[future]
+                start_time = started.get(instance_id)
+                if start_time is not None and now - start_time > timeout:
+                    logger.warning(f"Agent sync for {instance_name} timed out after {timeout} seconds, cancelling")
+                    cancels[instance_id].set()
+                    pending.discard(future)
+                    yield {
+                        'instance_id': instance_id,
+                        'instance_name': instance_name,
+                        'success': False,
+                        'timed_out': True,
+                        'cancelled': True,
+                        'count': 0,
+                        'message': (f"Sync timed out after {timeout} seconds and was cancelled; "
+                                    f"it stops at its next batch without committing"),
+                        'elapsed': round(now - start_time, 3)
+                    }
+
+    def shutdown(self, wait=True):
+        """Stop the worker pool."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+# Process-wide scheduler, bound to the app in create_app
+sync_scheduler = SyncScheduler()
@@ -5,6 +5,16 @@ from flask import Flask, jsonify, request
 from flask_cors import CORS
 from config import config
 from api.models import db, ma
+from api.utils.client_registry import cb_clients
+from api.utils.sync_scheduler import sync_scheduler
+from api.utils.sync_jobs import sync_jobs
+from api.utils.license_snapshots import license_snapshots
+from api.utils.response_cache import dashboard_cache, agent_facet_cache
+from api.utils.passthrough_cache import cbapi_cache
+from api.utils.agent_search import install_search_index
+from api.utils.audit_writer import audit_writer
+from api.utils.audit_partitions import audit_partitions
+from api.utils.health_probe import health_probe
 
 # Import blueprints conditionally to avoid crashing on missing modules
 try:
@@ -14,6 +24,8 @@ try:
     from api.routes.cb_users_routes import cb_users_bp
     from api.routes.import_routes import import_bp
     from api.routes.auth_routes import auth_bp
+    from api.routes.job_routes import job_bp
+    from api.routes.metrics_routes import metrics_bp
     from frontend.routes import frontend_bp
     from api.routes import api_bp
     
@@ -29,6 +41,8 @@ try:
         'cb_users_bp': cb_users_bp,
         'import_bp': import_bp,
         'auth_bp': auth_bp,
+        'job_bp': job_bp,
+        'metrics_bp': metrics_bp,
         'frontend_bp': frontend_bp,
         'api_bp': api_bp
     }
@@ -87,6 +101,16 @@ def create_app(config_name='default'):
     # Initialize extensions
     db.init_app(app)
     ma.init_app(app)
+    cb_clients.init_app(app)
+    sync_scheduler.init_app(app)
+    sync_jobs.init_app(app)
+    license_snapshots.init_app(app)
+    dashboard_cache.init_app(app)
+    agent_facet_cache.init_app(app)
+    cbapi_cache.init_app(app)
+    audit_writer.init_app(app)
+    audit_partitions.init_app(app)
+    health_probe.init_app(app)
     
     # Register blueprints
     for blueprint_name, blueprint in available_blueprints.items():
@@ -113,6 +137,8 @@ def create_app(config_name='default'):
                 'instances': '/api/instances',
                 'agents': '/api/agents',
                 'sync': '/api/sync',
+                'jobs': '/api/jobs',
+                'metrics': '/api/metrics',
                 'dashboard': '/api/dashboard',
                 'cbapi': '/api/cbapi',
                 'cb-users': '/api/cb-users',
@@ -142,6 +168,14 @@ def create_app(config_name='default'):
     with app.app_context():
         app.logger.info("Creating database tables if they don't exist")
         db.create_all()
+        
+        # SQLite's FTS5 search table is cheap to set up; PostgreSQL's search
+        # indexes are built by migrate_add_agent_search.py
+        if db.engine.dialect.name == 'sqlite':
+            try:
+                install_search_index(db.engine)
+            except Exception as e:
+                app.logger.warning(f"Could not set up agent search index: {str(e)}")
     
     return app
 
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Benchmark the agents table indexes with EXPLAIN ANALYZE.
+
+Runs the queries the console actually issues against the agents table,
+each once with all indexes in place and once with the index that is meant
+to serve it dropped (inside a transaction that is rolled back), and prints
+the plan and timings of both. PostgreSQL only.
+
+Dropping an index takes an exclusive lock on the agents table for the
+duration of one query, so run this against a copy of production data.
+
+Usage: python benchmark_agent_indexes.py [--runs 5] [--instance ID]
+"""
+
+import sys
+import json
+import argparse
+import logging
+import statistics
+from app import create_app
+from sqlalchemy import func, select
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+# Rows fetched per keyset page, as in the agent endpoints (limit + 1)
+PAGE_ROWS = 101
+
+def benchmark_cases(db, sample):
+    """The console's agents queries and the index meant to serve each one."""
+    from api.models import Agent
+    from api.routes.agent_routes import filter_agents
+    from api.utils.agent_sync import COMPARED_FIELDS
+    from api.utils.dashboard_stats import agent_conditions, status_condition
+
+    instance_id = sample['instance_id']
+    by_key = (Agent.instance_id, Agent.id)
+
+    cases = [
+        ('Agent list page for an instance', 'ix_agents_instance_id_id',
+         filter_agents(Agent.query, {'instance_id': instance_id}).order_by(*by_key).limit(PAGE_ROWS)),
+        ('Sync preload of an instance', 'ix_agents_instance_id_id',
+         db.session.query(Agent.id, *[getattr(Agent, field) for field in COMPARED_FIELDS]).filter(
+             Agent.instance_id == instance_id)),
+        ('Status filter within an instance', 'ix_agents_instance_id_status',
+         filter_agents(Agent.query, {'instance_id': instance_id, 'status': sample['status']}).order_by(
+             *by_key).limit(PAGE_ROWS)),
+        ('Dashboard counters for an instance', 'ix_agents_instance_id_status',
+         select(func.count(), func.count().filter(status_condition('Connected'))).select_from(Agent).where(
+             *agent_conditions(instance_id))),
+        ('Hostname sorted page', 'ix_agents_hostname_instance_id_id',
+         Agent.query.order_by(Agent.hostname, *by_key).limit(PAGE_ROWS)),
+        ('OS filter page', 'ix_agents_os_instance_id_id',
+         filter_agents(Agent.query, {'os_type': sample['os']}).order_by(*by_key).limit(PAGE_ROWS)),
+        ('Version sorted page', 'ix_agents_version_instance_id_id',
+         Agent.query.order_by(Agent.version, *by_key).limit(PAGE_ROWS)),
+    ]
+
+    if sample['group']:
+        cases.append(('Group filter page', 'ix_agents_groups',
+                      filter_agents(Agent.query, {'group': sample['group']}).order_by(*by_key).limit(PAGE_ROWS)))
+
+    return cases
+
+def sample_values(db, instance_id=None):
+    """Pick realistic filter values: the largest instance and its most common values."""
+    from api.models import Agent
+
+    def most_common(column, *conditions):
+        row = db.session.query(column, func.count()).filter(*conditions).group_by(column).order_by(
+            func.count().desc()).first()
+        return row[0] if row else None
+
+    instance_id = instance_id or most_common(Agent.instance_id)
+    group = db.session.execute(select(func.unnest(Agent.groups)).limit(1)).scalar()
+
+    return {
+        'instance_id': instance_id,
+        'status': most_common(Agent.status, Agent.instance_id == instance_id),
+        'os': most_common(Agent.os),
+        'group': group
+    }
+
+def summarize_plan(node):
+    """Flatten a JSON plan into 'Node Type [index]' steps."""
+    step = node['Node Type']
+    if node.get('Index Name'):
+        step += f" [{node['Index Name']}]"
+    steps = [step]
+    for child in node.get('Plans', []):
+        steps.extend(summarize_plan(child))
+    return steps
+
+def explain(conn, statement, runs):
+    """EXPLAIN ANALYZE a statement several times; return the plan and median timings."""
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={'render_postcompile': True})
+    timings = []
+    plan = None
+    for _ in range(runs):
+        result = conn.exec_driver_sql(
+            f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {compiled}', compiled.params
+        ).scalar()
+        if isinstance(result, str):
+            result = json.loads(result)
+        plan = result[0]
+        timings.append(plan['Execution Time'])
+
+    root = plan['Plan']
+    return {
+        'plan': ' > '.join(summarize_plan(root)),
+        'ms': statistics.median(timings),
+        'buffers': root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0)
+    }
+
+def run_benchmark(app, runs, instance_id=None):
+    """Run every case with and without its index and print a report."""
+    with app.app_context():
+        from api.models.base import db
+
+        if db.engine.dialect.name != 'postgresql':
+            raise RuntimeError("The index benchmark needs PostgreSQL")
+
+        sample = sample_values(db, instance_id)
+        logger.info(f"Benchmarking with sample values {sample}")
+
+        for name, index, query in benchmark_cases(db, sample):
+            statement = getattr(query, 'statement', query)
+
+            with db.engine.connect() as conn:
+                with_index = explain(conn, statement, runs)
+                conn.rollback()
+
+                # Same query with its index dropped; rolled back afterwards
+                trans = conn.begin()
+                try:
+                    conn.exec_driver_sql(f'DROP INDEX IF EXISTS {index}')
+                    without_index = explain(conn, statement, runs)
+                finally:
+                    trans.rollback()
+
+            speedup = without_index['ms'] / with_index['ms'] if with_index['ms'] else float('inf')
+            print(f"\n{name} ({index})")
+            print(f"  with index:    {with_index['ms']:9.2f} ms  {with_index['buffers']:8d} buffers  {with_index['plan']}")
+            print(f"  without index: {without_index['ms']:9.2f} ms  {without_index['buffers']:8d} buffers  {without_index['plan']}")
+            print(f"  speedup:       {speedup:9.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the agents table indexes with EXPLAIN ANALYZE')
+    parser.add_argument('--runs', type=int, default=5, help='Runs per query; the median is reported')
+    parser.add_argument('--instance', type=str, default=None, help='Instance ID to filter on (default: largest)')
+    args = parser.parse_args()
+
+    try:
+        run_benchmark(create_app(), max(1, args.runs), args.instance)
+    except Exception as e:
+        logger.error(f"Error during index benchmark: {str(e)}")
+        sys.exit(1)
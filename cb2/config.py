@@ -16,6 +16,76 @@ class Config:
     # Application configs
     APP_NAME = "Carbon Black Multi-Tenant Console"
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    
+    # Carbon Black API client configs
+    CB_CLIENT_IDLE_TIMEOUT = int(os.getenv('CB_CLIENT_IDLE_TIMEOUT', 900))
+    CB_CLIENT_POOL_MAXSIZE = int(os.getenv('CB_CLIENT_POOL_MAXSIZE', 10))
+    
+    # Agent sync configs
+    AGENT_SYNC_BATCH_SIZE = int(os.getenv('AGENT_SYNC_BATCH_SIZE', 1000))
+    SYNC_MAX_WORKERS = int(os.getenv('SYNC_MAX_WORKERS', 4))
+    SYNC_INSTANCE_TIMEOUT = int(os.getenv('SYNC_INSTANCE_TIMEOUT', 600))
+    SYNC_MAX_TIMEOUT = int(os.getenv('SYNC_MAX_TIMEOUT', 3600))  # upper bound for ?timeout
+    AGENT_FULL_SYNC_INTERVAL = int(os.getenv('AGENT_FULL_SYNC_INTERVAL', 86400))
+    SYNC_JOB_WORKERS = int(os.getenv('SYNC_JOB_WORKERS', 2))
+    SYNC_JOB_STALE_AFTER = int(os.getenv('SYNC_JOB_STALE_AFTER', 1800))
+    SENSOR_COUNT_MAX_AGE = int(os.getenv('SENSOR_COUNT_MAX_AGE', 3600))
+    
+    # License aggregation configs
+    LICENSE_FETCH_TIMEOUT = int(os.getenv('LICENSE_FETCH_TIMEOUT', 15))
+    LICENSE_FETCH_WORKERS = int(os.getenv('LICENSE_FETCH_WORKERS', 8))
+    LICENSE_SNAPSHOT_TTL = int(os.getenv('LICENSE_SNAPSHOT_TTL', 3600))
+    LICENSE_SNAPSHOT_MAX_STALE = int(os.getenv('LICENSE_SNAPSHOT_MAX_STALE', 604800))
+    LICENSE_REFRESH_INTERVAL = int(os.getenv('LICENSE_REFRESH_INTERVAL', 900))
+    LICENSE_AGENT_REMOTE_LIMIT = int(os.getenv('LICENSE_AGENT_REMOTE_LIMIT', 200))
+    
+    # Dashboard rollup configs
+    ROLLUP_HOURLY_RETENTION_HOURS = int(os.getenv('ROLLUP_HOURLY_RETENTION_HOURS', 48))
+    ROLLUP_DAILY_RETENTION_DAYS = int(os.getenv('ROLLUP_DAILY_RETENTION_DAYS', 400))
+    
+    # Dashboard response cache configs
+    DASHBOARD_CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', 60))
+    DASHBOARD_CACHE_MAX_ENTRIES = int(os.getenv('DASHBOARD_CACHE_MAX_ENTRIES', 256))
+    DASHBOARD_CACHE_BACKEND = os.getenv('DASHBOARD_CACHE_BACKEND', 'memory')
+    DASHBOARD_CACHE_URL = os.getenv('DASHBOARD_CACHE_URL', '')
+    
+    # Agent filter options cache configs
+    AGENT_FACET_CACHE_TTL = int(os.getenv('AGENT_FACET_CACHE_TTL', 600))
+    AGENT_FACET_CACHE_MAX_ENTRIES = int(os.getenv('AGENT_FACET_CACHE_MAX_ENTRIES', 256))
+    AGENT_FACET_CACHE_BACKEND = os.getenv('AGENT_FACET_CACHE_BACKEND', 'memory')
+    AGENT_FACET_CACHE_URL = os.getenv('AGENT_FACET_CACHE_URL', '')
+    
+    # CB API passthrough cache configs
+    CBAPI_CACHE_TTL = int(os.getenv('CBAPI_CACHE_TTL', 30))  # For endpoints without a rule
+    CBAPI_CACHE_MAX_ENTRIES = int(os.getenv('CBAPI_CACHE_MAX_ENTRIES', 4096))
+    CBAPI_CACHE_MAX_BYTES = int(os.getenv('CBAPI_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    CBAPI_CACHE_BACKEND = os.getenv('CBAPI_CACHE_BACKEND', 'memory')
+    CBAPI_CACHE_URL = os.getenv('CBAPI_CACHE_URL', '')
+    CBAPI_CACHE_RULES = os.getenv('CBAPI_CACHE_RULES', '')  # prefix=seconds,... overriding the defaults
+    
+    # CB API batch execution configs
+    CBAPI_BATCH_MAX_ITEMS = int(os.getenv('CBAPI_BATCH_MAX_ITEMS', 500))
+    CBAPI_BATCH_WORKERS = int(os.getenv('CBAPI_BATCH_WORKERS', 8))
+    CBAPI_BATCH_TIMEOUT = int(os.getenv('CBAPI_BATCH_TIMEOUT', 30))
+    CBAPI_STREAM_PAGE_SIZE = int(os.getenv('CBAPI_STREAM_PAGE_SIZE', 500))
+    
+    # Audit log writer configs
+    AUDIT_WRITE_MODE = os.getenv('AUDIT_WRITE_MODE', '')  # async or sync; empty picks sync when TESTING
+    AUDIT_BUFFER_SIZE = int(os.getenv('AUDIT_BUFFER_SIZE', 10000))
+    AUDIT_FLUSH_SIZE = int(os.getenv('AUDIT_FLUSH_SIZE', 200))
+    AUDIT_FLUSH_INTERVAL = int(os.getenv('AUDIT_FLUSH_INTERVAL', 2))
+    
+    # Audit log partitioning and retention configs
+    AUDIT_PARTITION_PREMAKE_MONTHS = int(os.getenv('AUDIT_PARTITION_PREMAKE_MONTHS', 3))
+    AUDIT_RETENTION_MONTHS = int(os.getenv('AUDIT_RETENTION_MONTHS', 0))  # 0 keeps everything
+    AUDIT_MAINTENANCE_INTERVAL = int(os.getenv('AUDIT_MAINTENANCE_INTERVAL', 3600))
+    AUDIT_ARCHIVE_DIR = os.getenv('AUDIT_ARCHIVE_DIR', '')  # absolute path, required for retention
+    AUDIT_RETENTION_PLAIN_TABLE = os.getenv('AUDIT_RETENTION_PLAIN_TABLE', 'False').lower() in ('true', '1', 't')
+    
+    # Instance health probe configs
+    HEALTH_PROBE_INTERVAL = int(os.getenv('HEALTH_PROBE_INTERVAL', 300))
+    HEALTH_PROBE_TIMEOUT = int(os.getenv('HEALTH_PROBE_TIMEOUT', 10))
+    HEALTH_PROBE_WORKERS = int(os.getenv('HEALTH_PROBE_WORKERS', 16))
 
 
 class DevelopmentConfig(Config):
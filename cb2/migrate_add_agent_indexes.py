@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import sys
+import logging
+from app import create_app
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+def add_agent_indexes(app):
+    """Create the indexes declared on the Agent model if they don't exist.
+
+    On PostgreSQL the indexes are built CONCURRENTLY, so syncs and the
+    console keep writing to and reading from the agents table meanwhile.
+    See benchmark_agent_indexes.py for the queries each index serves.
+    """
+    with app.app_context():
+        from api.models.base import db
+        from api.models import Agent
+
+        # Find which indexes are missing
+        inspector = inspect(db.engine)
+        existing = {index['name'] for index in inspector.get_indexes('agents')}
+        # Skip indexes declared for another dialect (the PostgreSQL-only GIN index)
+        dialect = db.engine.dialect.name
+        missing = [index for index in sorted(Agent.__table__.indexes, key=lambda index: index.name)
+                   if index.name not in existing
+                   and (index._ddl_if is None or index._ddl_if.dialect in (None, dialect))]
+
+        if not missing:
+            logger.info("Agent indexes already exist. No migration needed.")
+            return
+
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+        engine = db.engine.execution_options(isolation_level='AUTOCOMMIT')
+        concurrently = db.engine.dialect.name == 'postgresql'
+
+        with engine.connect() as conn:
+            for index in missing:
+                statement = str(CreateIndex(index, if_not_exists=True).compile(dialect=db.engine.dialect))
+                if concurrently:
+                    statement = statement.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1)
+
+                logger.info(f"Creating index {index.name}...")
+                try:
+                    conn.exec_driver_sql(statement)
+                except Exception as e:
+                    logger.error(f"Error creating index {index.name}: {str(e)}")
+                    if concurrently:
+                        # A failed concurrent build leaves an INVALID index behind
+                        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+                    raise
+
+        # Refresh planner statistics so the new indexes are picked up
+        if concurrently:
+            with engine.connect() as conn:
+                conn.exec_driver_sql("ANALYZE agents")
+
+        logger.info(f"Successfully created {len(missing)} agent indexes")
+
+if __name__ == "__main__":
+    logger.info("Starting database migration process...")
+
+    try:
+        # Create the Flask app
+        app = create_app()
+
+        # Add agent indexes if they don't exist
+        add_agent_indexes(app)
+
+        logger.info("Database migration completed successfully!")
+    except Exception as e:
+        logger.error(f"Error during database migration: {str(e)}")
+        sys.exit(1)
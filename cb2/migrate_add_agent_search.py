@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import sys
+import logging
+from app import create_app
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+def add_agent_search_index(app):
+    """Create the agent search index if it doesn't exist.
+
+    On PostgreSQL this enables pg_trgm and builds trigram GIN indexes over the
+    searchable agent columns, which needs a role allowed to create extensions.
+    On SQLite it creates the FTS5 search table and its triggers.
+    """
+    with app.app_context():
+        from api.models.base import db
+        from api.utils.agent_search import install_search_index
+
+        logger.info(f"Creating agent search index on {db.engine.dialect.name}...")
+        backend = install_search_index(db.engine)
+
+        if backend == 'like':
+            raise RuntimeError("Agent search index could not be created")
+        logger.info(f"Agent search is using the {backend} index")
+
+if __name__ == "__main__":
+    logger.info("Starting database migration process...")
+
+    try:
+        # Create the Flask app
+        app = create_app()
+
+        # Build the agent search index if it doesn't exist
+        add_agent_search_index(app)
+
+        logger.info("Database migration completed successfully!")
+    except Exception as e:
+        logger.error(f"Error during database migration: {str(e)}")
+        sys.exit(1)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import sys
+import logging
+from app import create_app
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+def add_audit_rollups(app):
+    """Create the hourly audit log rollups table and fill it from audit_logs.
+
+    The audit writer keeps the rollups up to date from then on. Safe to run
+    again: it recomputes every rollup. On PostgreSQL audit log writes wait
+    while the rollups are rebuilt.
+    """
+    with app.app_context():
+        from api.models import AuditLogRollup
+        from api.models.base import db
+        from api.utils.audit_rollups import rebuild_audit_rollups
+
+        logger.info("Creating audit_log_rollups table if it doesn't exist...")
+        AuditLogRollup.__table__.create(db.engine, checkfirst=True)
+
+        logger.info("Rebuilding audit log rollups from audit_logs...")
+        with db.engine.begin() as conn:
+            written = rebuild_audit_rollups(conn)
+        logger.info(f"Wrote {written} hourly audit log rollups")
+
+if __name__ == "__main__":
+    logger.info("Starting database migration process...")
+
+    try:
+        # Create the Flask app
+        app = create_app()
+
+        # Create and backfill the audit log rollups
+        add_audit_rollups(app)
+
+        logger.info("Database migration completed successfully!")
+    except Exception as e:
+        logger.error(f"Error during database migration: {str(e)}")
+        sys.exit(1)
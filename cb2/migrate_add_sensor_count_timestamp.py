@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import sys
+import logging
+from app import create_app
+from sqlalchemy import text, inspect
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+def add_sensor_count_timestamp(app):
+    """Add the sensors_counted_at column to the instances table if it doesn't exist"""
+    with app.app_context():
+        from api.models.base import db
+
+        inspector = inspect(db.engine)
+        existing = {column['name'] for column in inspector.get_columns('instances')}
+
+        if 'sensors_counted_at' in existing:
+            logger.info("sensors_counted_at column already exists in instances table. No migration needed.")
+            return
+
+        conn = db.engine.connect()
+        try:
+            logger.info("Adding sensors_counted_at column to instances table...")
+            conn.execute(text("ALTER TABLE instances ADD COLUMN sensors_counted_at TIMESTAMP WITH TIME ZONE"))
+
+            # Commit the transaction
+            conn.commit()
+            logger.info("Successfully added sensors_counted_at column to instances table")
+        except Exception as e:
+            logger.error(f"Error adding sensors_counted_at column: {str(e)}")
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    logger.info("Starting database migration process...")
+
+    try:
+        # Create the Flask app
+        app = create_app()
+
+        # Add the sensor count timestamp column if it doesn't exist
+        add_sensor_count_timestamp(app)
+
+        logger.info("Database migration completed successfully!")
+    except Exception as e:
+        logger.error(f"Error during database migration: {str(e)}")
+        sys.exit(1)
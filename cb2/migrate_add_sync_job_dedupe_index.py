@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import sys
+import logging
+from datetime import datetime
+from app import create_app
+from sqlalchemy import text, inspect
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+def add_sync_job_dedupe_index(app):
+    """Add the partial unique index on the dedupe keys of active sync jobs if it doesn't exist"""
+    with app.app_context():
+        from api.models.base import db
+
+        inspector = inspect(db.engine)
+        if 'sync_jobs' not in inspector.get_table_names():
+            logger.info("sync_jobs table does not exist yet, it is created with the index. No migration needed.")
+            return
+
+        existing = {index['name'] for index in inspector.get_indexes('sync_jobs')}
+        if 'uq_sync_jobs_active_dedupe_key' in existing:
+            logger.info("uq_sync_jobs_active_dedupe_key index already exists. No migration needed.")
+            return
+
+        conn = db.engine.connect()
+        try:
+            # Older duplicates of an active job would violate the index
+            logger.info("Failing duplicate active sync jobs...")
+            result = conn.execute(text(
+                "UPDATE sync_jobs SET status = 'failed', message = 'Duplicate of a newer sync job', "
+                "finished_at = :now "
+                "WHERE status IN ('queued', 'running') AND EXISTS ("
+                "SELECT 1 FROM sync_jobs newer WHERE newer.dedupe_key = sync_jobs.dedupe_key "
+                "AND newer.status IN ('queued', 'running') AND newer.created_at > sync_jobs.created_at)"
+            ), {'now': datetime.utcnow()})
+            logger.info(f"Failed {result.rowcount} duplicate sync jobs")
+
+            logger.info("Adding uq_sync_jobs_active_dedupe_key index to sync_jobs table...")
+            conn.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_sync_jobs_active_dedupe_key ON sync_jobs (dedupe_key) "
+                "WHERE status IN ('queued', 'running')"
+            ))
+
+            # Commit the transaction
+            conn.commit()
+            logger.info("Successfully added uq_sync_jobs_active_dedupe_key index")
+        except Exception as e:
+            logger.error(f"Error adding sync job dedupe index: {str(e)}")
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    logger.info("Starting database migration process...")
+
+    try:
+        # Create the Flask app
+        app = create_app()
+
+        # Add the sync job dedupe index if it doesn't exist
+        add_sync_job_dedupe_index(app)
+
+        logger.info("Database migration completed successfully!")
+    except Exception as e:
+        logger.error(f"Error during database migration: {str(e)}")
+        sys.exit(1)
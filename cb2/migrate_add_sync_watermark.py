@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import sys
+import logging
+from app import create_app
+from sqlalchemy import text, inspect
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+# Columns used by incremental agent sync
+SYNC_COLUMNS = {
+    'sync_watermark': 'TIMESTAMP WITH TIME ZONE',
+    'last_full_sync': 'TIMESTAMP WITH TIME ZONE'
+}
+
+def add_sync_watermark_columns(app):
+    """Add incremental sync columns to the instances table if they don't exist"""
+    with app.app_context():
+        from api.models.base import db
+
+        # Find which columns are missing
+        inspector = inspect(db.engine)
+        existing = {column['name'] for column in inspector.get_columns('instances')}
+        missing = [name for name in SYNC_COLUMNS if name not in existing]
+
+        if not missing:
+            logger.info("Sync watermark columns already exist in instances table. No migration needed.")
+            return
+
+        conn = db.engine.connect()
+        try:
+            for name in missing:
+                logger.info(f"Adding {name} column to instances table...")
+                conn.execute(text(f"ALTER TABLE instances ADD COLUMN {name} {SYNC_COLUMNS[name]}"))
+
+            # Commit the transaction
+            conn.commit()
+            logger.info("Successfully added sync watermark columns to instances table")
+        except Exception as e:
+            logger.error(f"Error adding sync watermark columns: {str(e)}")
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    logger.info("Starting database migration process...")
+
+    try:
+        # Create the Flask app
+        app = create_app()
+
+        # Add sync watermark columns if they don't exist
+        add_sync_watermark_columns(app)
+
+        logger.info("Database migration completed successfully!")
+    except Exception as e:
+        logger.error(f"Error during database migration: {str(e)}")
+        sys.exit(1)
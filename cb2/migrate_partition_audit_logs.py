@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import sys
+import logging
+from datetime import datetime
+from app import create_app
+from sqlalchemy import text
+from api.utils.audit_writer import AUDIT_COLUMNS
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+# Indexes of the partitioned table; created on the parent, so every partition gets them
+AUDIT_INDEXES = {
+    'ix_audit_logs_timestamp': 'timestamp',
+    'ix_audit_logs_action': 'action',
+    'ix_audit_logs_resource_type': 'resource_type',
+    'ix_audit_logs_resource_id': 'resource_id'
+}
+
+def partition_audit_logs(app):
+    """Convert audit_logs into a table range partitioned by month on timestamp.
+
+    Runs in one transaction: the existing table is renamed, a partitioned
+    audit_logs takes its place with a partition for every month that has
+    rows plus the upcoming months and a default partition, the rows are
+    copied over and the old table is dropped. The id sequence is kept. The
+    primary key becomes (id, timestamp), as PostgreSQL requires the
+    partition key in every unique constraint.
+    """
+    with app.app_context():
+        from api.models.base import db
+        from api.utils.audit_partitions import (
+            is_partitioned, month_start, add_months, create_partition, DEFAULT_PARTITION
+        )
+
+        if db.engine.dialect.name != 'postgresql':
+            logger.info("Audit log partitioning needs PostgreSQL. No migration needed.")
+            return
+
+        with db.engine.begin() as conn:
+            if is_partitioned(conn):
+                logger.info("audit_logs is already partitioned. No migration needed.")
+                return
+
+            # Block audit writes for the duration; the buffered writer retries
+            conn.execute(text("LOCK TABLE audit_logs IN ACCESS EXCLUSIVE MODE"))
+            sequence = conn.execute(text("SELECT pg_get_serial_sequence('audit_logs', 'id')")).scalar()
+            oldest = conn.execute(text("SELECT min(timestamp) FROM audit_logs")).scalar()
+
+            logger.info("Creating partitioned audit_logs table...")
+            conn.execute(text("ALTER TABLE audit_logs RENAME TO audit_logs_legacy"))
+            conn.execute(text(
+                "CREATE TABLE audit_logs (LIKE audit_logs_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)"
+            ))
+            conn.execute(text("ALTER TABLE audit_logs ALTER COLUMN timestamp SET NOT NULL"))
+            conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF audit_logs DEFAULT"))
+
+            # One partition per month from the oldest row up to the premade months
+            premake = app.config.get('AUDIT_PARTITION_PREMAKE_MONTHS', 3)
+            last = add_months(month_start(datetime.utcnow()), premake)
+            month = month_start(oldest) if oldest else month_start(datetime.utcnow())
+            while month <= last:
+                create_partition(conn, month)
+                month = add_months(month, 1)
+
+            logger.info("Copying audit logs into partitions...")
+            # Ids are kept; rows without a timestamp are stamped with the current time
+            copy_columns = ('id',) + AUDIT_COLUMNS
+            columns = ', '.join(copy_columns)
+            values = ', '.join(
+                "coalesce(timestamp, now() AT TIME ZONE 'utc')" if column == 'timestamp' else column
+                for column in copy_columns
+            )
+            copied = conn.execute(text(
+                f"INSERT INTO audit_logs ({columns}) SELECT {values} FROM audit_logs_legacy"
+            )).rowcount
+
+            # Keep the id sequence alive when the old table goes
+            if sequence:
+                conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY audit_logs.id"))
+            conn.execute(text("DROP TABLE audit_logs_legacy"))
+
+            # Added once the old table and its constraint names are gone
+            conn.execute(text("ALTER TABLE audit_logs ADD PRIMARY KEY (id, timestamp)"))
+            for name, column in AUDIT_INDEXES.items():
+                conn.execute(text(f"CREATE INDEX {name} ON audit_logs ({column})"))
+
+            logger.info(f"Successfully partitioned audit_logs ({copied} rows)")
+
+if __name__ == "__main__":
+    logger.info("Starting database migration process...")
+
+    try:
+        # Create the Flask app
+        app = create_app()
+
+        # Partition audit_logs if it isn't already
+        partition_audit_logs(app)
+
+        logger.info("Database migration completed successfully!")
+    except Exception as e:
+        logger.error(f"Error during database migration: {str(e)}")
+        sys.exit(1)